@@ -1,5 +1,9 @@
 import os
+import sys
 import unittest
+import threading
+import timeit
+import numpy
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
@@ -36,6 +40,9 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
 
     self.logic = ScreenCaptureLogic()
     self.logic.logCallback = self.addLog
+    self.logic.progressCallback = self.setProgress
+    # Runs the capture in progress (CaptureJobRunner)
+    self.captureJobRunner = None
 
     # Instantiate and connect widgets ...
 
@@ -59,6 +66,33 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     self.viewNodeSelector.setToolTip( "Contents of this slice or 3D view will be captured." )
     inputFormLayout.addRow("View to capture: ", self.viewNodeSelector)
 
+    # Additional views selector
+    self.additionalViewNodesSelector = slicer.qMRMLCheckableNodeComboBox()
+    self.additionalViewNodesSelector.nodeTypes = ["vtkMRMLSliceNode", "vtkMRMLViewNode"]
+    self.additionalViewNodesSelector.addEnabled = False
+    self.additionalViewNodesSelector.removeEnabled = False
+    self.additionalViewNodesSelector.noneEnabled = False
+    self.additionalViewNodesSelector.showHidden = False
+    self.additionalViewNodesSelector.showChildNodeTypes = False
+    self.additionalViewNodesSelector.setMRMLScene( slicer.mrmlScene )
+    self.additionalViewNodesSelector.setToolTip( "Views that are captured together with the main view and"
+      " combined into a mosaic image. Slice views are swept through their entire range,"
+      " 3D views are rotated the same way as the main view." )
+    inputFormLayout.addRow("Additional views: ", self.additionalViewNodesSelector)
+
+    # Sequence browser selector
+    self.sequenceBrowserNodeSelector = slicer.qMRMLNodeComboBox()
+    self.sequenceBrowserNodeSelector.nodeTypes = ["vtkMRMLSequenceBrowserNode"]
+    self.sequenceBrowserNodeSelector.addEnabled = False
+    self.sequenceBrowserNodeSelector.removeEnabled = False
+    self.sequenceBrowserNodeSelector.noneEnabled = True
+    self.sequenceBrowserNodeSelector.showHidden = False
+    self.sequenceBrowserNodeSelector.showChildNodeTypes = False
+    self.sequenceBrowserNodeSelector.setMRMLScene( slicer.mrmlScene )
+    self.sequenceBrowserNodeSelector.setToolTip( "If a sequence browser is selected then views are captured"
+      " at each time point of the sequence (from the first to the last item) instead of sweeping or rotating them." )
+    inputFormLayout.addRow("Sequence: ", self.sequenceBrowserNodeSelector)
+
     #
     # Slice view options area
     #
@@ -85,6 +119,13 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     self.endSliceOffsetSliderWidget.setToolTip("End slice offset.")
     sliceViewOptionsLayout.addRow("End offset:", self.endSliceOffsetSliderWidget)
 
+    # Native resolution
+    self.nativeResolutionCheckBox = qt.QCheckBox(" ")
+    self.nativeResolutionCheckBox.checked = False
+    self.nativeResolutionCheckBox.setToolTip("If checked, each slice of the volume between start and end offset is captured"
+      " exactly once, at voxel centers. Number of images is determined by the volume.")
+    sliceViewOptionsLayout.addRow("Native resolution:", self.nativeResolutionCheckBox)
+
     #
     # 3D view options area
     #
@@ -111,6 +152,15 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     self.endRotationSliderWidget.setToolTip("Rotation angle for the last image, relative to current orientation.")
     threeDViewOptionsLayout.addRow("End rotation angle:", self.endRotationSliderWidget)
 
+    # Rotation axis
+    self.rotationAxisSelector = qt.QComboBox()
+    self.rotationAxisSelector.addItem("Yaw", "yaw")
+    self.rotationAxisSelector.addItem("Pitch", "pitch")
+    self.rotationAxisSelector.addItem("Roll", "roll")
+    self.rotationAxisSelector.setToolTip("Yaw rotates around the vertical axis of the view, pitch around the horizontal axis,"
+      " roll around the viewing direction.")
+    threeDViewOptionsLayout.addRow("Rotation axis:", self.rotationAxisSelector)
+
     #
     # Output area
     #
@@ -144,7 +194,9 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     outputFormLayout.addRow("Video export:", self.videoExportCheckBox)
 
     self.videoFileNameWidget = qt.QLineEdit()
-    self.videoFileNameWidget.setToolTip("String that defines file name, type, and numbering scheme. Default: capture.avi.")
+    self.videoFileNameWidget.setToolTip("String that defines file name, type, and numbering scheme. Default: capture.avi."
+      " Animated GIF (.gif) and animated PNG (.png) files are created without using ffmpeg."
+      " GIF encoding is slow, animated PNG is recommended for large images.")
     self.videoFileNameWidget.text = "SlicerCapture.avi"
     self.videoFileNameWidget.setEnabled(False)
     outputFormLayout.addRow("Video file name:", self.videoFileNameWidget)
@@ -170,12 +222,32 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     # Capture button
     self.captureButton = qt.QPushButton("Capture")
     self.captureButton.toolTip = "Capture slice sweep to image sequence."
-    outputFormLayout.addRow(self.captureButton)
+    self.pauseButton = qt.QPushButton("Pause")
+    self.pauseButton.toolTip = "Pause capture. Press again to continue."
+    self.pauseButton.checkable = True
+    self.pauseButton.enabled = False
+    self.cancelButton = qt.QPushButton("Cancel")
+    self.cancelButton.toolTip = "Stop capture and restore original view."
+    self.cancelButton.enabled = False
+    captureButtonsLayout = qt.QHBoxLayout()
+    captureButtonsLayout.addWidget(self.captureButton)
+    captureButtonsLayout.addWidget(self.pauseButton)
+    captureButtonsLayout.addWidget(self.cancelButton)
+    outputFormLayout.addRow(captureButtonsLayout)
         
+    self.progressBar = qt.QProgressBar()
+    self.progressBar.setVisible(False)
+    outputFormLayout.addRow(self.progressBar)
+
     self.statusLabel = qt.QPlainTextEdit()
     self.statusLabel.setTextInteractionFlags(qt.Qt.TextSelectableByMouse)
     self.statusLabel.setCenterOnScroll(True)
+    # keep only the most recent messages to keep appending fast
+    self.statusLabel.setMaximumBlockCount(1000)
     outputFormLayout.addRow(self.statusLabel)
+    # messages that are not displayed yet
+    self.pendingLogMessages = []
+    self.lastLogUpdateTime = 0
 
     #
     # Advanced area
@@ -191,6 +263,32 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     self.fileNamePatternWidget.text = "image_%05d.png"
     advancedFormLayout.addRow("Image file name pattern:", self.fileNamePatternWidget)
 
+    self.imageFormatSelector = qt.QComboBox()
+    self.imageFormatSelector.addItem("Automatic (from file name)", "")
+    for name, description, fileExtensions, encodeFunction, settings in getImageFormatPresets():
+      self.imageFormatSelector.addItem(description, name)
+    self.imageFormatSelector.setToolTip("Format and compression settings of image files. File name extension is set"
+      " to match the selected format. Fast formats are recommended for temporary images of videos.")
+    self.benchmarkImageFormatsButton = qt.QPushButton("Benchmark")
+    self.benchmarkImageFormatsButton.setToolTip("Measure writing speed and file size of all image formats"
+      " using the current content of the selected view.")
+    imageFormatLayout = qt.QHBoxLayout()
+    imageFormatLayout.addWidget(self.imageFormatSelector)
+    imageFormatLayout.addWidget(self.benchmarkImageFormatsButton)
+    advancedFormLayout.addRow("Image format:", imageFormatLayout)
+
+    self.downsamplingFactorsWidget = qt.QLineEdit()
+    self.downsamplingFactorsWidget.setToolTip("Size reduction factors of additional, smaller copies of the output"
+      " (for example, '2, 4' for half and quarter size images). Each size is written into its own subdirectory"
+      " of the output directory. Used only if the output is images or streamed video.")
+    advancedFormLayout.addRow("Additional resolutions:", self.downsamplingFactorsWidget)
+
+    self.perViewOutputCheckBox = qt.QCheckBox()
+    self.perViewOutputCheckBox.checked = False
+    self.perViewOutputCheckBox.setToolTip("If checked and additional views are captured then images of each view"
+      " are saved, too. View name is prepended to the image file name pattern.")
+    advancedFormLayout.addRow("Per-view images:", self.perViewOutputCheckBox)
+
     ffmpegPath = self.logic.getFfmpegPath()
     self.ffmpegPathSelector = ctk.ctkPathLineEdit()
     self.ffmpegPathSelector.setCurrentPath(ffmpegPath)
@@ -200,29 +298,117 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     self.ffmpegPathSelector.setEnabled(False)
     advancedFormLayout.addRow("ffmpeg executable:", self.ffmpegPathSelector)
 
+    self.videoStreamingCheckBox = qt.QCheckBox()
+    self.videoStreamingCheckBox.checked = True
+    self.videoStreamingCheckBox.setToolTip("If checked, captured frames are sent directly to ffmpeg while they are captured,"
+      " without writing temporary image files.")
+    self.videoStreamingCheckBox.setEnabled(False)
+    advancedFormLayout.addRow("Stream video frames:", self.videoStreamingCheckBox)
+
+    self.skipDuplicateFramesCheckBox = qt.QCheckBox()
+    self.skipDuplicateFramesCheckBox.checked = False
+    self.skipDuplicateFramesCheckBox.setToolTip("If checked, consecutive identical images (for example, when sweeping"
+      " outside of the volume) are saved only once. Video playback timing is preserved. Not used when video frames are streamed.")
+    advancedFormLayout.addRow("Skip duplicate frames:", self.skipDuplicateFramesCheckBox)
+
+    self.videoSegmentsSpinBox = qt.QSpinBox()
+    self.videoSegmentsSpinBox.minimum = 1
+    self.videoSegmentsSpinBox.maximum = 64
+    self.videoSegmentsSpinBox.value = 1
+    self.videoSegmentsSpinBox.setToolTip("Number of video segments that are encoded in parallel, in separate ffmpeg processes,"
+      " and then joined. Used only if video frames are not streamed. Values larger than 1 make encoding faster"
+      " on computers with many processor cores.")
+    self.videoSegmentsSpinBox.setEnabled(False)
+    advancedFormLayout.addRow("Video segments:", self.videoSegmentsSpinBox)
+
+    self.writerThreadsSpinBox = qt.QSpinBox()
+    self.writerThreadsSpinBox.minimum = 0
+    self.writerThreadsSpinBox.maximum = 32
+    self.writerThreadsSpinBox.value = self.logic.numberOfWriterThreads
+    self.writerThreadsSpinBox.setToolTip("Number of background threads that compress and write captured images"
+      " while the next image is rendered. Set to 0 to write images synchronously.")
+    advancedFormLayout.addRow("Writer threads:", self.writerThreadsSpinBox)
+
+    self.captureBackendSelector = qt.QComboBox()
+    self.captureBackendSelector.addItem("Screen grab", "widget")
+    self.captureBackendSelector.addItem("Render window", "renderWindow")
+    self.captureBackendSelector.setToolTip("Screen grab captures the view as it is displayed on screen."
+      " Render window reads pixels directly from the view's renderer, which is faster and allows magnification.")
+    advancedFormLayout.addRow("Capture method:", self.captureBackendSelector)
+
+    self.captureMagnificationSpinBox = qt.QSpinBox()
+    self.captureMagnificationSpinBox.minimum = 1
+    self.captureMagnificationSpinBox.maximum = 8
+    self.captureMagnificationSpinBox.value = 1
+    self.captureMagnificationSpinBox.setToolTip("Size of captured images relative to the view size."
+      " Images larger than the view are rendered in tiles.")
+    self.captureMagnificationSpinBox.setEnabled(False)
+    advancedFormLayout.addRow("Magnification:", self.captureMagnificationSpinBox)
+
+    self.frameCacheCheckBox = qt.QCheckBox()
+    self.frameCacheCheckBox.checked = False
+    self.frameCacheCheckBox.setToolTip("If checked, captured images are stored in FrameCache folder in the output"
+      " directory and images of views that have not changed since they were captured are reused instead of rendering them"
+      " again. Allows quickly resuming an interrupted capture. Capture of images that are not reused is slower,"
+      " as each of them is also saved uncompressed in the cache (about 2.8 MB for a 1280x720 image).")
+    advancedFormLayout.addRow("Reuse captured images:", self.frameCacheCheckBox)
+
+    self.cropRegionWidget = qt.QLineEdit()
+    self.cropRegionWidget.setPlaceholderText("whole view")
+    self.cropRegionWidget.setToolTip("Part of the captured images that is saved: left, top, width, height (in pixels),"
+      " or 'auto' to remove background around the displayed content. In 'auto' mode all images are captured"
+      " and stored in a temporary file before writing starts, to find a region that fits the content of all images.")
+    advancedFormLayout.addRow("Crop region:", self.cropRegionWidget)
+
     # Add vertical spacer
     self.layout.addStretch(1)
     
     # connections
     self.captureButton.connect('clicked(bool)', self.onCaptureButton)
+    self.benchmarkImageFormatsButton.connect('clicked(bool)', self.onBenchmarkImageFormats)
+    self.pauseButton.connect('toggled(bool)', self.onPauseButton)
+    self.cancelButton.connect('clicked(bool)', self.onCancelButton)
     self.viewNodeSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onViewNodeSelected)
     self.startSliceOffsetSliderWidget.connect('valueChanged(double)', self.setSliceOffset)
     self.endSliceOffsetSliderWidget.connect('valueChanged(double)', self.setSliceOffset)
     self.videoExportCheckBox.connect('toggled(bool)', self.fileNamePatternWidget, 'setDisabled(bool)')
     self.videoExportCheckBox.connect('toggled(bool)', self.ffmpegPathSelector, 'setEnabled(bool)')
     self.videoExportCheckBox.connect('toggled(bool)', self.videoFileNameWidget, 'setEnabled(bool)')
+    self.videoExportCheckBox.connect('toggled(bool)', self.videoStreamingCheckBox, 'setEnabled(bool)')
+    self.videoExportCheckBox.connect('toggled(bool)', self.videoSegmentsSpinBox, 'setEnabled(bool)')
+    self.captureBackendSelector.connect('currentIndexChanged(int)', self.onCaptureBackendSelected)
 
     self.onViewNodeSelected()
 
   def addLog(self, text):
-    """Append text to log window
+    """Append text to log window.
+    Messages are displayed and the application is updated at most maximumProgressUpdateRate times per second,
+    so logging many messages does not slow down capturing.
     """
-    self.statusLabel.appendPlainText(text)
-    self.statusLabel.ensureCursorVisible()
+    import time
+    self.pendingLogMessages.append(text)
+    if time.time() - self.lastLogUpdateTime >= 1.0 / self.logic.maximumProgressUpdateRate:
+      self.flushLog()
+
+  def flushLog(self):
+    """Display all pending log messages
+    """
+    import time
+    if self.pendingLogMessages:
+      self.statusLabel.appendPlainText("\n".join(self.pendingLogMessages))
+      self.statusLabel.ensureCursorVisible()
+      self.pendingLogMessages = []
+    self.lastLogUpdateTime = time.time()
     slicer.app.processEvents() # force update
+
+  def setProgress(self, numberOfCapturedFrames, numberOfFrames):
+    self.progressBar.maximum = numberOfFrames
+    self.progressBar.value = numberOfCapturedFrames
+    self.flushLog()
     
   def cleanup(self):
-    pass
+    if self.captureJobRunner:
+      self.captureJobRunner.cancel()
 
   def enableSliceViewOptions(self, enable):
     self.sliceViewOptionsCollapsibleButton.setVisible(enable)
@@ -256,44 +442,218 @@ class ScreenCaptureWidget(ScriptedLoadableModuleWidget):
     sliceLogic = self.logic.getSliceLogicFromSliceNode(self.viewNodeSelector.currentNode())
     sliceLogic.SetSliceOffset(offset) 
   
+  def onCaptureBackendSelected(self, index):
+    self.captureMagnificationSpinBox.setEnabled(self.captureBackendSelector.itemData(index) == "renderWindow")
+
   def onSelect(self):
     self.captureButton.enabled = self.viewNodeSelector.currentNode()
 
+  def setCaptureInProgress(self, inProgress):
+    self.captureButton.enabled = not inProgress
+    self.pauseButton.enabled = inProgress
+    self.cancelButton.enabled = inProgress
+    wasBlocked = self.pauseButton.blockSignals(True)
+    self.pauseButton.checked = False
+    self.pauseButton.blockSignals(wasBlocked)
+    self.progressBar.setVisible(inProgress)
+
+  def onPauseButton(self, paused):
+    if not self.captureJobRunner:
+      return
+    if paused:
+      self.captureJobRunner.pause()
+      self.addLog("Paused.")
+    else:
+      self.addLog("Continue.")
+      self.captureJobRunner.resume()
+    self.flushLog()
+
+  def onCancelButton(self):
+    if self.captureJobRunner:
+      self.captureJobRunner.cancel()
+
   def onCaptureButton(self):
-    slicer.app.setOverrideCursor(qt.Qt.WaitCursor)
     self.statusLabel.plainText = ''
+    self.progressBar.value = 0
 
     videoOutputRequested = self.videoExportCheckBox.checked
+    animationOutputRequested = videoOutputRequested and self.logic.isAnimationFileName(self.videoFileNameWidget.text)
+    # animations are always encoded while frames are captured
+    videoStreamingRequested = videoOutputRequested and (animationOutputRequested or self.videoStreamingCheckBox.checked)
     viewNode = self.viewNodeSelector.currentNode()
     numberOfSteps = int(self.numberOfStepsSliderWidget.value)
+    if self.isNativeResolutionSliceSweepRequested(viewNode):
+      numberOfSteps = len(self.logic.getVoxelAlignedSliceOffsets(viewNode, self.startSliceOffsetSliderWidget.value,
+                                                                  self.endSliceOffsetSliderWidget.value))
     outputDir = self.outputDirSelector.currentPath
 
     # Need to create a new random file pattern if video output is requested to make sure that new image files are not mixed up with
     # existing files in the output directory
-    imageFileNamePattern = self.logic.getRandomFilePattern() if videoOutputRequested else self.fileNamePatternWidget.text
+    self.logic.imageFormat = self.imageFormatSelector.itemData(self.imageFormatSelector.currentIndex) or None
+    imageFileNamePattern = self.logic.getImageFileNamePattern(
+      self.logic.getRandomFilePattern() if videoOutputRequested else self.fileNamePatternWidget.text)
 
-    try:
-      if viewNode.IsA("vtkMRMLSliceNode"):
-        self.logic.captureSliceSweep(viewNode, self.startSliceOffsetSliderWidget.value, self.endSliceOffsetSliderWidget.value,
-                                     numberOfSteps, outputDir, imageFileNamePattern)
-      elif viewNode.IsA("vtkMRMLViewNode"):
-        self.logic.capture3dViewRotation(viewNode, self.startRotationSliderWidget.value, self.endRotationSliderWidget.value,
-                                         numberOfSteps, outputDir, imageFileNamePattern)
-      else:
-        raise ValueError('Unsupported view node type.')
+    self.logic.numberOfWriterThreads = self.writerThreadsSpinBox.value
+    self.logic.captureBackend = self.captureBackendSelector.itemData(self.captureBackendSelector.currentIndex)
+    self.logic.captureMagnification = self.captureMagnificationSpinBox.value
+    if self.frameCacheCheckBox.checked:
+      self.logic.createFrameCache(os.path.join(outputDir, "FrameCache"))
+    else:
+      self.logic.frameCache = None
+    streamedVideoFilePath = os.path.join(outputDir, self.videoFileNameWidget.text) if videoStreamingRequested else None
 
-      if videoOutputRequested:
+    frameWriter = None
+    viewJobs = []
+    captureJob = None
+    try:
+      self.logic.cropRegion = self.getCropRegion()
+      downsamplingFactors = [int(factor) for factor in self.downsamplingFactorsWidget.text.replace(',', ' ').split()]
+      multiResolutionOutputRequested = (downsamplingFactors and not animationOutputRequested
+                                        and (videoStreamingRequested or not videoOutputRequested))
+      frameListFileName = None
+      if videoOutputRequested and not animationOutputRequested:
         self.logic.setFfmpegPath(self.ffmpegPathSelector.currentPath)
-        self.logic.createVideo(self.videoQualitySliderWidget.value, self.videoFrameRateSliderWidget.value,
-                               outputDir, imageFileNamePattern, self.videoFileNameWidget.text)
-        self.logic.deleteTemporaryFiles(outputDir, imageFileNamePattern, numberOfSteps)
+      if animationOutputRequested:
+        sizeWarning = self.logic.getAnimationSizeWarning(self.videoFileNameWidget.text, viewNode)
+        if sizeWarning:
+          self.addLog(sizeWarning)
+        frameWriter = self.logic.createAnimationWriter(self.videoFrameRateSliderWidget.value, outputDir,
+                                                       self.videoFileNameWidget.text)
+      elif multiResolutionOutputRequested:
+        frameWriter = self.logic.createMultiResolutionWriter(outputDir,
+          None if videoOutputRequested else imageFileNamePattern, [1] + downsamplingFactors,
+          self.videoFileNameWidget.text if videoOutputRequested else None,
+          self.videoQualitySliderWidget.value, self.videoFrameRateSliderWidget.value)
+        if videoOutputRequested:
+          streamedVideoFilePath = os.path.join(self.logic.getMultiResolutionOutputDir(outputDir, 1),
+                                               self.videoFileNameWidget.text)
+      elif videoStreamingRequested:
+        frameWriter = self.logic.createVideoStreamWriter(self.videoQualitySliderWidget.value, self.videoFrameRateSliderWidget.value,
+                                                         outputDir, self.videoFileNameWidget.text)
+      elif self.skipDuplicateFramesCheckBox.checked:
+        if not os.path.exists(outputDir):
+          os.makedirs(outputDir)
+        filePathPattern = os.path.join(outputDir, imageFileNamePattern)
+        frameWriter = self.logic.createImageSequenceWriter(filePathPattern, skipDuplicateFrames=True)
+        if videoOutputRequested:
+          frameListFileName = imageFileNamePattern.split('%')[0] + "frames.ffconcat"
+          frameWriter.setFrameListOutput(os.path.join(outputDir, frameListFileName), filePathPattern,
+                                         self.videoFrameRateSliderWidget.value)
+
+      additionalViewNodes = [node for node in self.additionalViewNodesSelector.checkedNodes() if node != viewNode]
+      if not additionalViewNodes:
+        captureJob = self.createViewCaptureJob(viewNode, True, numberOfSteps, outputDir, imageFileNamePattern, frameWriter)
+      else:
+        for viewIndex, node in enumerate([viewNode] + additionalViewNodes):
+          viewFileNamePattern = None
+          if self.perViewOutputCheckBox.checked:
+            viewFileNamePattern = self.logic.getImageFileNamePattern(node.GetLayoutName() + "_" + self.fileNamePatternWidget.text)
+          viewJobs.append(self.createViewCaptureJob(node, viewIndex == 0, numberOfSteps, outputDir, viewFileNamePattern))
+        captureJob = self.logic.createMultiViewCaptureJob(viewJobs, outputDir, imageFileNamePattern, frameWriter)
+      jobs = [captureJob]
 
-      self.addLog("Done.")
+      if videoOutputRequested and not videoStreamingRequested:
+        jobs.append(self.logic.createVideoJob(self.videoQualitySliderWidget.value, self.videoFrameRateSliderWidget.value,
+                                              outputDir, imageFileNamePattern, self.videoFileNameWidget.text, numberOfSteps,
+                                              frameListFileName,
+                                              1 if frameListFileName else self.videoSegmentsSpinBox.value))
     except Exception as e:
-      self.addLog("Unexpected error: {0}".format(e.message))
+      self.addLog("Unexpected error: {0}".format(str(e)))
       import traceback
       traceback.print_exc()
-    slicer.app.restoreOverrideCursor()
+      # writers that have been created already will not receive any frames
+      self.logic.abortFrameWriters([frameWriter] + [job.frameWriter for job in viewJobs + [captureJob] if job])
+      self.flushLog()
+      return
+
+    # Information needed for completing the capture
+    self.streamedVideoFilePath = streamedVideoFilePath
+    self.temporaryImageFiles = None
+    self.temporaryFrameListFilePath = os.path.join(outputDir, frameListFileName) if frameListFileName else None
+    if videoOutputRequested and not videoStreamingRequested:
+      self.temporaryImageFiles = (outputDir, imageFileNamePattern, numberOfSteps)
+
+    self.setCaptureInProgress(True)
+    self.captureJobRunner = self.logic.startCaptureJobs(jobs, self.onCaptureFinished)
+
+  def getCropRegion(self):
+    text = self.cropRegionWidget.text.strip()
+    if not text:
+      return None
+    if text.lower() == 'auto':
+      return 'auto'
+    try:
+      left, top, width, height = [int(value) for value in text.replace(',', ' ').split()]
+    except ValueError:
+      raise ValueError("Crop region must be 'auto' or left, top, width, height: {0}".format(text))
+    if left < 0 or top < 0 or width <= 0 or height <= 0:
+      raise ValueError("Crop region must have non-negative left and top and positive width and height: {0}".format(text))
+    return (top, top+height, left, left+width)
+
+  def isNativeResolutionSliceSweepRequested(self, viewNode):
+    return (self.nativeResolutionCheckBox.checked and viewNode.IsA("vtkMRMLSliceNode")
+            and not self.sequenceBrowserNodeSelector.currentNode())
+
+  def onBenchmarkImageFormats(self):
+    self.statusLabel.plainText = ''
+    self.logic.captureBackend = self.captureBackendSelector.itemData(self.captureBackendSelector.currentIndex)
+    self.logic.captureMagnification = self.captureMagnificationSpinBox.value
+    try:
+      self.logic.benchmarkImageFormats(self.viewNodeSelector.currentNode())
+    except Exception as e:
+      self.addLog("Unexpected error: {0}".format(e))
+    self.flushLog()
+
+  def createViewCaptureJob(self, viewNode, mainView, numberOfImages, outputDir, imageFileNamePattern, frameWriter=None):
+    """Create a capture job for a view. Slice offset range of the main view is set by the user,
+    other slice views are swept through their entire range. If native resolution is requested then the main slice view
+    captures each volume slice once and numberOfImages must match the number of slices.
+    If a sequence browser is selected then all views step through the sequence.
+    """
+    browserNode = self.sequenceBrowserNodeSelector.currentNode()
+    if browserNode:
+      # items of sequence nodes are in memory, there is nothing to prefetch (see createSequenceCaptureJob)
+      return self.logic.createSequenceCaptureJob(browserNode, viewNode, 0, browserNode.GetNumberOfItems()-1,
+                                                 numberOfImages, outputDir, imageFileNamePattern, frameWriter)
+    if viewNode.IsA("vtkMRMLSliceNode"):
+      if mainView and self.isNativeResolutionSliceSweepRequested(viewNode):
+        return self.logic.createNativeResolutionSliceSweepJob(viewNode, outputDir, imageFileNamePattern, frameWriter,
+                                                              self.startSliceOffsetSliderWidget.value,
+                                                              self.endSliceOffsetSliderWidget.value)
+      if mainView:
+        startSliceOffset = self.startSliceOffsetSliderWidget.value
+        endSliceOffset = self.endSliceOffsetSliderWidget.value
+      else:
+        startSliceOffset, endSliceOffset = self.logic.getSliceOffsetRange(viewNode)
+      return self.logic.createSliceSweepJob(viewNode, startSliceOffset, endSliceOffset,
+                                            numberOfImages, outputDir, imageFileNamePattern, frameWriter)
+    elif viewNode.IsA("vtkMRMLViewNode"):
+      return self.logic.create3dViewRotationJob(viewNode, self.startRotationSliderWidget.value,
+                                                self.endRotationSliderWidget.value,
+                                                numberOfImages, outputDir, imageFileNamePattern, frameWriter,
+                                                self.rotationAxisSelector.itemData(self.rotationAxisSelector.currentIndex))
+    else:
+      raise ValueError('Unsupported view node type.')
+
+  def onCaptureFinished(self, runner):
+    if runner.error:
+      self.addLog("Unexpected error: {0}".format(runner.error))
+    else:
+      if self.temporaryImageFiles:
+        self.logic.deleteTemporaryFiles(*self.temporaryImageFiles)
+      if self.temporaryFrameListFilePath and os.path.exists(self.temporaryFrameListFilePath):
+        os.remove(self.temporaryFrameListFilePath)
+      if runner.cancelled:
+        self.addLog("Capture cancelled.")
+      else:
+        if self.streamedVideoFilePath:
+          self.addLog("Video export succeeded to file: "+self.streamedVideoFilePath)
+        if self.logic.captureStatistics:
+          self.addLog(self.logic.captureStatistics.getSummaryText())
+        self.addLog("Done.")
+    self.flushLog()
+    self.setCaptureInProgress(False)
+    self.captureJobRunner = None
 
 #
 # ScreenCaptureLogic
@@ -309,11 +669,65 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
+  def __init__(self):
+    ScriptedLoadableModuleLogic.__init__(self)
+    self.logCallback = None
+    # Called with (numberOfCapturedFrames, numberOfFrames) during capture
+    self.progressCallback = None
+    # Progress is reported at most this many times per second (and always when capture is completed)
+    self.maximumProgressUpdateRate = 5.0
+    self.lastProgressReportTime = None
+    # Number of background threads that compress and write frames while the next frame is rendered.
+    # If 0 then frames are written synchronously.
+    import multiprocessing
+    self.numberOfWriterThreads = min(4, multiprocessing.cpu_count())
+    # Number of preallocated frame buffers between the capture loop and the frame writers.
+    # Rendering is paused while all the buffers are waiting to be written.
+    self.numberOfFrameBuffers = 8
+    # Method of getting view contents:
+    # - 'widget': grab the view widget as it is displayed on screen
+    # - 'renderWindow': read pixels directly from the VTK render window of the view,
+    #   which is faster and allows capturing images larger than the view (see captureMagnification)
+    self.captureBackend = 'widget'
+    # Size of images captured from render windows relative to the view size
+    self.captureMagnification = 1
+    # Timing of capture stages of the most recent capture (CaptureStatistics)
+    self.captureStatistics = None
+    # Image format preset of image files (see getImageFormatPresets),
+    # None means that the format is determined by the file name extension, with default settings
+    self.imageFormat = None
+    # Captured frames are stored in this FrameCache and reused when the same view state is captured again,
+    # for example when an interrupted capture is restarted. If None then frames are always rendered.
+    self.frameCache = None
+    # Identifies the displayed scene content in frame cache keys. If None then IDs and modification times
+    # of displayed nodes are used, which are only valid in the current session (see getSceneStateKey).
+    self.frameCacheSceneKey = None
+    # Part of captured images that is written: None (whole image), (firstRow, endRow, firstColumn, endColumn)
+    # in pixels, which must be inside the captured image, or 'auto' to remove background margins (see getContentMask).
+    # In 'auto' mode all frames are captured once before writing starts to find the region that has content in any
+    # of the frames, therefore all frames have the same size. Captured frames are kept in a temporary file
+    # (uncompressed) until they are written.
+    self.cropRegion = None
+    # Number of background pixels kept around the content when cropRegion is 'auto'
+    self.autoCropMargin = 0
+    # Path of the ffmpeg executable. If None then the path saved in application settings is used (see setFfmpegPath).
+    self.ffmpegPath = None
+
   def addLog(self, text):
     logging.info(text)
     if self.logCallback:
       self.logCallback(text)
 
+  def reportProgress(self, numberOfCapturedFrames, numberOfFrames):
+    if not self.progressCallback:
+      return
+    currentTime = timeit.default_timer()
+    if (numberOfCapturedFrames < numberOfFrames and self.lastProgressReportTime is not None
+      and currentTime - self.lastProgressReportTime < 1.0 / self.maximumProgressUpdateRate):
+      return
+    self.lastProgressReportTime = currentTime
+    self.progressCallback(numberOfCapturedFrames, numberOfFrames)
+
   def getRandomFilePattern(self):
     import string
     import random
@@ -323,6 +737,8 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
     return filePathPattern
 
   def getFfmpegPath(self):
+    if self.ffmpegPath:
+      return self.ffmpegPath
     settings = qt.QSettings()
     if settings.contains('General/ffmpegPath'):
       return settings.value('General/ffmpegPath')
@@ -336,6 +752,16 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
         return
     settings.setValue('General/ffmpegPath',ffmpegPath)
 
+  def getValidatedFfmpegPath(self):
+    import os.path
+    ffmpegPath = self.getFfmpegPath()
+    if not ffmpegPath:
+      raise ValueError("Video creation failed: ffmpeg executable path is not defined")
+    ffmpegPath = os.path.abspath(ffmpegPath)
+    if not os.path.isfile(ffmpegPath):
+      raise ValueError("Video creation failed: ffmpeg executable path is invalid: "+ffmpegPath)
+    return ffmpegPath
+
   def getSliceLogicFromSliceNode(self, sliceNode):
     lm = slicer.app.layoutManager()
     sliceLogic = lm.sliceWidget(sliceNode.GetLayoutName()).sliceLogic()
@@ -366,92 +792,546 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
       sliceOffsetResolution = sliceSpacing[2]
 
     return sliceOffsetResolution
-      
-  def captureSliceSweep(self, sliceNode, startSliceOffset, endSliceOffset, numberOfImages, outputDir, outputFilenamePattern):
+
+  def getVoxelAlignedSliceOffsets(self, sliceNode, startSliceOffset=None, endSliceOffset=None):
+    """
+    Returns slice offsets of all distinct slices of the lowest volume in the slice view, at voxel centers,
+    in increasing order. If startSliceOffset or endSliceOffset is specified then only slices within the range
+    are returned (the range may be given in any order).
+    """
+    sliceLogic = self.getSliceLogicFromSliceNode(sliceNode)
+    sliceBounds = [0, -1, 0, -1, 0, -1]
+    sliceLogic.GetLowestVolumeSliceBounds(sliceBounds)
+    sliceOffsetMin = sliceBounds[4]
+    sliceOffsetMax = sliceBounds[5]
+    if sliceOffsetMin >= sliceOffsetMax:
+      raise ValueError('No volume is shown in the selected slice view.')
+    sliceSpacing = self.getSliceOffsetResolution(sliceNode)
+
+    # Let the slice logic find a voxel center, then step by slice spacing in both directions
+    originalSliceOffset = sliceLogic.GetSliceOffset()
+    sliceLogic.SetSliceOffset((sliceOffsetMin+sliceOffsetMax)*0.5)
+    sliceLogic.SnapSliceOffsetToIJK()
+    voxelCenterOffset = sliceLogic.GetSliceOffset()
+    sliceLogic.SetSliceOffset(originalSliceOffset)
+
+    if startSliceOffset is not None or endSliceOffset is not None:
+      rangeStart = sliceOffsetMin if startSliceOffset is None else startSliceOffset
+      rangeEnd = sliceOffsetMax if endSliceOffset is None else endSliceOffset
+      sliceOffsetMin = max(sliceOffsetMin, min(rangeStart, rangeEnd))
+      sliceOffsetMax = min(sliceOffsetMax, max(rangeStart, rangeEnd))
+
+    # small tolerance to include slices that are at the boundary of the range
+    tolerance = 1e-3
+    firstSliceIndex = int(numpy.ceil((sliceOffsetMin-voxelCenterOffset)/sliceSpacing-tolerance))
+    lastSliceIndex = int(numpy.floor((sliceOffsetMax-voxelCenterOffset)/sliceSpacing+tolerance))
+    return voxelCenterOffset+numpy.arange(firstSliceIndex, lastSliceIndex+1)*sliceSpacing
+
+  def grabViewFrame(self, view):
+    """
+    Get the current content of the view as a numpy array.
+    """
+    if self.captureBackend == 'renderWindow':
+      return vtkImageDataToArray(self.readRenderWindowImageData(view.renderWindow(), self.captureMagnification))
+    pixmap = qt.QPixmap().grabWidget(view)
+    return qImageToArray(pixmap.toImage())
+
+  def readRenderWindowImageData(self, renderWindow, magnification=1):
+    """
+    Read pixels directly from a render window into a vtkImageData.
+    If magnification is larger than 1 then the image is rendered in tiles and the resulting image is larger
+    than the render window.
+    """
+    windowToImage = vtk.vtkWindowToImageFilter()
+    windowToImage.SetInput(renderWindow)
+    windowToImage.SetInputBufferTypeToRGB()
+    if magnification != 1:
+      if hasattr(windowToImage, 'SetScale'):
+        windowToImage.SetScale(magnification)
+      else:
+        windowToImage.SetMagnification(magnification)
+    else:
+      # the view has been just rendered, no need to render it again
+      windowToImage.ShouldRerenderOff()
+    windowToImage.Update()
+    imageData = vtk.vtkImageData()
+    imageData.ShallowCopy(windowToImage.GetOutput())
+    return imageData
+
+  def createImageSequenceWriter(self, filePathPattern, skipDuplicateFrames=False):
+    """
+    Create a frame writer that saves each frame into a separate image file.
+    If background writer threads are enabled then images are compressed and written while next frames are rendered.
+    If skipDuplicateFrames is True then consecutive identical frames are saved only once and images are numbered
+    consecutively. Number of captured frames represented by each image is available in frameWriter.frameDurations
+    and can be saved in an ffmpeg concat list using frameWriter.setFrameListOutput.
+    """
+    frameWriter = ImageSequenceFrameWriter(filePathPattern, self.getImageEncoder(filePathPattern))
+    if self.numberOfWriterThreads > 0:
+      framePipeline = self.createFramePipeline()
+      framePipeline.addFrameWriter(frameWriter, self.numberOfWriterThreads)
+      frameWriter = framePipeline
+    if skipDuplicateFrames:
+      frameWriter = DeduplicatingFrameWriter(frameWriter)
+    return frameWriter
+
+  def getImageEncoder(self, fileName=None):
+    """
+    Returns the image encoder of the selected image format (see imageFormat), None if the format is determined
+    by the file name extension. Raises an error if fileName does not have an extension that matches the image format.
+    """
+    if not self.imageFormat:
+      return None
+    encoder = createImageEncoder(self.imageFormat)
+    if fileName and os.path.splitext(fileName)[1].lower() not in encoder.fileExtensions:
+      raise ValueError("File name {0} does not match image format {1}, use {2} file extension".format(
+        fileName, self.imageFormat, encoder.fileExtension))
+    return encoder
+
+  def getImageFileNamePattern(self, fileNamePattern):
+    """
+    Returns the file name pattern with its extension replaced by the extension of the selected image format.
+    """
+    encoder = self.getImageEncoder()
+    if encoder is None or os.path.splitext(fileNamePattern)[1].lower() in encoder.fileExtensions:
+      return fileNamePattern
+    return os.path.splitext(fileNamePattern)[0] + encoder.fileExtension
+
+  def benchmarkImageFormats(self, viewNode, imageFormats=None, numberOfFrames=10):
+    """
+    Measure how fast the current content of the view can be saved in each image format and how large the files are.
+    Images are encoded and written to a temporary directory numberOfFrames times (in the current thread).
+    imageFormats is a list of preset names (see getImageFormatPresets), by default all presets are measured.
+    Returns a list of dictionaries with imageFormat, framesPerSecond, megapixelsPerSecond, and bytesPerFrame.
+    """
+    import shutil
+    import tempfile
+    if imageFormats is None:
+      imageFormats = [preset[0] for preset in getImageFormatPresets()]
+    view = self.getViewFromViewNode(viewNode)
+    view.forceRender()
+    frame = self.grabViewFrame(view)
+    outputDir = tempfile.mkdtemp()
+    results = []
+    try:
+      for imageFormat in imageFormats:
+        encoder = createImageEncoder(imageFormat)
+        filename = os.path.join(outputDir, "benchmark" + encoder.fileExtension)
+        statistics = CaptureStatistics()
+        startTime = timeit.default_timer()
+        for frameIndex in range(numberOfFrames):
+          writeImageFile(filename, frame, statistics, encoder)
+        elapsedTime = timeit.default_timer() - startTime
+        results.append({
+          'imageFormat': imageFormat,
+          'framesPerSecond': numberOfFrames / elapsedTime,
+          'megapixelsPerSecond': numberOfFrames * frame.shape[0] * frame.shape[1] / elapsedTime / 1.0e6,
+          'bytesPerFrame': statistics.bytesWritten // numberOfFrames,
+          })
+        self.addLog("{0}: {1:.1f} fps, {2:.1f} Mpixel/s, {3:.1f} kB/frame".format(imageFormat,
+          results[-1]['framesPerSecond'], results[-1]['megapixelsPerSecond'], results[-1]['bytesPerFrame'] / 1.0e3))
+    finally:
+      shutil.rmtree(outputDir)
+    return results
+
+  def createArrayFrameWriter(self, numberOfFrames, filename=None, frames=None):
+    """
+    Create a frame writer that stores all frames in a single numpy array (frames, rows, columns, RGB),
+    available in frameWriter.frames after capture.
+    If filename is specified then the array is memory-mapped to this .npy file (can be loaded by numpy.load),
+    which allows capturing more frames than what fits into memory.
+    If frames is specified then frames are stored in this existing array (it must have matching size),
+    which avoids memory allocation when capture is repeated many times.
+    """
+    return ArrayFrameWriter(numberOfFrames, filename, frames)
+
+  def createFramePipeline(self):
+    """
+    Create an empty frame pipeline. Frame writers can be added to the pipeline by calling addFrameWriter.
+    All frame writers of the pipeline receive each frame and they run in background threads.
+    """
+    return FramePipeline(self.numberOfFrameBuffers)
+
+  def abortFrameWriters(self, frameWriters):
+    """
+    Abort frame writers that will not receive any frames, for example because creating the capture job failed,
+    to stop their writer threads and ffmpeg processes and remove partial output files.
+    None and repeated items of the list are ignored.
+    """
+    abortedFrameWriters = []
+    for frameWriter in frameWriters:
+      if frameWriter is None or [writer for writer in abortedFrameWriters if writer is frameWriter]:
+        continue
+      abortedFrameWriters.append(frameWriter)
+      try:
+        frameWriter.abort()
+      except Exception as e:
+        logging.error("Failed to abort frame writer: {0}".format(e))
+
+  def startCaptureStatistics(self, frameWriter):
+    """
+    Start collecting timing information of a new capture.
+    """
+    self.lastProgressReportTime = None
+    self.captureStatistics = CaptureStatistics()
+    frameWriter.setStatistics(self.captureStatistics)
+    return self.captureStatistics
+
+  def stopCaptureStatistics(self):
+    self.captureStatistics.stop()
+    logging.debug(self.captureStatistics.getSummaryText())
+
+  def createFrameCache(self, cacheDir, maximumSize=2.0e9):
+    """
+    Start reusing captured frames that are stored in cacheDir (see FrameCache). Returns the frame cache.
+    """
+    if self.frameCache is None or os.path.abspath(self.frameCache.cacheDir) != os.path.abspath(cacheDir):
+      self.frameCache = FrameCache(cacheDir, maximumSize)
+    self.frameCache.maximumSize = maximumSize
+    self.frameCache.removeLeastRecentlyUsedFrames()
+    return self.frameCache
+
+  def getSceneStateKey(self):
+    """
+    Returns a string that changes when anything displayed in the views changes: ID and modification time of all
+    displayable, display, color, and volume property nodes, and their image data and meshes.
+    Helper nodes (displayable nodes that are hidden from editors, such as slice models and their transforms)
+    and their display nodes are ignored, as they are modified when views are updated.
+    Modification times are not saved in the scene, therefore frameCacheSceneKey is returned instead if it is set.
+    """
+    if self.frameCacheSceneKey is not None:
+      return self.frameCacheSceneKey
+    nodeStates = []
+    for nodeIndex in range(slicer.mrmlScene.GetNumberOfNodes()):
+      node = slicer.mrmlScene.GetNthNode(nodeIndex)
+      if not [className for className in ['vtkMRMLDisplayableNode', 'vtkMRMLDisplayNode', 'vtkMRMLColorNode',
+        'vtkMRMLVolumePropertyNode'] if node.IsA(className)]:
+        continue
+      # display nodes are hidden from editors by default, use the flag of their displayable node
+      displayableNode = node.GetDisplayableNode() if node.IsA('vtkMRMLDisplayNode') else node
+      if (displayableNode is not None and displayableNode.IsA('vtkMRMLDisplayableNode')
+        and displayableNode.GetHideFromEditors()):
+        continue
+      nodeState = [node.GetID(), node.GetMTime()]
+      if node.IsA('vtkMRMLVolumeNode') and node.GetImageData():
+        nodeState.append(node.GetImageData().GetMTime())
+      if node.IsA('vtkMRMLModelNode') and node.GetMesh():
+        nodeState.append(node.GetMesh().GetMTime())
+      nodeStates.append(tuple(nodeState))
+    return repr(nodeStates)
+
+  def getFileStateKey(self, filePath):
+    """
+    Returns a string that identifies the current content of a file (path, size, and modification time),
+    which can be used as frameCacheSceneKey when views show a scene that is loaded from this file.
+    """
+    fileStat = os.stat(filePath)
+    return repr((os.path.abspath(filePath), fileStat.st_size, int(fileStat.st_mtime)))
+
+  def createSliceSweepJob(self, sliceNode, startSliceOffset, endSliceOffset, numberOfImages, outputDir,
+                          outputFilenamePattern, frameWriter=None):
+    """
+    Create a job that acquires a set of screenshots of the slice view while sweeping the slice offset.
+    If frameWriter is specified then captured frames are passed to it instead of being written to image files
+    in outputDir. The writer is closed when all the frames are captured.
+    If neither outputFilenamePattern nor frameWriter is specified then the job has no output and it can only be used
+    as a view of a multi-view capture (see createMultiViewCaptureJob).
+    """
     if not sliceNode.IsMappedInLayout():
       raise ValueError('Selected slice view is not visible in the current layout.')
 
-    if not os.path.exists(outputDir):
+    if outputDir and not os.path.exists(outputDir):
       os.makedirs(outputDir)
-    filePathPattern = os.path.join(outputDir,outputFilenamePattern)
+    if frameWriter is None and outputFilenamePattern:
+      frameWriter = self.createImageSequenceWriter(os.path.join(outputDir,outputFilenamePattern))
 
     sliceLogic = self.getSliceLogicFromSliceNode(sliceNode)
-    originalSliceOffset = sliceLogic.GetSliceOffset()
-    
     sliceView = slicer.app.layoutManager().sliceWidget(sliceNode.GetLayoutName()).sliceView()
-    compositeNode = sliceLogic.GetSliceCompositeNode()
-    offsetStepSize = (endSliceOffset-startSliceOffset)/(numberOfImages-1)
-    for offsetIndex in range(numberOfImages):
-      sliceLogic.SetSliceOffset(startSliceOffset+offsetIndex*offsetStepSize)
-      sliceView.forceRender()
-      pixmap = qt.QPixmap().grabWidget(sliceView)
-      filename = filePathPattern % offsetIndex
-      self.addLog("Write "+filename)
-      pixmap.save(filename)
+    return SliceSweepCaptureJob(self, sliceLogic, sliceView, startSliceOffset, endSliceOffset, numberOfImages, frameWriter)
 
-    sliceLogic.SetSliceOffset(originalSliceOffset)
+  def captureSliceSweep(self, sliceNode, startSliceOffset, endSliceOffset, numberOfImages, outputDir, outputFilenamePattern,
+                        frameWriter=None):
+    """
+    Acquire a set of screenshots of the slice view while sweeping the slice offset.
+    If frameWriter is specified then captured frames are passed to it instead of being written to image files
+    in outputDir. The writer is closed when all the frames are captured.
+    """
+    self.createSliceSweepJob(sliceNode, startSliceOffset, endSliceOffset, numberOfImages, outputDir,
+                             outputFilenamePattern, frameWriter).run()
 
-  def capture3dViewRotation(self, viewNode, startRotation, endRotation, numberOfImages, outputDir,
-                        outputFilenamePattern):
+  def createNativeResolutionSliceSweepJob(self, sliceNode, outputDir, outputFilenamePattern, frameWriter=None,
+                                          startSliceOffset=None, endSliceOffset=None):
     """
-    Acquire a set of screenshots of the 3D view while rotating it.
+    Create a job that captures each distinct slice of the lowest volume in the slice view exactly once,
+    at voxel centers (see getVoxelAlignedSliceOffsets). Number of frames is determined by the volume,
+    it is available in the numberOfFrames attribute of the returned job.
+    Slices are captured from startSliceOffset towards endSliceOffset.
     """
+    sliceOffsets = self.getVoxelAlignedSliceOffsets(sliceNode, startSliceOffset, endSliceOffset)
+    if len(sliceOffsets) == 0:
+      raise ValueError('No volume slices are in the selected slice offset range.')
+    if startSliceOffset is not None and endSliceOffset is not None and startSliceOffset > endSliceOffset:
+      sliceOffsets = sliceOffsets[::-1]
+    # slices are evenly spaced, so a sweep between the first and last slice visits all of them
+    return self.createSliceSweepJob(sliceNode, sliceOffsets[0], sliceOffsets[-1], len(sliceOffsets), outputDir,
+                                    outputFilenamePattern, frameWriter)
 
-    if not os.path.exists(outputDir):
-      os.makedirs(outputDir)
+  def captureNativeResolutionSliceSweep(self, sliceNode, outputDir, outputFilenamePattern, frameWriter=None,
+                                        startSliceOffset=None, endSliceOffset=None):
+    """
+    Acquire a screenshot of each distinct slice of the lowest volume in the slice view.
+    Returns the number of captured frames.
+    """
+    captureJob = self.createNativeResolutionSliceSweepJob(sliceNode, outputDir, outputFilenamePattern, frameWriter,
+                                                          startSliceOffset, endSliceOffset)
+    captureJob.run()
+    return captureJob.numberOfFrames
 
-    filePathPattern = os.path.join(outputDir, outputFilenamePattern)
+  def captureSliceSweepToArray(self, sliceNode, startSliceOffset, endSliceOffset, numberOfImages, filename=None, frames=None):
+    """
+    Acquire a set of screenshots of the slice view while sweeping the slice offset and return them
+    in a numpy array (frames, rows, columns, RGB), without writing image files.
+    See createArrayFrameWriter for description of filename and frames arguments.
+    """
+    frameWriter = self.createArrayFrameWriter(numberOfImages, filename, frames)
+    self.createSliceSweepJob(sliceNode, startSliceOffset, endSliceOffset, numberOfImages, None, None, frameWriter).run()
+    return frameWriter.frames
 
-    renderView = None
+  def getThreeDViewFromViewNode(self, viewNode):
     lm = slicer.app.layoutManager()
     for widgetIndex in range(lm.threeDViewCount):
       view = lm.threeDWidget(widgetIndex).threeDView()
       if viewNode == view.mrmlViewNode():
-        renderView = view
-        break
-    if not renderView:
-      raise ValueError('Selected 3D view is not visible in the current layout.')
-
-    # Save original orientation and go to start orientation
-    originalPitchRollYawIncrement = renderView.pitchRollYawIncrement
-    originalYawDirection = renderView.yawDirection
-    renderView.setPitchRollYawIncrement(startRotation)
-    renderView.yawDirection = renderView.YawLeft
-    renderView.yaw()
-
-    # Rotate step-by-step
-    rotationStepSize = (endRotation + startRotation) / (numberOfImages - 1)
-    renderView.setPitchRollYawIncrement(rotationStepSize)
-    renderView.yawDirection = renderView.YawRight
-    for offsetIndex in range(numberOfImages):
-      renderView.forceRender()
-      pixmap = qt.QPixmap().grabWidget(view)
-      filename = filePathPattern % offsetIndex
-      self.addLog("Write " + filename)
-      pixmap.save(filename)
-      renderView.yaw()
-
-    # Restore original orientation and rotation step size & direction
-    renderView.yawDirection = renderView.YawLeft
-    renderView.yaw()
-    renderView.setPitchRollYawIncrement(endRotation)
-    renderView.yaw()
-    renderView.setPitchRollYawIncrement(originalPitchRollYawIncrement)
-    renderView.yawDirection = originalYawDirection
-
-  def createVideo(self, bitRate, frameRate, outputDir, imageFileNamePattern, videoFileName):
-    self.addLog("Export to video...")
-
-    # Get ffmpeg
-    import os.path
-    ffmpegPath = os.path.abspath(self.getFfmpegPath())
-    if not ffmpegPath:
-      raise ValueError("Video creation failed: ffmpeg executable path is not defined")
-    if not os.path.isfile(ffmpegPath):
-      raise ValueError("Video creation failed: ffmpeg executable path is invalid: "+ffmpegPath)
+        return view
+    raise ValueError('Selected 3D view is not visible in the current layout.')
+
+  def create3dViewRotationJob(self, viewNode, startRotation, endRotation, numberOfImages, outputDir,
+                              outputFilenamePattern, frameWriter=None, rotationAxis='yaw'):
+    """
+    Create a job that acquires a set of screenshots of the 3D view while rotating it.
+    If frameWriter is specified then captured frames are passed to it instead of being written to image files
+    in outputDir. The writer is closed when all the frames are captured.
+    If neither outputFilenamePattern nor frameWriter is specified then the job has no output and it can only be used
+    as a view of a multi-view capture (see createMultiViewCaptureJob).
+    rotationAxis is 'yaw', 'pitch', 'roll', or an axis in world coordinates (see ViewRotationCaptureJob).
+    """
+    renderView = self.getThreeDViewFromViewNode(viewNode)
+
+    if outputDir and not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+    if frameWriter is None and outputFilenamePattern:
+      frameWriter = self.createImageSequenceWriter(os.path.join(outputDir, outputFilenamePattern))
+
+    return ViewRotationCaptureJob(self, renderView, startRotation, endRotation, numberOfImages, frameWriter, rotationAxis)
+
+  def capture3dViewRotation(self, viewNode, startRotation, endRotation, numberOfImages, outputDir,
+                        outputFilenamePattern, frameWriter=None, rotationAxis='yaw'):
+    """
+    Acquire a set of screenshots of the 3D view while rotating it.
+    If frameWriter is specified then captured frames are passed to it instead of being written to image files
+    in outputDir. The writer is closed when all the frames are captured.
+    """
+    self.create3dViewRotationJob(viewNode, startRotation, endRotation, numberOfImages, outputDir,
+                                 outputFilenamePattern, frameWriter, rotationAxis).run()
+
+  def capture3dViewRotationToArray(self, viewNode, startRotation, endRotation, numberOfImages, filename=None, frames=None,
+                                   rotationAxis='yaw'):
+    """
+    Acquire a set of screenshots of the 3D view while rotating it and return them
+    in a numpy array (frames, rows, columns, RGB), without writing image files.
+    See createArrayFrameWriter for description of filename and frames arguments.
+    """
+    frameWriter = self.createArrayFrameWriter(numberOfImages, filename, frames)
+    self.create3dViewRotationJob(viewNode, startRotation, endRotation, numberOfImages, None, None, frameWriter,
+                                 rotationAxis).run()
+    return frameWriter.frames
+
+  def getCameraPose(self, viewNode):
+    """
+    Returns current (position, focal point, view up) of the camera of a 3D view.
+    It can be used as a starting point for computing camera paths (computeRotationCameraPath, computeKeyframeCameraPath).
+    """
+    camera = self.getThreeDViewFromViewNode(viewNode).renderWindow().GetRenderers().GetFirstRenderer().GetActiveCamera()
+    return (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp())
+
+  def createCameraPathCaptureJob(self, viewNode, cameraPath, outputDir, outputFilenamePattern, frameWriter=None):
+    """
+    Create a job that acquires a screenshot of the 3D view at each pose of a camera path (see CameraPath).
+    If frameWriter is specified then captured frames are passed to it instead of being written to image files
+    in outputDir.
+    """
+    renderView = self.getThreeDViewFromViewNode(viewNode)
+
+    if outputDir and not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+    if frameWriter is None and outputFilenamePattern:
+      frameWriter = self.createImageSequenceWriter(os.path.join(outputDir, outputFilenamePattern))
+
+    return CameraPathCaptureJob(self, renderView, cameraPath, frameWriter)
+
+  def captureCameraPath(self, viewNode, cameraPath, outputDir, outputFilenamePattern, frameWriter=None):
+    """
+    Acquire a screenshot of the 3D view at each pose of a camera path. The original camera is restored at the end.
+    """
+    self.createCameraPathCaptureJob(viewNode, cameraPath, outputDir, outputFilenamePattern, frameWriter).run()
+
+  def getViewFromViewNode(self, viewNode):
+    """Returns the slice or 3D view widget that displays the view node."""
+    if viewNode.IsA("vtkMRMLSliceNode"):
+      if not viewNode.IsMappedInLayout():
+        raise ValueError('Selected slice view is not visible in the current layout.')
+      return slicer.app.layoutManager().sliceWidget(viewNode.GetLayoutName()).sliceView()
+    elif viewNode.IsA("vtkMRMLViewNode"):
+      return self.getThreeDViewFromViewNode(viewNode)
+    raise ValueError('Unsupported view node type.')
+
+  def createSequenceCaptureJob(self, browserNode, viewNode, startItemIndex, endItemIndex, numberOfImages, outputDir,
+                               outputFilenamePattern, frameWriter=None, prefetcher=None):
+    """
+    Create a job that acquires a set of screenshots of a slice or 3D view while stepping through items (time points)
+    of a sequence browser node, from startItemIndex to endItemIndex. The selected item is restored at the end.
+    Prefetching is a hook for scripts: if a prefetcher is specified then the next item is prefetched in a background
+    thread while the current item is captured (see SequenceCaptureJob). It only helps if selecting an item waits for
+    data that can be prepared without accessing MRML, such as files that a custom sequence reads from disk
+    (see createFilePrefetcher). Sequence nodes keep all items in memory and proxy nodes can only be updated
+    on the main thread, therefore captures started from the module GUI or from batch job files do not prefetch.
+    If frameWriter is specified then captured frames are passed to it instead of being written to image files
+    in outputDir.
+    """
+    view = self.getViewFromViewNode(viewNode)
+
+    if outputDir and not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+    if frameWriter is None and outputFilenamePattern:
+      frameWriter = self.createImageSequenceWriter(os.path.join(outputDir, outputFilenamePattern))
+
+    return SequenceCaptureJob(self, view, browserNode, startItemIndex, endItemIndex, numberOfImages, frameWriter,
+                              prefetcher)
+
+  def captureSequence(self, browserNode, viewNode, startItemIndex, endItemIndex, numberOfImages, outputDir,
+                      outputFilenamePattern, frameWriter=None, prefetcher=None):
+    """
+    Acquire a set of screenshots of a view while stepping through items of a sequence browser node.
+    See createSequenceCaptureJob for details.
+    """
+    self.createSequenceCaptureJob(browserNode, viewNode, startItemIndex, endItemIndex, numberOfImages, outputDir,
+                                  outputFilenamePattern, frameWriter, prefetcher).run()
+
+  def createSphericalGridCaptureJob(self, viewNode, yawAngles, pitchAngles, outputDir, outputFilenamePattern=None,
+                                    spriteSheetFileNamePattern=None, indexFileName=None, spriteSheetDownsamplingFactor=1,
+                                    frameWriter=None):
+    """
+    Create a job that captures the 3D view from all combinations of yaw and pitch angles (in degrees, relative
+    to the current orientation), for example for interactive web viewers. Frame index is
+    pitchIndex * len(yawAngles) + yawIndex.
+    Outputs (all optional, in outputDir):
+    - outputFilenamePattern: separate image file for each frame
+    - spriteSheetFileNamePattern: sprite sheets that contain all frames as tiles (e.g., "sprites_%02d.jpg"),
+      reduced in size by spriteSheetDownsamplingFactor
+    - indexFileName: JSON file that lists angles, image file names, and sprite sheet tile positions of all frames
+    - frameWriter: any frame writer that accepts frames in arbitrary order (frames are captured row by row,
+      in alternating yaw direction)
+    Image files and sprite sheets are written in background threads if writer threads are enabled.
+    """
+    renderView = self.getThreeDViewFromViewNode(viewNode)
+
+    if outputDir and not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+
+    frameWriters = [frameWriter] if frameWriter else []
+    imageFilePathPattern = None
+    if outputFilenamePattern:
+      imageFilePathPattern = os.path.join(outputDir, outputFilenamePattern)
+      frameWriters.append(ImageSequenceFrameWriter(imageFilePathPattern, self.getImageEncoder(imageFilePathPattern)))
+    spriteSheetWriter = None
+    if spriteSheetFileNamePattern:
+      spriteSheetWriter = SpriteSheetFrameWriter(os.path.join(outputDir, spriteSheetFileNamePattern),
+        len(yawAngles) * len(pitchAngles), spriteSheetDownsamplingFactor)
+      frameWriters.append(spriteSheetWriter)
+    if not frameWriters:
+      raise ValueError("No output is specified for the capture")
+
+    # writers run in background threads, each of them with all writer threads as they support concurrent writes
+    framePipeline = self.createFramePipeline()
+    for writer in frameWriters:
+      framePipeline.addFrameWriter(writer, 1 if writer is frameWriter else max(self.numberOfWriterThreads, 1))
+
+    indexFilePath = os.path.join(outputDir, indexFileName) if indexFileName else None
+    return SphericalGridCaptureJob(self, renderView, yawAngles, pitchAngles, framePipeline, indexFilePath,
+                                   imageFilePathPattern, spriteSheetWriter)
+
+  def captureSphericalGrid(self, viewNode, yawAngles, pitchAngles, outputDir, outputFilenamePattern=None,
+                           spriteSheetFileNamePattern=None, indexFileName=None, spriteSheetDownsamplingFactor=1,
+                           frameWriter=None):
+    """
+    Capture the 3D view from all combinations of yaw and pitch angles. See createSphericalGridCaptureJob for details.
+    """
+    self.createSphericalGridCaptureJob(viewNode, yawAngles, pitchAngles, outputDir, outputFilenamePattern,
+                                       spriteSheetFileNamePattern, indexFileName, spriteSheetDownsamplingFactor,
+                                       frameWriter).run()
+
+  def createMultiViewCaptureJob(self, viewJobs, outputDir, outputFilenamePattern, frameWriter=None, numberOfColumns=None):
+    """
+    Create a job that captures multiple views in one pass and combines them into a single mosaic image.
+    viewJobs are capture jobs of the individual views (created by createSliceSweepJob, create3dViewRotationJob, etc.),
+    they must have the same number of images. In each step, all the views are updated, rendered, and grabbed.
+    Images of individual views are passed to the frame writer of the view job (if it has one).
+    Mosaic images are written to outputDir using outputFilenamePattern, or passed to frameWriter if it is specified.
+    numberOfColumns specifies the number of views in a row of the mosaic (by default the mosaic is approximately square).
+    """
+    if not viewJobs:
+      raise ValueError('No views are selected for capture.')
+
+    if not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+    if frameWriter is None:
+      frameWriter = self.createImageSequenceWriter(os.path.join(outputDir, outputFilenamePattern))
+
+    return MultiViewCaptureJob(self, viewJobs, frameWriter, numberOfColumns)
+
+  def captureMultiView(self, viewJobs, outputDir, outputFilenamePattern, frameWriter=None, numberOfColumns=None):
+    """
+    Capture multiple views in one pass and combine them into a single mosaic image.
+    See createMultiViewCaptureJob for details.
+    """
+    self.createMultiViewCaptureJob(viewJobs, outputDir, outputFilenamePattern, frameWriter, numberOfColumns).run()
+
+  def createVideoJob(self, bitRate, frameRate, outputDir, imageFileNamePattern, videoFileName, numberOfImages=None,
+                     frameListFileName=None, numberOfSegments=1):
+    """
+    Create a job that creates a video file from an image sequence.
+    If numberOfImages is specified then it is used for reporting encoding progress.
+    If frameListFileName is specified then images and their durations are read from this ffmpeg concat list
+    (written by a frame writer that skips duplicate frames) instead of using imageFileNamePattern.
+    If numberOfSegments is larger than 1 then the image sequence is split into segments, which are encoded
+    in parallel in separate processes, and concatenated at the end. numberOfImages must be specified in this case.
+    """
+    if numberOfSegments > 1:
+      if frameListFileName:
+        raise ValueError("Segmented video encoding cannot be used with a frame list")
+      if not numberOfImages:
+        raise ValueError("Number of images must be specified for segmented video encoding")
+      return self.createSegmentedVideoJob(bitRate, frameRate, outputDir, imageFileNamePattern, videoFileName,
+                                          numberOfImages, numberOfSegments)
+
+    ffmpegPath = self.getValidatedFfmpegPath()
 
     filePathPattern = os.path.join(outputDir, imageFileNamePattern)
     outputVideoFilePath = os.path.join(outputDir, videoFileName)
+    if frameListFileName:
+      # durations are specified in the list, output frame rate is enforced by repeating images
+      ffmpegParams = [ffmpegPath,
+                      "-y", # overwrite without asking
+                      "-f", "concat",
+                      "-safe", "0",
+                      "-i", os.path.join(outputDir, frameListFileName),
+                      "-r", str(frameRate),
+                      "-vb", "{0}M".format(bitRate)]
+      if numberOfImages:
+        # the list ends with an extra entry for the last image, which must not extend the video
+        ffmpegParams += ["-frames:v", str(numberOfImages)]
+      ffmpegParams.append(outputVideoFilePath)
+      return VideoEncodingJob(self, ffmpegParams, outputVideoFilePath, numberOfImages)
     ffmpegParams = [ffmpegPath,
                     "-y", # overwrite without asking
                     "-r", str(frameRate),
@@ -463,18 +1343,150 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
     #ffmpegParams = [ffmpegPath,
     #                "-h"]
 
-    logging.debug("ffmpeg parameters: "+repr(ffmpegParams))
+    return VideoEncodingJob(self, ffmpegParams, outputVideoFilePath, numberOfImages)
 
-    import subprocess
-    p = subprocess.Popen(ffmpegParams, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output = p.communicate()
-    if p.returncode != 0:
-      self.addLog("ffmpeg error output: " + output[1])
-      raise ValueError("ffmpeg returned with error")
+  def createSegmentedVideoJob(self, bitRate, frameRate, outputDir, imageFileNamePattern, videoFileName,
+                              numberOfImages, numberOfSegments):
+    """
+    Create a job that encodes segments of an image sequence in parallel and concatenates them into a single video file.
+    """
+    ffmpegPath = self.getValidatedFfmpegPath()
+
+    filePathPattern = os.path.join(outputDir, imageFileNamePattern)
+    outputVideoFilePath = os.path.join(outputDir, videoFileName)
+    segmentFilePathPattern = os.path.join(outputDir, os.path.splitext(self.getRandomFilePattern())[0]
+      + os.path.splitext(videoFileName)[1])
+    segmentBoundaries = numpy.linspace(0, numberOfImages, min(numberOfSegments, numberOfImages)+1).astype(int)
+    segmentJobs = []
+    for startImageIndex, endImageIndex in zip(segmentBoundaries[:-1], segmentBoundaries[1:]):
+      segmentFilePath = segmentFilePathPattern % len(segmentJobs)
+      ffmpegParams = [ffmpegPath,
+                      "-y", # overwrite without asking
+                      "-r", str(frameRate),
+                      "-vb", "{0}M".format(bitRate),
+                      "-start_number", str(startImageIndex),
+                      "-i", str(filePathPattern),
+                      "-frames:v", str(endImageIndex-startImageIndex),
+                      segmentFilePath]
+      segmentJobs.append(VideoEncodingJob(self, ffmpegParams, segmentFilePath, endImageIndex-startImageIndex, False))
+
+    segmentListFilePath = os.path.splitext(segmentFilePathPattern % 0)[0] + ".ffconcat"
+    ffmpegParams = [ffmpegPath,
+                    "-y", # overwrite without asking
+                    "-f", "concat",
+                    "-safe", "0",
+                    "-i", segmentListFilePath,
+                    "-c", "copy", # segments are not re-encoded
+                    outputVideoFilePath]
+    concatenationJob = VideoEncodingJob(self, ffmpegParams, outputVideoFilePath, reportStatus=False)
+
+    return SegmentedVideoEncodingJob(self, segmentJobs, concatenationJob, segmentListFilePath)
+
+  def createVideo(self, bitRate, frameRate, outputDir, imageFileNamePattern, videoFileName, numberOfImages=None,
+                  frameListFileName=None, numberOfSegments=1):
+    """
+    Create a video file from an image sequence. See createVideoJob for description of the arguments.
+    """
+    self.createVideoJob(bitRate, frameRate, outputDir, imageFileNamePattern, videoFileName, numberOfImages,
+                        frameListFileName, numberOfSegments).run()
+
+  def startCaptureJobs(self, jobs, finishedCallback=None):
+    """
+    Run capture jobs one after the other, step-by-step, from the application event loop.
+    The application remains responsive during capture. Returns a CaptureJobRunner that can be used
+    for pausing or cancelling the jobs. finishedCallback is called with the runner when all jobs are completed,
+    failed, or cancelled.
+    """
+    runner = CaptureJobRunner(jobs, finishedCallback)
+    runner.start()
+    return runner
+
+  def createVideoStreamWriter(self, bitRate, frameRate, outputDir, videoFileName):
+    """
+    Create a frame writer that sends captured frames directly to ffmpeg.
+    Pass the returned writer to captureSliceSweep or capture3dViewRotation to create a video
+    without writing temporary image files.
+    """
+    ffmpegPath = self.getValidatedFfmpegPath()
+    if not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+    outputVideoFilePath = os.path.join(outputDir, videoFileName)
+    frameWriter = FfmpegVideoStreamWriter(ffmpegPath, bitRate, frameRate, outputVideoFilePath)
+    if self.numberOfWriterThreads > 0:
+      framePipeline = self.createFramePipeline()
+      # frames must be sent to ffmpeg in order, therefore only a single thread can be used
+      framePipeline.addFrameWriter(frameWriter, 1)
+      frameWriter = framePipeline
+    return frameWriter
+
+  def isAnimationFileName(self, fileName):
+    """Returns True if the file can be written by an animation writer (see createAnimationWriter)."""
+    return os.path.splitext(fileName)[1].lower() in ['.gif', '.png', '.apng']
+
+  def getMultiResolutionOutputDir(self, outputDir, downsamplingFactor):
+    """Returns the directory where a level of a multi-resolution output is written (see createMultiResolutionWriter)."""
+    return os.path.join(outputDir, "scale_1" if downsamplingFactor == 1 else "scale_1_{0}".format(downsamplingFactor))
+
+  def createMultiResolutionWriter(self, outputDir, outputFilenamePattern=None, downsamplingFactors=(1, 2, 4),
+                                  videoFileName=None, videoBitRate=2, videoFrameRate=25):
+    """
+    Create a frame writer that saves each captured frame at multiple resolutions, so that thumbnails and previews
+    are created from the same render as the full-size images. downsamplingFactors are integer size reduction factors
+    (1 is the original size), each level is written into its own directory (see getMultiResolutionOutputDir):
+    as image files if outputFilenamePattern is specified and as a video (streamed to ffmpeg) if videoFileName is specified.
+    Downsampling and writing of all levels run in background threads. Pass the returned writer
+    to any capture method as frameWriter.
+    """
+    framePipeline = self.createFramePipeline()
+    for downsamplingFactor in downsamplingFactors:
+      levelOutputDir = self.getMultiResolutionOutputDir(outputDir, downsamplingFactor)
+      if not os.path.exists(levelOutputDir):
+        os.makedirs(levelOutputDir)
+      if outputFilenamePattern:
+        filePathPattern = os.path.join(levelOutputDir, outputFilenamePattern)
+        imageWriter = ImageSequenceFrameWriter(filePathPattern, self.getImageEncoder(filePathPattern))
+        framePipeline.addFrameWriter(DownsamplingFrameWriter(imageWriter, downsamplingFactor),
+                                     max(1, self.numberOfWriterThreads))
+      if videoFileName:
+        videoWriter = FfmpegVideoStreamWriter(self.getValidatedFfmpegPath(), videoBitRate, videoFrameRate,
+                                              os.path.join(levelOutputDir, videoFileName))
+        # frames must be sent to ffmpeg in order, therefore only a single thread can be used
+        framePipeline.addFrameWriter(DownsamplingFrameWriter(videoWriter, downsamplingFactor, evenSize=True), 1)
+    return framePipeline
+
+  def createAnimationWriter(self, frameRate, outputDir, fileName, loop=0):
+    """
+    Create a frame writer that encodes frames into an animated GIF (.gif) or animated PNG (.png, .apng) file
+    while they are captured. ffmpeg is not needed.
+    loop is the number of times the animation is played (0 means forever).
+    """
+    if not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+    filename = os.path.join(outputDir, fileName)
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension == '.gif':
+      frameWriter = GifFrameWriter(filename, frameRate, loop)
+    elif extension in ['.png', '.apng']:
+      frameWriter = ApngFrameWriter(filename, frameRate, loop)
     else:
-      self.addLog("Video export succeeded to file: "+outputVideoFilePath)
-      logging.debug("ffmpeg standard output: " + output[0])
-      logging.debug("ffmpeg error output: " + output[1])
+      raise ValueError("Unsupported animation file format: "+fileName)
+    if self.numberOfWriterThreads > 0:
+      framePipeline = self.createFramePipeline()
+      # frames must be encoded in order, therefore only a single thread can be used
+      framePipeline.addFrameWriter(frameWriter, 1)
+      frameWriter = framePipeline
+    return frameWriter
+
+  def getAnimationSizeWarning(self, fileName, viewNode):
+    """
+    Returns a warning if images of the view would be slow to encode in the animation file format
+    (see getGifSizeWarning), None otherwise.
+    """
+    if os.path.splitext(fileName)[1].lower() != '.gif':
+      return None
+    view = self.getViewFromViewNode(viewNode)
+    magnification = self.captureMagnification if self.captureBackend == 'renderWindow' else 1
+    return getGifSizeWarning(view.height * magnification, view.width * magnification)
 
   def deleteTemporaryFiles(self, outputDir, imageFileNamePattern, numberOfImages):
     """
@@ -484,45 +1496,2681 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
     filePathPattern = os.path.join(outputDir, imageFileNamePattern)
     for imageIndex in range(numberOfImages):
       filename = filePathPattern % imageIndex
+      if not os.path.exists(filename):
+        # capture was interrupted
+        continue
       logging.debug("Delete temporary file " + filename)
       os.remove(filename)
 
-  def takeScreenshot(self,name,description,type=-1):
-    # show the message even if not taking a screen shot
-    slicer.util.delayDisplay('Take screenshot: '+description+'.\nResult is available in the Annotations module.', 3000)
+  def readBatchCaptureFile(self, jobFilePath):
+    """
+    Read a batch capture job file. JSON files are always supported, YAML files (.yml, .yaml) require PyYAML.
+    """
+    with open(jobFilePath) as jobFile:
+      if os.path.splitext(jobFilePath)[1].lower() in ['.yml', '.yaml']:
+        try:
+          import yaml
+        except ImportError:
+          raise ValueError("Reading YAML job files requires PyYAML, use JSON instead: "+jobFilePath)
+        return yaml.safe_load(jobFile)
+      import json
+      return json.load(jobFile)
+
+  def getViewNodeByLayoutName(self, layoutName):
+    """Returns the slice or 3D view node that is shown in the current layout with the given name
+    (e.g., 'Red', '1', or 'View1')."""
+    lm = self.getBatchCaptureLayoutManager()
+    sliceWidget = lm.sliceWidget(layoutName)
+    if sliceWidget:
+      return sliceWidget.mrmlSliceNode()
+    for widgetIndex in range(lm.threeDViewCount):
+      viewNode = lm.threeDWidget(widgetIndex).threeDView().mrmlViewNode()
+      if layoutName in [viewNode.GetLayoutName(), 'View'+viewNode.GetLayoutName()]:
+        return viewNode
+    raise ValueError("View is not found in the current layout: {0}".format(layoutName))
 
+  def getBatchCaptureLayoutManager(self):
+    """Returns the layout manager of the application. Views only exist if the application has a main window,
+    therefore an error is raised if Slicer was started with --no-main-window.
+    """
     lm = slicer.app.layoutManager()
-    # switch on the type to get the requested window
-    widget = 0
-    if type == slicer.qMRMLScreenShotDialog.FullLayout:
-      # full layout
-      widget = lm.viewport()
-    elif type == slicer.qMRMLScreenShotDialog.ThreeD:
-      # just the 3D window
-      widget = lm.threeDWidget(0).threeDView()
-    elif type == slicer.qMRMLScreenShotDialog.Red:
-      # red slice window
-      widget = lm.sliceWidget("Red")
-    elif type == slicer.qMRMLScreenShotDialog.Yellow:
-      # yellow slice window
-      widget = lm.sliceWidget("Yellow")
-    elif type == slicer.qMRMLScreenShotDialog.Green:
-      # green slice window
+    if lm is None:
+      raise ValueError("Capture requires views of the application main window,"
+        " Slicer must not be started with --no-main-window")
+    return lm
+
+  def setBatchCaptureLayout(self, layout):
+    """Set view layout by ID or by name (e.g., 'FourUp', 'OneUpRedSlice')."""
+    if not isinstance(layout, int):
+      layout = getattr(slicer.vtkMRMLLayoutNode, "SlicerLayout"+layout+"View")
+    self.getBatchCaptureLayoutManager().setLayout(layout)
+    slicer.app.processEvents()
+
+  def createBatchCaptureJob(self, jobDescription, outputDir):
+    """
+    Create a capture job from a job description of a batch capture file (see runBatchCapture).
+    """
+    jobType = jobDescription.get('type', 'sliceSweep')
+    if jobType not in ['sliceSweep', 'nativeResolutionSliceSweep', '3dViewRotation', 'sphericalGrid', 'sequence']:
+      raise ValueError("Unsupported capture job type: {0}".format(jobType))
+    viewNode = self.getViewNodeByLayoutName(jobDescription['view'])
+    browserNode = None
+    if jobType == 'sequence':
+      browserNode = slicer.mrmlScene.GetFirstNodeByName(jobDescription['sequenceBrowser'])
+      if browserNode is None:
+        raise ValueError("Sequence browser is not found: {0}".format(jobDescription['sequenceBrowser']))
+    if not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+
+    # Output
+    frameWriter = None
+    fileNamePattern = self.getImageFileNamePattern(jobDescription.get('fileNamePattern', 'image_%05d.png'))
+    videoFileName = jobDescription.get('video')
+    if jobDescription.get('downsamplingFactors'):
+      frameWriter = self.createMultiResolutionWriter(outputDir, None if videoFileName else fileNamePattern,
+                                                     [1] + list(jobDescription['downsamplingFactors']), videoFileName,
+                                                     jobDescription.get('videoQuality', 2), jobDescription.get('frameRate', 25))
+      fileNamePattern = None
+    elif videoFileName:
+      frameRate = jobDescription.get('frameRate', 25)
+      if self.isAnimationFileName(videoFileName):
+        frameWriter = self.createAnimationWriter(frameRate, outputDir, videoFileName, jobDescription.get('loop', 0))
+      else:
+        frameWriter = self.createVideoStreamWriter(jobDescription.get('videoQuality', 2), frameRate,
+                                                   outputDir, videoFileName)
+      fileNamePattern = None
+
+    try:
+      return self.createBatchCaptureJobWithOutput(jobType, jobDescription, viewNode, browserNode, outputDir,
+                                                  fileNamePattern, frameWriter)
+    except:
+      # the writer will not receive any frames
+      self.abortFrameWriters([frameWriter])
+      raise
+
+  def createBatchCaptureJobWithOutput(self, jobType, jobDescription, viewNode, browserNode, outputDir, fileNamePattern,
+                                      frameWriter):
+    """Create the capture job of a validated batch job description, with output already set up
+    (see createBatchCaptureJob).
+    """
+    if jobType == 'sliceSweep':
+      sliceOffsetMin, sliceOffsetMax = self.getSliceOffsetRange(viewNode)
+      return self.createSliceSweepJob(viewNode, jobDescription.get('startSliceOffset', sliceOffsetMin),
+                                      jobDescription.get('endSliceOffset', sliceOffsetMax),
+                                      jobDescription.get('numberOfImages', 30), outputDir, fileNamePattern, frameWriter)
+    elif jobType == 'nativeResolutionSliceSweep':
+      return self.createNativeResolutionSliceSweepJob(viewNode, outputDir, fileNamePattern, frameWriter,
+                                                      jobDescription.get('startSliceOffset'),
+                                                      jobDescription.get('endSliceOffset'))
+    elif jobType == '3dViewRotation':
+      return self.create3dViewRotationJob(viewNode, jobDescription.get('startRotation', 180),
+                                          jobDescription.get('endRotation', 180), jobDescription.get('numberOfImages', 30),
+                                          outputDir, fileNamePattern, frameWriter, jobDescription.get('rotationAxis', 'yaw'))
+    elif jobType == 'sphericalGrid':
+      return self.createSphericalGridCaptureJob(viewNode, jobDescription['yawAngles'], jobDescription['pitchAngles'],
+                                                outputDir, fileNamePattern, jobDescription.get('spriteSheetFileNamePattern'),
+                                                jobDescription.get('indexFileName'),
+                                                jobDescription.get('spriteSheetDownsamplingFactor', 1), frameWriter)
+    elif jobType == 'sequence':
+      endItemIndex = jobDescription.get('endItemIndex', browserNode.GetNumberOfItems()-1)
+      return self.createSequenceCaptureJob(browserNode, viewNode, jobDescription.get('startItemIndex', 0), endItemIndex,
+                                           jobDescription.get('numberOfImages', browserNode.GetNumberOfItems()),
+                                           outputDir, fileNamePattern, frameWriter)
+    raise ValueError("Unsupported capture job type: {0}".format(jobType))
+
+  def runBatchCapture(self, jobFilePath, summaryFilePath=None):
+    """
+    Run all capture jobs of a job file (JSON or YAML) in the current Slicer session. Scenes are loaded once and
+    reused by all the jobs that refer to them, and a failed job does not stop the remaining ones.
+    Views are rendered in the application main window, which must exist (see main).
+    Example job file:
+
+      {
+        "scene": "head.mrb",
+        "layout": "FourUp",
+        "outputDir": "output",
+        "jobs": [
+          {"name": "axial", "type": "sliceSweep", "view": "Red", "numberOfImages": 50, "video": "axial.mp4"},
+          {"name": "spin", "type": "3dViewRotation", "view": "1", "startRotation": 180, "endRotation": 180,
+           "numberOfImages": 72, "fileNamePattern": "spin_%05d.png"}
+        ]
+      }
+
+    Job types are sliceSweep, nativeResolutionSliceSweep, 3dViewRotation, sphericalGrid, and sequence, parameters
+    have the same name as arguments of the corresponding create...Job method. scene, layout, and logic settings
+    (numberOfWriterThreads, captureBackend, captureMagnification, imageFormat, cropRegion, autoCropMargin, ffmpegPath)
+    can be set globally and overridden in jobs. They are only used while the job file runs, ffmpegPath is not saved
+    in application settings.
+    Output of each job is written to outputDir/name. If downsamplingFactors is specified (e.g., [2, 4]) then smaller
+    copies of the output are written, too (see createMultiResolutionWriter). Relative paths are relative to the job file.
+    If frameCacheDir is specified then captured frames are stored there (up to frameCacheMaximumSize bytes) and reused
+    when the job file is run again, so that only frames that are not captured yet are rendered (see FrameCache).
+    Cached frames of a scene are reused until the scene file is modified.
+    A summary of all jobs (status, error, number of frames, time, and capture statistics) is written after each job
+    to summaryFilePath (default: summary.json in outputDir). Returns the list of job summaries.
+    """
+    import json
+    # fail early instead of failing each job
+    self.getBatchCaptureLayoutManager()
+    batchDescription = self.readBatchCaptureFile(jobFilePath)
+    baseDir = os.path.dirname(os.path.abspath(jobFilePath))
+    outputDir = os.path.join(baseDir, batchDescription.get('outputDir', '.'))
+    if summaryFilePath is None:
+      summaryFilePath = os.path.join(outputDir, 'summary.json')
+    if not os.path.exists(outputDir):
+      os.makedirs(outputDir)
+
+    settingNames = ['numberOfWriterThreads', 'captureBackend', 'captureMagnification', 'imageFormat', 'cropRegion',
+      'autoCropMargin', 'ffmpegPath']
+    defaultSettings = dict((name, getattr(self, name)) for name in settingNames)
+    defaultFrameCache = (self.frameCache, self.frameCacheSceneKey)
+    loadedSceneFilePath = None
+    currentLayout = None
+    jobSummaries = []
+    for jobIndex, jobDescription in enumerate(batchDescription.get('jobs', [])):
+      jobName = jobDescription.get('name', 'job_{0:03d}'.format(jobIndex))
+      jobSummary = {'name': jobName, 'type': jobDescription.get('type', 'sliceSweep'), 'status': 'failed',
+        'outputDir': os.path.join(outputDir, jobName)}
+      startTime = timeit.default_timer()
+      self.captureStatistics = None
+      try:
+        sceneFileName = jobDescription.get('scene', batchDescription.get('scene'))
+        sceneFilePath = os.path.join(baseDir, sceneFileName) if sceneFileName else None
+        if sceneFilePath != loadedSceneFilePath:
+          self.addLog("Load scene: {0}".format(sceneFilePath))
+          slicer.mrmlScene.Clear(0)
+          loadedSceneFilePath = None
+          currentLayout = None
+          if sceneFilePath:
+            slicer.util.loadScene(sceneFilePath)
+          loadedSceneFilePath = sceneFilePath
+        layout = jobDescription.get('layout', batchDescription.get('layout'))
+        if layout is not None and layout != currentLayout:
+          self.setBatchCaptureLayout(layout)
+          currentLayout = layout
+        for name in settingNames:
+          setattr(self, name, jobDescription.get(name, batchDescription.get(name, defaultSettings[name])))
+        frameCacheDir = jobDescription.get('frameCacheDir', batchDescription.get('frameCacheDir'))
+        if frameCacheDir:
+          self.createFrameCache(os.path.join(baseDir, frameCacheDir),
+            jobDescription.get('frameCacheMaximumSize', batchDescription.get('frameCacheMaximumSize', 2.0e9)))
+          # node modification times are different each time the scene is loaded, use the scene file instead
+          self.frameCacheSceneKey = self.getFileStateKey(sceneFilePath) if sceneFilePath else None
+        else:
+          self.frameCache, self.frameCacheSceneKey = defaultFrameCache
+
+        self.addLog("Capture job: {0}".format(jobName))
+        captureJob = self.createBatchCaptureJob(jobDescription, jobSummary['outputDir'])
+        captureJob.run()
+        jobSummary['status'] = 'completed'
+        jobSummary['numberOfFrames'] = captureJob.numberOfFrames
+      except Exception as e:
+        import traceback
+        logging.error("Capture job {0} failed: {1}\n{2}".format(jobName, e, traceback.format_exc()))
+        jobSummary['error'] = str(e)
+      jobSummary['elapsedTime'] = timeit.default_timer() - startTime
+      if self.captureStatistics:
+        jobSummary['statistics'] = self.captureStatistics.getSummary()
+      jobSummaries.append(jobSummary)
+      # write summary after each job to make results available even if the process is terminated
+      with open(summaryFilePath, 'w') as summaryFile:
+        json.dump({'jobFile': os.path.abspath(jobFilePath), 'jobs': jobSummaries}, summaryFile, indent=2, sort_keys=True)
+
+    for name in settingNames:
+      setattr(self, name, defaultSettings[name])
+    self.frameCache, self.frameCacheSceneKey = defaultFrameCache
+    return jobSummaries
+
+  def takeScreenshot(self,name,description,type=-1):
+    # show the message even if not taking a screen shot
+    slicer.util.delayDisplay('Take screenshot: '+description+'.\nResult is available in the Annotations module.', 3000)
+    self.takeScreenshots([(name, description, type)])
+
+  def getScreenshotWidget(self, type):
+    """Returns (widget, view that has a render window or None, screenshot type) for a screenshot type
+    (slicer.qMRMLScreenShotDialog.FullLayout, ThreeD, Red, Yellow, Green, or -1 for the full window).
+    """
+    lm = slicer.app.layoutManager()
+    # switch on the type to get the requested window
+    if type == slicer.qMRMLScreenShotDialog.FullLayout:
+      # full layout
+      return lm.viewport(), None, type
+    elif type == slicer.qMRMLScreenShotDialog.ThreeD:
+      # just the 3D window
+      widget = lm.threeDWidget(0).threeDView()
+      return widget, widget, type
+    elif type == slicer.qMRMLScreenShotDialog.Red:
+      # red slice window
+      widget = lm.sliceWidget("Red")
+      return widget, widget.sliceView(), type
+    elif type == slicer.qMRMLScreenShotDialog.Yellow:
+      # yellow slice window
+      widget = lm.sliceWidget("Yellow")
+      return widget, widget.sliceView(), type
+    elif type == slicer.qMRMLScreenShotDialog.Green:
+      # green slice window
       widget = lm.sliceWidget("Green")
-    else:
-      # default to using the full window
-      widget = slicer.util.mainWindow()
-      # reset the type so that the node is set correctly
-      type = slicer.qMRMLScreenShotDialog.FullLayout
-
-    # grab and convert to vtk image data
-    qpixMap = qt.QPixmap().grabWidget(widget)
-    qimage = qpixMap.toImage()
-    imageData = vtk.vtkImageData()
-    slicer.qMRMLUtils().qImageToVtkImageData(qimage,imageData)
+      return widget, widget.sliceView(), type
+    # default to using the full window
+    # reset the type so that the node is set correctly
+    return slicer.util.mainWindow(), None, slicer.qMRMLScreenShotDialog.FullLayout
+
+  def takeScreenshots(self, screenshots):
+    """
+    Create annotation snapshots of multiple views at once. screenshots is a list of (name, description, type),
+    see getScreenshotWidget for available types. All views are rendered once, then each of them is grabbed once
+    (even if it is used by multiple snapshots), and snapshot nodes are added to the scene in a single batch.
+    Unlike takeScreenshot, no message is displayed.
+    """
+    screenshotWidgets = [self.getScreenshotWidget(type) for name, description, type in screenshots]
+
+    # single render pass
+    renderedViews = []
+    for widget, renderView, type in screenshotWidgets:
+      if renderView and renderView not in renderedViews:
+        renderView.forceRender()
+        renderedViews.append(renderView)
+
+    imageDataByWidget = []
+    snapshotImages = []
+    for widget, renderView, type in screenshotWidgets:
+      imageData = None
+      for grabbedWidget, grabbedImageData in imageDataByWidget:
+        if grabbedWidget == widget:
+          imageData = grabbedImageData
+      if imageData is None:
+        if self.captureBackend == 'renderWindow' and renderView:
+          imageData = self.readRenderWindowImageData(renderView.renderWindow(), self.captureMagnification)
+        else:
+          imageData = qImageToVtkImageData(qt.QPixmap().grabWidget(widget).toImage())
+        imageDataByWidget.append((widget, imageData))
+      snapshotImages.append((type, imageData))
 
     annotationLogic = slicer.modules.annotations.logic()
-    annotationLogic.CreateSnapShot(name, description, type, 1, imageData)
+    slicer.mrmlScene.StartState(slicer.mrmlScene.BatchProcessState)
+    try:
+      for (name, description, _), (type, imageData) in zip(screenshots, snapshotImages):
+        annotationLogic.CreateSnapShot(name, description, type, 1, imageData)
+    finally:
+      slicer.mrmlScene.EndState(slicer.mrmlScene.BatchProcessState)
+
+#
+# Capture jobs
+#
+
+class CaptureJob(object):
+  """Base class of operations that are performed step-by-step, so that they can be run from the application
+  event loop (see CaptureJobRunner) and cancelled at any time.
+  """
+
+  # Time between steps (in milliseconds) when the job runs from the application event loop
+  stepInterval = 0
+
+  def begin(self):
+    pass
+
+  def step(self):
+    """Perform the next step. Returns True if there are more steps.
+    """
+    return False
+
+  def end(self):
+    pass
+
+  def cancel(self):
+    """Stop the job and restore the original state. May be called at any time after begin.
+    """
+    pass
+
+  def run(self):
+    """Run the job to completion, without returning to the application event loop.
+    """
+    import time
+    try:
+      self.begin()
+      while self.step():
+        if self.stepInterval:
+          time.sleep(self.stepInterval/1000.0)
+      self.end()
+    except:
+      self.cancel()
+      raise
+
+class FrameCaptureJob(CaptureJob):
+  """Base class of jobs that capture one frame in each step.
+  Derived classes set self.view and implement saveViewState, restoreViewState, and setFrameState.
+  If the logic has a frame cache then frames are looked up in the cache before they are rendered.
+  Derived classes enable this by implementing getViewStateKey and getFrameStateKey.
+  Frames are cropped before they are written (see ScreenCaptureLogic.cropRegion). If the crop region is 'auto'
+  then the job first captures all frames to find the content region and keeps them in a temporary file,
+  then crops and writes them.
+  """
+
+  def __init__(self, logic, numberOfFrames, frameWriter):
+    self.logic = logic
+    self.numberOfFrames = numberOfFrames
+    self.frameWriter = frameWriter
+    self.view = None
+    self.nextFrameIndex = 0
+    self.statistics = None
+    self.viewStateSaved = False
+    self.viewStateKey = None
+    self.sceneStateKey = None
+    self.cropRegion = None
+    self.autoCrop = False
+    # True while frames are captured to find the content region for automatic cropping
+    self.scanningContent = False
+    self.contentMask = None
+    # Frames captured while scanning content (numpy memmap), written after the crop region is known
+    self.scannedFrames = None
+    self.scannedFramesCached = []
+    self.scannedFramesDir = None
+
+  def saveViewState(self):
+    pass
+
+  def getViewStateKey(self):
+    """Returns the view properties that affect all captured frames (view size, orientation, etc.),
+    as a value that has the same repr in all sessions. Called after saveViewState.
+    Returns None if captured frames cannot be cached.
+    """
+    return None
+
+  def getFrameStateKey(self, frameIndex):
+    """Returns the view properties that are set for the specified frame by setFrameState (see getViewStateKey).
+    """
+    return None
+
+  def getFrameCacheKey(self, frameIndex):
+    """Returns the key of the frame in the frame cache, None if the frame cannot be cached.
+    """
+    if self.logic.frameCache is None or self.viewStateKey is None:
+      return None
+    frameStateKey = self.getFrameStateKey(frameIndex)
+    if frameStateKey is None:
+      return None
+    import hashlib
+    state = (self.sceneStateKey, self.logic.captureBackend, self.logic.captureMagnification,
+      self.viewStateKey, frameStateKey)
+    return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
+  def restoreViewState(self):
+    pass
+
+  def setFrameState(self, frameIndex):
+    """Update the view (slice offset, camera, etc.) for capturing the specified frame.
+    """
+    pass
+
+  def captureFrame(self, frameIndex):
+    with self.statistics.measure('render'):
+      self.view.forceRender()
+    with self.statistics.measure('grab'):
+      return self.logic.grabViewFrame(self.view)
+
+  def begin(self):
+    if self.frameWriter is None:
+      # jobs without output can only be used as views of a multi-view capture
+      raise ValueError("No output is specified for the capture")
+    self.nextFrameIndex = 0
+    self.statistics = self.logic.startCaptureStatistics(self.frameWriter)
+    self.saveViewState()
+    self.viewStateSaved = True
+    self.viewStateKey = self.getViewStateKey() if self.logic.frameCache is not None else None
+    self.sceneStateKey = self.logic.getSceneStateKey() if self.viewStateKey is not None else None
+    self.autoCrop = self.logic.cropRegion == 'auto'
+    self.cropRegion = None if self.autoCrop else self.logic.cropRegion
+    self.scanningContent = self.autoCrop
+    self.contentMask = None
+    self.removeScannedFrames()
+
+  def getOutputFrameIndex(self, frameIndex):
+    """Returns the index of the frame in the output. Derived classes may capture frames in a different order.
+    """
+    return frameIndex
+
+  def getFrame(self, frameIndex):
+    """Returns (frame, cached): the frame from the frame cache if it is found there, otherwise the captured frame.
+    """
+    frameCacheKey = self.getFrameCacheKey(frameIndex)
+    if frameCacheKey is not None:
+      with self.statistics.measure('cache'):
+        frame = self.logic.frameCache.getFrame(frameCacheKey)
+      if frame is not None:
+        return frame, True
+    with self.statistics.measure('update'):
+      self.setFrameState(frameIndex)
+    frame = self.captureFrame(frameIndex)
+    if frameCacheKey is not None:
+      with self.statistics.measure('cache'):
+        self.logic.frameCache.addFrame(frameCacheKey, frame)
+    return frame, False
+
+  def reportProgress(self):
+    numberOfScanSteps = self.numberOfFrames if self.autoCrop else 0
+    numberOfCompletedSteps = self.nextFrameIndex if self.scanningContent else numberOfScanSteps + self.nextFrameIndex
+    self.logic.reportProgress(numberOfCompletedSteps, numberOfScanSteps + self.numberOfFrames)
+
+  def removeScannedFrames(self):
+    # release the memmap before deleting its file
+    self.scannedFrames = None
+    self.scannedFramesCached = []
+    if self.scannedFramesDir:
+      import shutil
+      shutil.rmtree(self.scannedFramesDir, ignore_errors=True)
+      self.scannedFramesDir = None
+
+  def scanContent(self):
+    frame, cached = self.getFrame(self.nextFrameIndex)
+    if self.scannedFrames is None:
+      import tempfile
+      self.scannedFramesDir = tempfile.mkdtemp()
+      self.scannedFrames = numpy.lib.format.open_memmap(os.path.join(self.scannedFramesDir, "ScannedFrames.npy"),
+        mode='w+', dtype=frame.dtype, shape=(self.numberOfFrames,)+frame.shape)
+    self.scannedFrames[self.nextFrameIndex] = frame
+    self.scannedFramesCached.append(cached)
+    with self.statistics.measure('trim'):
+      contentMask = getContentMask(frame)
+      self.contentMask = contentMask if self.contentMask is None else self.contentMask | contentMask
+    self.nextFrameIndex += 1
+    if self.nextFrameIndex == self.numberOfFrames:
+      self.cropRegion = getContentRegion(self.contentMask, frame.shape, margin=self.logic.autoCropMargin, evenSize=True)
+      logging.debug("Crop region: {0}".format(self.cropRegion))
+      self.scanningContent = False
+      self.nextFrameIndex = 0
+    self.reportProgress()
+    return True
+
+  def step(self):
+    if self.scanningContent:
+      return self.scanContent()
+    frameIndex = self.nextFrameIndex
+    if self.scannedFrames is not None:
+      frame, cached = self.scannedFrames[frameIndex], self.scannedFramesCached[frameIndex]
+    else:
+      frame, cached = self.getFrame(frameIndex)
+    if cached:
+      self.statistics.addCachedFrame()
+    frame = cropFrame(frame, self.cropRegion)
+    outputFrameIndex = self.getOutputFrameIndex(frameIndex)
+    logging.debug("Write "+self.frameWriter.getFrameDescription(outputFrameIndex))
+    with self.statistics.measure('output'):
+      self.frameWriter.writeFrame(outputFrameIndex, frame)
+    self.statistics.addFrame()
+    self.nextFrameIndex += 1
+    self.reportProgress()
+    return self.nextFrameIndex < self.numberOfFrames
+
+  def saveFrameCache(self):
+    if self.viewStateKey is not None:
+      self.logic.frameCache.save()
+
+  def end(self):
+    try:
+      self.frameWriter.close()
+    finally:
+      self.restoreViewState()
+      self.viewStateSaved = False
+      self.saveFrameCache()
+      self.removeScannedFrames()
+    self.logic.stopCaptureStatistics()
+
+  def cancel(self):
+    try:
+      if self.frameWriter is not None:
+        self.frameWriter.abort()
+    finally:
+      if self.viewStateSaved:
+        self.restoreViewState()
+        self.viewStateSaved = False
+      # frames captured so far are reused when the capture is restarted
+      self.saveFrameCache()
+      self.removeScannedFrames()
+
+class SliceSweepCaptureJob(FrameCaptureJob):
+  """Capture slice view while sweeping the slice offset between start and end offset.
+  """
+
+  def __init__(self, logic, sliceLogic, sliceView, startSliceOffset, endSliceOffset, numberOfImages, frameWriter):
+    FrameCaptureJob.__init__(self, logic, numberOfImages, frameWriter)
+    self.sliceLogic = sliceLogic
+    self.view = sliceView
+    self.startSliceOffset = startSliceOffset
+    self.offsetStepSize = (endSliceOffset-startSliceOffset)/(numberOfImages-1) if numberOfImages > 1 else 0
+
+  def saveViewState(self):
+    self.originalSliceOffset = self.sliceLogic.GetSliceOffset()
+
+  def restoreViewState(self):
+    self.sliceLogic.SetSliceOffset(self.originalSliceOffset)
+
+  def setFrameState(self, frameIndex):
+    self.sliceLogic.SetSliceOffset(self.startSliceOffset+frameIndex*self.offsetStepSize)
+
+  def getViewStateKey(self):
+    sliceNode = self.sliceLogic.GetSliceNode()
+    sliceToRas = numpy.array([[sliceNode.GetSliceToRAS().GetElement(row, column) for column in range(4)]
+      for row in range(4)])
+    # slice offset is set for each frame, only the in-plane position of the slice origin is part of the view state
+    normal = sliceToRas[:3, 2] / numpy.linalg.norm(sliceToRas[:3, 2])
+    inPlaneOrigin = sliceToRas[:3, 3] - numpy.dot(sliceToRas[:3, 3], normal) * normal
+    compositeNode = self.sliceLogic.GetSliceCompositeNode()
+    layers = None
+    if compositeNode is not None:
+      layers = (compositeNode.GetBackgroundVolumeID(), compositeNode.GetForegroundVolumeID(),
+        compositeNode.GetLabelVolumeID(), getRoundedValues([compositeNode.GetForegroundOpacity(),
+        compositeNode.GetLabelOpacity()]))
+    return ('slice', tuple(self.view.renderWindow().GetSize()), getRoundedValues(sliceToRas[:3, :3]),
+      getRoundedValues(inPlaneOrigin), getRoundedValues(sliceNode.GetFieldOfView()),
+      getRoundedValues(sliceNode.GetXYZOrigin()), layers)
+
+  def getFrameStateKey(self, frameIndex):
+    return getRoundedValues([self.startSliceOffset+frameIndex*self.offsetStepSize])
+
+class CameraPathCaptureJob(FrameCaptureJob):
+  """Capture 3D view while moving the camera along a path (see CameraPath).
+  Each pose is set directly on the camera, so errors do not accumulate, and the original camera is restored exactly.
+  Derived classes may compute the path from the original camera pose, when the capture starts (see computeCameraPath).
+  """
+
+  def __init__(self, logic, renderView, cameraPath, frameWriter, numberOfImages=None):
+    FrameCaptureJob.__init__(self, logic, numberOfImages if cameraPath is None else cameraPath.numberOfPoses, frameWriter)
+    self.view = renderView
+    self.cameraPath = cameraPath
+    self.originalCameraState = None
+
+  def computeCameraPath(self, cameraPose):
+    """Returns the camera path. cameraPose is the original (position, focal point, view up) of the camera.
+    """
+    return self.cameraPath
+
+  def getRenderer(self):
+    return self.view.renderWindow().GetRenderers().GetFirstRenderer()
+
+  def saveViewState(self):
+    camera = self.getRenderer().GetActiveCamera()
+    self.originalCameraState = (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp(),
+      camera.GetViewAngle(), camera.GetParallelScale(), camera.GetClippingRange())
+    self.cameraPath = self.computeCameraPath(self.originalCameraState[:3])
+    if self.cameraPath.numberOfPoses != self.numberOfFrames:
+      raise ValueError("Camera path has {0} poses, expected {1}".format(self.cameraPath.numberOfPoses, self.numberOfFrames))
+
+  def restoreViewState(self):
+    renderer = self.getRenderer()
+    camera = renderer.GetActiveCamera()
+    position, focalPoint, viewUp, viewAngle, parallelScale, clippingRange = self.originalCameraState
+    camera.SetPosition(position)
+    camera.SetFocalPoint(focalPoint)
+    camera.SetViewUp(viewUp)
+    camera.SetViewAngle(viewAngle)
+    camera.SetParallelScale(parallelScale)
+    camera.SetClippingRange(clippingRange)
+    renderer.UpdateLightsGeometryToFollowCamera()
+
+  def setFrameState(self, frameIndex):
+    renderer = self.getRenderer()
+    camera = renderer.GetActiveCamera()
+    camera.SetPosition(self.cameraPath.positions[frameIndex])
+    camera.SetFocalPoint(self.cameraPath.focalPoints[frameIndex])
+    camera.SetViewUp(self.cameraPath.viewUps[frameIndex])
+    renderer.ResetCameraClippingRange()
+    renderer.UpdateLightsGeometryToFollowCamera()
+
+  def getViewStateKey(self):
+    viewAngle, parallelScale = self.originalCameraState[3:5]
+    return ('camera', tuple(self.view.renderWindow().GetSize()), getRoundedValues([viewAngle, parallelScale]))
+
+  def getFrameStateKey(self, frameIndex):
+    return (getRoundedValues(self.cameraPath.positions[frameIndex]),
+      getRoundedValues(self.cameraPath.focalPoints[frameIndex]), getRoundedValues(self.cameraPath.viewUps[frameIndex]))
+
+class ViewRotationCaptureJob(CameraPathCaptureJob):
+  """Capture 3D view while rotating it from -startRotation to +endRotation (relative to current orientation).
+  rotationAxis is 'yaw' (around the view up direction, positive angle rotates the camera to the right),
+  'pitch' (around the horizontal axis of the view, positive angle rotates the camera up), 'roll' (around the
+  viewing direction), or an axis in world coordinates. Rotation center is the focal point.
+  """
+
+  def __init__(self, logic, renderView, startRotation, endRotation, numberOfImages, frameWriter, rotationAxis='yaw'):
+    CameraPathCaptureJob.__init__(self, logic, renderView, None, frameWriter, numberOfImages)
+    self.startRotation = startRotation
+    self.endRotation = endRotation
+    self.rotationAxis = rotationAxis
+
+  def computeCameraPath(self, cameraPose):
+    angles = numpy.linspace(-self.startRotation, self.endRotation, self.numberOfFrames)
+    return computeRotationCameraPath(cameraPose, getCameraRotationAxis(cameraPose, self.rotationAxis), angles)
+
+class SequenceCaptureJob(FrameCaptureJob):
+  """Capture a view while stepping through items (time points) of a sequence browser node.
+  If a prefetcher is specified then the next item is prefetched in a background thread while the current item
+  is rendered and written. prefetcher(browserNode, itemIndex) is called on the main thread (MRML may only be accessed there)
+  and returns a function that is run in a background thread, or None if there is nothing to prefetch.
+  """
+
+  def __init__(self, logic, view, browserNode, startItemIndex, endItemIndex, numberOfImages, frameWriter,
+               prefetcher=None):
+    FrameCaptureJob.__init__(self, logic, numberOfImages, frameWriter)
+    self.view = view
+    self.browserNode = browserNode
+    self.itemIndices = numpy.round(numpy.linspace(startItemIndex, endItemIndex, numberOfImages)).astype(int)
+    self.prefetcher = prefetcher
+    self.prefetchThread = None
+
+  def startPrefetch(self, itemIndex):
+    prefetchFunction = self.prefetcher(self.browserNode, itemIndex)
+    if prefetchFunction is None:
+      return
+    self.prefetchThread = threading.Thread(target=prefetchFunction)
+    self.prefetchThread.daemon = True
+    self.prefetchThread.start()
+
+  def waitForPrefetch(self):
+    if self.prefetchThread is not None:
+      self.prefetchThread.join()
+      self.prefetchThread = None
+
+  def saveViewState(self):
+    self.originalItemIndex = self.browserNode.GetSelectedItemNumber()
+
+  def restoreViewState(self):
+    self.waitForPrefetch()
+    self.browserNode.SetSelectedItemNumber(self.originalItemIndex)
+
+  def setFrameState(self, frameIndex):
+    self.waitForPrefetch()
+    itemIndex = int(self.itemIndices[frameIndex])
+    self.browserNode.SetSelectedItemNumber(itemIndex)
+    if self.prefetcher and frameIndex+1 < self.numberOfFrames and self.itemIndices[frameIndex+1] != itemIndex:
+      self.startPrefetch(int(self.itemIndices[frameIndex+1]))
+
+def createFilePrefetcher(getItemFilePaths, blockSize=1<<20):
+  """Returns a prefetcher for SequenceCaptureJob that reads the files of the next item in a background thread,
+  so that they are in the file system cache when the item is selected. Useful for sequences that load
+  item data from disk when an item is selected. getItemFilePaths(browserNode, itemIndex) is called on the main thread
+  and returns the list of files of the item.
+  """
+  def prefetcher(browserNode, itemIndex):
+    filePaths = getItemFilePaths(browserNode, itemIndex)
+    if not filePaths:
+      return None
+    def readFiles():
+      for filePath in filePaths:
+        with open(filePath, 'rb') as itemFile:
+          while itemFile.read(blockSize):
+            pass
+    return readFiles
+  return prefetcher
+
+class SphericalGridCaptureJob(CameraPathCaptureJob):
+  """Capture 3D view from all combinations of yaw and pitch angles (relative to the current orientation).
+  Output frames are ordered by pitch, then yaw: frame index = pitchIndex * numberOfYawAngles + yawIndex.
+  Poses are visited row by row, alternating the yaw direction, so that the camera never jumps far.
+  If indexFilePath is specified then a JSON file is written at the end that lists angles and images of all frames.
+  """
+
+  def __init__(self, logic, renderView, yawAngles, pitchAngles, frameWriter, indexFilePath=None,
+               imageFilePathPattern=None, spriteSheetWriter=None):
+    self.yawAngles = numpy.array(yawAngles, float)
+    self.pitchAngles = numpy.array(pitchAngles, float)
+    CameraPathCaptureJob.__init__(self, logic, renderView, None, frameWriter, len(self.yawAngles)*len(self.pitchAngles))
+    self.indexFilePath = indexFilePath
+    self.imageFilePathPattern = imageFilePathPattern
+    self.spriteSheetWriter = spriteSheetWriter
+    self.outputFrameIndices = None
+
+  def computeCameraPath(self, cameraPose):
+    cameraPath, self.outputFrameIndices = computeSphericalGridCameraPath(cameraPose, self.yawAngles, self.pitchAngles)
+    return cameraPath
+
+  def getOutputFrameIndex(self, frameIndex):
+    return self.outputFrameIndices[frameIndex]
+
+  def writeIndexFile(self):
+    import json
+    indexDir = os.path.dirname(self.indexFilePath)
+    frames = []
+    for frameIndex in range(self.numberOfFrames):
+      pitchIndex, yawIndex = divmod(frameIndex, len(self.yawAngles))
+      frameInfo = {'yaw': self.yawAngles[yawIndex], 'pitch': self.pitchAngles[pitchIndex]}
+      if self.imageFilePathPattern:
+        frameInfo['image'] = os.path.relpath(self.imageFilePathPattern % frameIndex, indexDir).replace("\\", "/")
+      if self.spriteSheetWriter:
+        frameInfo.update(self.spriteSheetWriter.getTilePlacement(frameIndex))
+      frames.append(frameInfo)
+    index = {'yawAngles': self.yawAngles.tolist(), 'pitchAngles': self.pitchAngles.tolist(), 'frames': frames}
+    if self.spriteSheetWriter:
+      index['sheets'] = [os.path.relpath(filePath, indexDir).replace("\\", "/")
+        for filePath in self.spriteSheetWriter.getSheetFilePaths()]
+      index['tileWidth'], index['tileHeight'] = self.spriteSheetWriter.getTileSize()
+    with open(self.indexFilePath, 'w') as indexFile:
+      json.dump(index, indexFile, indent=1)
+
+  def end(self):
+    CameraPathCaptureJob.end(self)
+    if self.indexFilePath:
+      self.writeIndexFile()
+
+class MultiViewCaptureJob(FrameCaptureJob):
+  """Capture multiple views in one pass. In each step, the state of all views is updated by their view jobs,
+  all views are rendered and grabbed, and the images are combined into a single mosaic frame.
+  Frame writers of view jobs (if specified) receive the images of the individual views, which are not cropped.
+  """
+
+  def __init__(self, logic, viewJobs, frameWriter, numberOfColumns=None):
+    FrameCaptureJob.__init__(self, logic, viewJobs[0].numberOfFrames, frameWriter)
+    for viewJob in viewJobs:
+      if viewJob.numberOfFrames != self.numberOfFrames:
+        raise ValueError("All views must be captured with the same number of images")
+    self.viewJobs = viewJobs
+    self.numberOfColumns = numberOfColumns
+    # reused between frames
+    self.mosaic = None
+
+  def getViewFrameWriters(self):
+    return [viewJob.frameWriter for viewJob in self.viewJobs if viewJob.frameWriter]
+
+  def saveViewState(self):
+    for viewJob in self.viewJobs:
+      viewJob.saveViewState()
+
+  def restoreViewState(self):
+    for viewJob in reversed(self.viewJobs):
+      viewJob.restoreViewState()
+
+  def setFrameState(self, frameIndex):
+    for viewJob in self.viewJobs:
+      viewJob.setFrameState(frameIndex)
+
+  def getViewStateKey(self):
+    if self.getViewFrameWriters():
+      # frames of individual views are only available when they are rendered
+      return None
+    viewStateKeys = tuple(viewJob.getViewStateKey() for viewJob in self.viewJobs)
+    if None in viewStateKeys:
+      return None
+    return ('multiView', self.numberOfColumns, viewStateKeys)
+
+  def getFrameStateKey(self, frameIndex):
+    frameStateKeys = tuple(viewJob.getFrameStateKey(frameIndex) for viewJob in self.viewJobs)
+    return None if None in frameStateKeys else frameStateKeys
+
+  def captureFrame(self, frameIndex):
+    with self.statistics.measure('render'):
+      for viewJob in self.viewJobs:
+        viewJob.view.forceRender()
+    with self.statistics.measure('grab'):
+      viewFrames = [self.logic.grabViewFrame(viewJob.view) for viewJob in self.viewJobs]
+    # each frame is captured once, also when scanning content for automatic cropping
+    with self.statistics.measure('output'):
+      for viewJob, viewFrame in zip(self.viewJobs, viewFrames):
+        if viewJob.frameWriter:
+          viewJob.frameWriter.writeFrame(frameIndex, viewFrame)
+    self.mosaic = composeMosaic(viewFrames, self.numberOfColumns, self.mosaic)
+    return self.mosaic
+
+  def begin(self):
+    FrameCaptureJob.begin(self)
+    for viewFrameWriter in self.getViewFrameWriters():
+      viewFrameWriter.setStatistics(self.statistics)
+
+  def end(self):
+    try:
+      for viewFrameWriter in self.getViewFrameWriters():
+        viewFrameWriter.close()
+    finally:
+      FrameCaptureJob.end(self)
+
+  def cancel(self):
+    try:
+      for viewFrameWriter in self.getViewFrameWriters():
+        viewFrameWriter.abort()
+    finally:
+      FrameCaptureJob.cancel(self)
+
+class VideoEncodingJob(CaptureJob):
+  """Create a video file from an image sequence using ffmpeg, without blocking the application.
+  Progress is reported from the frame number printed by ffmpeg.
+  """
+
+  stepInterval = 100
+
+  def __init__(self, logic, ffmpegParams, outputVideoFilePath, numberOfFrames=None, reportStatus=True):
+    self.logic = logic
+    self.ffmpegParams = ffmpegParams
+    self.outputVideoFilePath = outputVideoFilePath
+    self.numberOfFrames = numberOfFrames
+    # if disabled then no messages, progress, and statistics are reported (used when the job is part of another job)
+    self.reportStatus = reportStatus
+    self.process = None
+    self.outputFile = None
+
+  def begin(self):
+    import subprocess
+    import tempfile
+    if self.reportStatus:
+      self.logic.addLog("Export to video...")
+    logging.debug("ffmpeg parameters: "+repr(self.ffmpegParams))
+    self.startTime = timeit.default_timer()
+    # Output is redirected to a file, as an unread pipe would block ffmpeg when its buffer is full
+    self.outputFile = tempfile.TemporaryFile()
+    self.process = subprocess.Popen(self.ffmpegParams, stdout=self.outputFile, stderr=self.outputFile)
+
+  def getOutput(self, maximumLength=None):
+    self.outputFile.seek(0, os.SEEK_END)
+    outputLength = self.outputFile.tell()
+    if maximumLength is not None and outputLength > maximumLength:
+      self.outputFile.seek(outputLength-maximumLength)
+    else:
+      self.outputFile.seek(0)
+    return self.outputFile.read().decode('utf-8', 'replace')
+
+  def getNumberOfEncodedFrames(self):
+    """Returns the last frame number that ffmpeg printed."""
+    import re
+    encodedFrameNumbers = re.findall(r"frame=\s*(\d+)", self.getOutput(4096))
+    return int(encodedFrameNumbers[-1]) if encodedFrameNumbers else 0
+
+  def step(self):
+    if self.process.poll() is not None:
+      return False
+    if self.numberOfFrames and self.reportStatus:
+      self.logic.reportProgress(min(self.getNumberOfEncodedFrames(), self.numberOfFrames-1), self.numberOfFrames)
+    return True
+
+  def end(self):
+    self.process.wait()
+    output = self.getOutput()
+    self.outputFile.close()
+    self.encodingTime = timeit.default_timer()-self.startTime
+    if self.logic.captureStatistics and self.reportStatus:
+      self.logic.captureStatistics.addDuration('video', self.encodingTime)
+      if os.path.exists(self.outputVideoFilePath):
+        self.logic.captureStatistics.addBytesWritten(os.path.getsize(self.outputVideoFilePath))
+    if self.process.returncode != 0:
+      self.logic.addLog("ffmpeg error output: " + output)
+      raise ValueError("ffmpeg returned with error")
+    if self.reportStatus:
+      self.logic.addLog("Video export succeeded to file: "+self.outputVideoFilePath)
+    logging.debug("ffmpeg output: " + output)
+
+  def cancel(self):
+    if self.outputFile is None or self.outputFile.closed:
+      return
+    if self.process is not None and self.process.poll() is None:
+      self.process.kill()
+      self.process.wait()
+    self.outputFile.close()
+
+class SegmentedVideoEncodingJob(CaptureJob):
+  """Create a video file from an image sequence by encoding segments of the sequence in parallel,
+  in separate ffmpeg processes, and then concatenating the segments without re-encoding.
+  Encoding time of each segment is added to the 'video segment' stage of capture statistics.
+  The list of segments that is read by the concatenation job is written to segmentListFilePath when the job begins.
+  Segments and the list are deleted at the end.
+  """
+
+  stepInterval = 100
+
+  def __init__(self, logic, segmentJobs, concatenationJob, segmentListFilePath):
+    self.logic = logic
+    self.segmentJobs = segmentJobs
+    self.concatenationJob = concatenationJob
+    self.segmentListFilePath = segmentListFilePath
+    self.temporaryFilePaths = [segmentJob.outputVideoFilePath for segmentJob in segmentJobs] + [segmentListFilePath]
+    self.numberOfFrames = sum([segmentJob.numberOfFrames for segmentJob in segmentJobs])
+    self.runningJobs = []
+
+  def begin(self):
+    self.logic.addLog("Export to video in {0} segments...".format(len(self.segmentJobs)))
+    self.startTime = timeit.default_timer()
+    with open(self.segmentListFilePath, 'w') as segmentListFile:
+      segmentListFile.write("ffconcat version 1.0\n")
+      for segmentJob in self.segmentJobs:
+        segmentListFile.write("file '{0}'\n".format(os.path.basename(segmentJob.outputVideoFilePath)))
+    for segmentJob in self.segmentJobs:
+      segmentJob.begin()
+    self.runningJobs = list(self.segmentJobs)
+
+  def step(self):
+    if self.runningJobs:
+      for segmentJob in list(self.runningJobs):
+        if not segmentJob.step():
+          self.runningJobs.remove(segmentJob)
+          segmentJob.end()
+          segmentIndex = self.segmentJobs.index(segmentJob)
+          self.logic.addLog("Segment {0} ({1} frames) encoded in {2:.2f}s".format(
+            segmentIndex, segmentJob.numberOfFrames, segmentJob.encodingTime))
+          if self.logic.captureStatistics:
+            self.logic.captureStatistics.addDuration('video segment', segmentJob.encodingTime)
+      if self.runningJobs:
+        numberOfEncodedFrames = sum([segmentJob.numberOfFrames for segmentJob in self.segmentJobs
+          if segmentJob not in self.runningJobs])
+        numberOfEncodedFrames += sum([min(segmentJob.getNumberOfEncodedFrames(), segmentJob.numberOfFrames)
+          for segmentJob in self.runningJobs])
+        self.logic.reportProgress(min(numberOfEncodedFrames, self.numberOfFrames-1), self.numberOfFrames)
+        return True
+      self.concatenationJob.begin()
+    return self.concatenationJob.step()
+
+  def deleteTemporaryFiles(self):
+    for filePath in self.temporaryFilePaths:
+      if os.path.exists(filePath):
+        os.remove(filePath)
+
+  def end(self):
+    try:
+      self.concatenationJob.end()
+    finally:
+      self.deleteTemporaryFiles()
+    if self.logic.captureStatistics:
+      self.logic.captureStatistics.addDuration('video', timeit.default_timer()-self.startTime)
+      self.logic.captureStatistics.addBytesWritten(os.path.getsize(self.concatenationJob.outputVideoFilePath))
+    self.logic.addLog("Video export succeeded to file: "+self.concatenationJob.outputVideoFilePath)
+
+  def cancel(self):
+    for segmentJob in self.segmentJobs:
+      segmentJob.cancel()
+    self.concatenationJob.cancel()
+    self.deleteTemporaryFiles()
+
+class CaptureJobRunner(object):
+  """Runs capture jobs one after the other from the application event loop, one step at a time,
+  so that the application remains responsive. Jobs can be paused, resumed, and cancelled.
+  After completion, error contains the exception that stopped the jobs (if any) and cancelled is True if the
+  jobs were cancelled.
+  """
+
+  def __init__(self, jobs, finishedCallback=None):
+    self.jobs = list(jobs)
+    self.finishedCallback = finishedCallback
+    self.currentJobIndex = 0
+    self.currentJobStarted = False
+    self.running = False
+    self.paused = False
+    self.cancelled = False
+    self.error = None
+    self.timer = qt.QTimer()
+    self.timer.connect('timeout()', self.onTimeout)
+
+  def start(self):
+    self.running = True
+    if not self.jobs:
+      self.finish()
+      return
+    self.scheduleNextStep()
+
+  def scheduleNextStep(self):
+    self.timer.setInterval(self.jobs[self.currentJobIndex].stepInterval)
+    if not self.paused:
+      self.timer.start()
+
+  def pause(self):
+    self.paused = True
+    self.timer.stop()
+
+  def resume(self):
+    self.paused = False
+    if self.running:
+      self.timer.start()
+
+  def cancel(self):
+    if not self.running:
+      return
+    self.timer.stop()
+    self.cancelled = True
+    if self.currentJobStarted:
+      try:
+        self.jobs[self.currentJobIndex].cancel()
+      except Exception as e:
+        logging.error("Failed to cancel capture: {0}".format(e))
+    self.finish()
+
+  def isStopped(self):
+    """Returns True if the jobs were cancelled while a step was running. Steps may process application events
+    (for example, to display progress), therefore cancel may be called from within a step.
+    """
+    return self.cancelled or not self.running
+
+  def onTimeout(self):
+    if self.isStopped():
+      return
+    job = self.jobs[self.currentJobIndex]
+    try:
+      if not self.currentJobStarted:
+        self.currentJobStarted = True
+        job.begin()
+      if self.isStopped():
+        return
+      if job.step():
+        return
+      if self.isStopped():
+        return
+      job.end()
+    except Exception as e:
+      if self.isStopped():
+        # the job has been already cancelled
+        logging.error("Capture failed after it was cancelled: {0}".format(e))
+        return
+      import traceback
+      traceback.print_exc()
+      self.timer.stop()
+      self.error = e
+      try:
+        job.cancel()
+      except Exception as cancelError:
+        logging.error("Failed to cancel capture: {0}".format(cancelError))
+      self.finish()
+      return
+    if self.isStopped():
+      return
+    self.currentJobIndex += 1
+    self.currentJobStarted = False
+    if self.currentJobIndex < len(self.jobs):
+      self.scheduleNextStep()
+    else:
+      self.timer.stop()
+      self.finish()
+
+  def finish(self):
+    self.running = False
+    if self.finishedCallback:
+      self.finishedCallback(self)
+
+#
+# Camera paths
+#
+
+class CameraPath(object):
+  """Sequence of camera poses. positions, focalPoints, and viewUps are numpy arrays (number of poses, 3).
+  View up directions are normalized and made orthogonal to the viewing direction.
+  """
+
+  def __init__(self, positions, focalPoints, viewUps):
+    self.positions = numpy.array(positions, float).reshape(-1, 3)
+    self.focalPoints = numpy.array(focalPoints, float).reshape(-1, 3)
+    viewUps = numpy.array(viewUps, float).reshape(-1, 3)
+    if not (len(self.positions) == len(self.focalPoints) == len(viewUps)):
+      raise ValueError("Number of camera positions, focal points, and view up directions must be the same")
+    directions = self.focalPoints - self.positions
+    directions /= numpy.linalg.norm(directions, axis=1)[:, numpy.newaxis]
+    viewUps -= (viewUps * directions).sum(axis=1)[:, numpy.newaxis] * directions
+    self.viewUps = viewUps / numpy.linalg.norm(viewUps, axis=1)[:, numpy.newaxis]
+
+  @property
+  def numberOfPoses(self):
+    return len(self.positions)
+
+def computeRotationMatrices(axis, angles):
+  """Returns rotation matrices (number of angles, 3, 3) that rotate around the axis by the angles (in degrees).
+  """
+  x, y, z = numpy.array(axis, float) / numpy.linalg.norm(axis)
+  crossProductMatrix = numpy.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+  angles = numpy.radians(numpy.array(angles, float))[:, numpy.newaxis, numpy.newaxis]
+  # Rodrigues' rotation formula, for all angles at once
+  return (numpy.eye(3) + numpy.sin(angles) * crossProductMatrix
+    + (1 - numpy.cos(angles)) * numpy.dot(crossProductMatrix, crossProductMatrix))
+
+def getCameraRotationAxis(cameraPose, rotationAxis):
+  """Returns rotation axis in world coordinates. rotationAxis is 'yaw', 'pitch', 'roll' (see ViewRotationCaptureJob)
+  or an axis in world coordinates. cameraPose is (position, focal point, view up).
+  """
+  if not isinstance(rotationAxis, str):
+    return numpy.array(rotationAxis, float)
+  position, focalPoint, viewUp = [numpy.array(vector, float) for vector in cameraPose]
+  direction = (focalPoint - position) / numpy.linalg.norm(focalPoint - position)
+  # same directions as ctkVTKRenderView yaw right (vtkCamera::Azimuth with negative angle), pitch up, and roll
+  axes = {'yaw': -viewUp, 'pitch': numpy.cross(viewUp, direction), 'roll': direction}
+  if rotationAxis not in axes:
+    raise ValueError("Unknown rotation axis: "+rotationAxis)
+  return axes[rotationAxis]
+
+def computeRotationCameraPath(cameraPose, axis, angles, center=None):
+  """Rotate the camera around an axis (in world coordinates) that goes through center (focal point by default).
+  Used for turntable animations (rotation around a fixed axis) and elevation arcs (rotation around the horizontal
+  axis of the view). cameraPose is (position, focal point, view up). angles are in degrees.
+  Returns a CameraPath with one pose for each angle.
+  """
+  position, focalPoint, viewUp = [numpy.array(vector, float) for vector in cameraPose]
+  if center is None:
+    center = focalPoint
+  rotations = computeRotationMatrices(axis, angles)
+  return CameraPath(center + numpy.dot(rotations, position - center),
+    center + numpy.dot(rotations, focalPoint - center), numpy.dot(rotations, viewUp))
+
+def computeSphericalGridCameraPath(cameraPose, yawAngles, pitchAngles):
+  """Compute camera poses for all combinations of yaw and pitch angles (in degrees, relative to cameraPose),
+  in an order that minimizes camera movement: rows of constant pitch, with alternating yaw direction.
+  Returns the CameraPath and grid index (pitchIndex * number of yaw angles + yawIndex) of each pose.
+  """
+  numberOfYawAngles = len(yawAngles)
+  numberOfPitchAngles = len(pitchAngles)
+  position, focalPoint, viewUp = [numpy.array(vector, float) for vector in cameraPose]
+  yawRotations = computeRotationMatrices(getCameraRotationAxis(cameraPose, 'yaw'), yawAngles)
+  pitchRotations = computeRotationMatrices(getCameraRotationAxis(cameraPose, 'pitch'), pitchAngles)
+  # rotation for each (pitch, yaw) grid position: pitch first, then yaw around the original vertical axis
+  rotations = numpy.einsum('yij,pjk->pyik', yawRotations, pitchRotations).reshape(-1, 3, 3)
+  gridIndices = numpy.arange(numberOfPitchAngles * numberOfYawAngles).reshape(numberOfPitchAngles, numberOfYawAngles)
+  gridIndices[1::2] = gridIndices[1::2, ::-1]
+  gridIndices = gridIndices.ravel()
+  rotations = rotations[gridIndices]
+  cameraPath = CameraPath(focalPoint + numpy.dot(rotations, position - focalPoint),
+    numpy.repeat(focalPoint[numpy.newaxis], len(rotations), axis=0), numpy.dot(rotations, viewUp))
+  return cameraPath, gridIndices
+
+def interpolateCatmullRom(points, times, sampleTimes):
+  """Interpolate points (number of points, components) at sampleTimes with a Catmull-Rom spline
+  that goes through each point at the corresponding time.
+  """
+  points = numpy.array(points, float)
+  if len(points) == 1:
+    return numpy.repeat(points, len(sampleTimes), axis=0)
+  times = numpy.array(times, float)
+  sampleTimes = numpy.clip(numpy.array(sampleTimes, float), times[0], times[-1])
+  segments = numpy.clip(numpy.searchsorted(times, sampleTimes, side='right') - 1, 0, len(points) - 2)
+  u = ((sampleTimes - times[segments]) / (times[segments + 1] - times[segments]))[:, numpy.newaxis]
+  # end points are duplicated so that the curve goes through all the points
+  paddedPoints = numpy.concatenate([points[:1], points, points[-1:]])
+  p0, p1, p2, p3 = [paddedPoints[segments + offset] for offset in range(4)]
+  return 0.5 * (2 * p1 + (p2 - p0) * u + (2 * p0 - 5 * p1 + 4 * p2 - p3) * u ** 2 + (3 * p1 - p0 - 3 * p2 + p3) * u ** 3)
+
+def computeKeyframeCameraPath(keyframePoses, numberOfPoses, keyframeTimes=None):
+  """Compute a smooth camera path (fly-through) that goes through keyframe poses.
+  keyframePoses is a list of (position, focal point, view up). keyframeTimes specifies when each keyframe is reached
+  (increasing values, evenly spaced by default). Poses are sampled at evenly spaced times.
+  """
+  if keyframeTimes is None:
+    keyframeTimes = numpy.arange(len(keyframePoses))
+  keyframePoses = numpy.array(keyframePoses, float)
+  sampleTimes = numpy.linspace(keyframeTimes[0], keyframeTimes[-1], numberOfPoses)
+  return CameraPath(*[interpolateCatmullRom(keyframePoses[:, component], keyframeTimes, sampleTimes)
+    for component in range(3)])
+
+#
+# Frame cache
+#
+
+def getRoundedValues(values, decimals=6):
+  """Returns values as a tuple of floats that are rounded to make them usable in frame cache keys.
+  """
+  return tuple(round(float(value), decimals) for value in numpy.ravel(values))
+
+class FrameCache(object):
+  """Stores captured frames in a directory, so that frames of a view state that has been already captured
+  do not have to be rendered again, for example when an interrupted capture is restarted or an unchanged scene
+  is captured again. Frames are identified by a key (see FrameCaptureJob.getFrameCacheKey) and stored in .npy files.
+  The manifest file lists frames from the least to the most recently used. Least recently used frames are removed
+  when the total size of frame files exceeds maximumSize (in bytes).
+  Frame files that are not in the manifest (the application was terminated before it was saved) are reused, too.
+  Frames are written uncompressed when they are captured, before they are passed to the frame writer, which adds
+  the time of writing the raw image to each frame that is not found in the cache.
+  """
+
+  manifestFileName = "manifest.json"
+
+  # Minimum time between saving the manifest while frames are added (in seconds)
+  saveInterval = 5.0
+
+  def __init__(self, cacheDir, maximumSize=2.0e9):
+    import collections
+    self.cacheDir = cacheDir
+    self.maximumSize = maximumSize
+    # frame key: file size, ordered from the least to the most recently used
+    self.frameSizes = collections.OrderedDict()
+    self.totalSize = 0
+    self.lastSaveTime = None
+    if not os.path.exists(cacheDir):
+      os.makedirs(cacheDir)
+    self.load()
+
+  def getFrameFilePath(self, key):
+    return os.path.join(self.cacheDir, key+".npy")
+
+  def getManifestFilePath(self):
+    return os.path.join(self.cacheDir, self.manifestFileName)
+
+  def load(self):
+    import json
+    keys = []
+    if os.path.exists(self.getManifestFilePath()):
+      try:
+        with open(self.getManifestFilePath()) as manifestFile:
+          keys = [frame['key'] for frame in json.load(manifestFile)['frames']]
+      except (ValueError, KeyError, TypeError) as e:
+        logging.warning("Frame cache manifest {0} is invalid, it is recreated: {1}".format(self.getManifestFilePath(), e))
+    listedKeys = set(keys)
+    unlistedKeys = sorted([fileName[:-len(".npy")] for fileName in os.listdir(self.cacheDir)
+      if fileName.endswith(".npy") and fileName[:-len(".npy")] not in listedKeys])
+    for key in unlistedKeys + keys:
+      if os.path.exists(self.getFrameFilePath(key)):
+        self.frameSizes[key] = os.path.getsize(self.getFrameFilePath(key))
+        self.totalSize += self.frameSizes[key]
+    self.removeLeastRecentlyUsedFrames()
+
+  def save(self):
+    import json
+    manifest = {'version': 1, 'frames': [{'key': key, 'size': size} for key, size in self.frameSizes.items()]}
+    # write to a temporary file first to never leave a partially written manifest
+    temporaryFilePath = self.getManifestFilePath()+".tmp"
+    with open(temporaryFilePath, 'w') as manifestFile:
+      json.dump(manifest, manifestFile)
+    os.replace(temporaryFilePath, self.getManifestFilePath())
+    self.lastSaveTime = timeit.default_timer()
+
+  def __len__(self):
+    return len(self.frameSizes)
+
+  def __contains__(self, key):
+    return key in self.frameSizes
+
+  def getFrame(self, key):
+    """Returns the frame that is stored with the specified key, None if there is no such frame.
+    """
+    if key not in self.frameSizes:
+      return None
+    try:
+      frame = numpy.load(self.getFrameFilePath(key))
+    except (IOError, ValueError) as e:
+      logging.warning("Failed to read cached frame {0}: {1}".format(key, e))
+      self.removeFrame(key)
+      return None
+    # mark as most recently used
+    self.frameSizes[key] = self.frameSizes.pop(key)
+    return frame
+
+  def addFrame(self, key, frame):
+    """Store a frame with the specified key. The frame is written uncompressed, in the calling thread.
+    """
+    # write to a temporary file first so that an interrupted write does not leave a corrupted frame file
+    temporaryFilePath = self.getFrameFilePath(key)+".tmp"
+    with open(temporaryFilePath, 'wb') as frameFile:
+      numpy.save(frameFile, frame)
+      frameSize = frameFile.tell()
+    # replaced atomically, the previous frame file remains if the application is terminated
+    os.replace(temporaryFilePath, self.getFrameFilePath(key))
+    if key in self.frameSizes:
+      self.totalSize -= self.frameSizes.pop(key)
+    self.frameSizes[key] = frameSize
+    self.totalSize += self.frameSizes[key]
+    self.removeLeastRecentlyUsedFrames()
+    if self.lastSaveTime is None or timeit.default_timer() - self.lastSaveTime > self.saveInterval:
+      self.save()
+
+  def removeFrame(self, key):
+    self.totalSize -= self.frameSizes.pop(key)
+    if os.path.exists(self.getFrameFilePath(key)):
+      os.remove(self.getFrameFilePath(key))
+
+  def removeLeastRecentlyUsedFrames(self):
+    # the most recently added frame is kept even if it is larger than maximumSize
+    while self.totalSize > self.maximumSize and len(self.frameSizes) > 1:
+      self.removeFrame(next(iter(self.frameSizes)))
+
+  def clear(self):
+    for key in list(self.frameSizes.keys()):
+      self.removeFrame(key)
+    self.save()
+
+#
+# Frame writers
+#
+
+def vtkImageDataToArray(imageData):
+  """Get RGB pixels of a vtkImageData as a numpy array (rows, columns, 3), with the top row first.
+  """
+  from vtk.util import numpy_support
+  columns, rows, _ = imageData.GetDimensions()
+  numberOfComponents = imageData.GetNumberOfScalarComponents()
+  pixels = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+  # VTK stores the bottom row first, drop alpha channel if present
+  return numpy.ascontiguousarray(pixels.reshape(rows, columns, numberOfComponents)[::-1, :, :3])
+
+def arrayToVtkImageData(frame):
+  """Create a vtkImageData from a numpy array (rows, columns, components) that has the top row first.
+  """
+  from vtk.util import numpy_support
+  rows, columns, numberOfComponents = frame.shape
+  imageData = vtk.vtkImageData()
+  imageData.SetDimensions(columns, rows, 1)
+  # Pixels are copied only once (while flipping the row order), the VTK array refers to this numpy array
+  pixels = numpy.empty((rows*columns, numberOfComponents), numpy.uint8)
+  pixels.reshape(rows, columns, numberOfComponents)[:] = frame[::-1]
+  scalars = numpy_support.numpy_to_vtk(pixels, deep=False, array_type=vtk.VTK_UNSIGNED_CHAR)
+  imageData.GetPointData().SetScalars(scalars)
+  return imageData
+
+def getQImagePixels(qimage):
+  """Returns RGB pixels of a 32-bit QImage (such as images of grabbed widgets) as a numpy array view
+  (rows, columns, 3) of the image buffer, with the top row first. No pixels are copied, therefore the QImage
+  must be kept alive while the array is used. Returns None if the image format is not 32-bit RGB
+  or the Python wrapping of Qt does not provide access to the image buffer.
+  """
+  if qimage.format() not in [qt.QImage.Format_RGB32, qt.QImage.Format_ARGB32, qt.QImage.Format_ARGB32_Premultiplied]:
+    return None
+  rows = qimage.height()
+  bytesPerLine = qimage.bytesPerLine()
+  try:
+    buffer = numpy.frombuffer(qimage.constBits(), numpy.uint8, count=rows*bytesPerLine)
+  except (AttributeError, TypeError, ValueError):
+    return None
+  if sys.byteorder != 'little':
+    return None
+  # 32-bit pixels are stored as 0xAARRGGBB, which is B, G, R, A byte order on little-endian systems
+  return buffer.reshape(rows, bytesPerLine)[:, :qimage.width()*4].reshape(rows, qimage.width(), 4)[:, :, 2::-1]
+
+def qImageToArray(qimage):
+  """Get RGB pixels of a QImage as a numpy array (rows, columns, 3), with the top row first.
+  """
+  pixels = getQImagePixels(qimage)
+  if pixels is not None:
+    return numpy.ascontiguousarray(pixels)
+  imageData = vtk.vtkImageData()
+  slicer.qMRMLUtils().qImageToVtkImageData(qimage, imageData)
+  return vtkImageDataToArray(imageData)
+
+def qImageToVtkImageData(qimage):
+  """Get RGB pixels of a QImage as a vtkImageData. Pixels are copied only once.
+  """
+  pixels = getQImagePixels(qimage)
+  if pixels is not None:
+    return arrayToVtkImageData(pixels)
+  imageData = vtk.vtkImageData()
+  slicer.qMRMLUtils().qImageToVtkImageData(qimage, imageData)
+  return imageData
+
+def composeMosaic(frames, numberOfColumns=None, mosaic=None):
+  """Arrange frames (numpy arrays of rows, columns, components) in a grid, in row-major order.
+  Cell size is the size of the largest frame. Frames are placed in the top-left corner of their cell.
+  If mosaic is specified and it has the right size then it is reused (empty cells are not cleared).
+  Returns the mosaic image.
+  """
+  numberOfFrames = len(frames)
+  if not numberOfColumns:
+    numberOfColumns = int(numpy.ceil(numpy.sqrt(numberOfFrames)))
+  numberOfRows = int(numpy.ceil(float(numberOfFrames)/numberOfColumns))
+  cellRows = max([frame.shape[0] for frame in frames])
+  cellColumns = max([frame.shape[1] for frame in frames])
+  numberOfComponents = frames[0].shape[2]
+  mosaicShape = (numberOfRows*cellRows, numberOfColumns*cellColumns, numberOfComponents)
+  if mosaic is None or mosaic.shape != mosaicShape:
+    mosaic = numpy.zeros(mosaicShape, numpy.uint8)
+  if all([frame.shape == frames[0].shape for frame in frames]):
+    # View the mosaic as a grid of cells (gridRow, gridColumn, cellRow, cellColumn, component)
+    # and copy all the frames into their cells at once
+    cells = mosaic.reshape(numberOfRows, cellRows, numberOfColumns, cellColumns, numberOfComponents).transpose(0, 2, 1, 3, 4)
+    frameIndices = numpy.arange(numberOfFrames)
+    cells[frameIndices // numberOfColumns, frameIndices % numberOfColumns] = numpy.array(frames)
+  else:
+    for frameIndex, frame in enumerate(frames):
+      gridRow, gridColumn = divmod(frameIndex, numberOfColumns)
+      mosaic[gridRow*cellRows:gridRow*cellRows+frame.shape[0],
+        gridColumn*cellColumns:gridColumn*cellColumns+frame.shape[1]] = frame
+  return mosaic
+
+pngSignature = b"\x89PNG\r\n\x1a\n"
+
+def pngChunk(chunkType, data):
+  import struct
+  import zlib
+  return (struct.pack(">I", len(data)) + chunkType + data
+    + struct.pack(">I", zlib.crc32(chunkType + data) & 0xffffffff))
+
+def pngHeaderChunk(frame):
+  import struct
+  rows, columns, numberOfComponents = frame.shape
+  colorType = {1: 0, 2: 4, 3: 2, 4: 6}[numberOfComponents]
+  return pngChunk(b"IHDR", struct.pack(">IIBBBBB", columns, rows, 8, colorType, 0, 0, 0))
+
+def compressPngImageData(frame, compressionLevel=6, strategy=None):
+  """Filter and compress a numpy array (rows, columns, components) into PNG image data (content of IDAT chunks).
+  strategy is a zlib compression strategy (e.g., zlib.Z_RLE, which is much faster than the default strategy
+  and works well for images that contain large uniform regions).
+  """
+  import zlib
+  rows, columns, numberOfComponents = frame.shape
+  # Use "Up" filter for all rows: store difference to the previous row (modulo 256), computed for all rows at once
+  pixels = frame.reshape(rows, columns*numberOfComponents)
+  filteredRows = numpy.empty((rows, columns*numberOfComponents+1), numpy.uint8)
+  filteredRows[:, 0] = 2
+  filteredRows[0, 1:] = pixels[0]
+  numpy.subtract(pixels[1:], pixels[:-1], out=filteredRows[1:, 1:])
+  if strategy is None:
+    return zlib.compress(filteredRows.tobytes(), compressionLevel)
+  compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, zlib.MAX_WBITS, 8, strategy)
+  return compressor.compress(filteredRows.tobytes()) + compressor.flush()
+
+def downsampleFrame(frame, factor):
+  """Reduce size of a frame (rows, columns, components) by an integer factor by averaging blocks of pixels.
+  Rows and columns that do not fill a complete block are dropped.
+  """
+  if factor == 1:
+    return frame
+  rows, columns, numberOfComponents = frame.shape
+  rows -= rows % factor
+  columns -= columns % factor
+  blocks = frame[:rows, :columns].reshape(rows // factor, factor, columns // factor, factor, numberOfComponents)
+  blockSums = blocks.sum(axis=(1, 3), dtype=numpy.uint32)
+  return ((blockSums + factor * factor // 2) // (factor * factor)).astype(frame.dtype)
+
+def encodePng(frame, compressionLevel=6, strategy=None):
+  """Compress a numpy array (rows, columns, components) into PNG file content.
+  Only numpy and zlib are used, which do not hold the Python global interpreter lock during compression,
+  therefore multiple frames can be encoded in parallel in separate threads.
+  """
+  return (pngSignature + pngHeaderChunk(frame)
+    + pngChunk(b"IDAT", compressPngImageData(frame, compressionLevel, strategy)) + pngChunk(b"IEND", b""))
+
+def encodeTiff(frame):
+  """Store a numpy array (rows, columns, components) in uncompressed TIFF file content.
+  Grayscale and RGB images are supported.
+  """
+  import struct
+  rows, columns, numberOfComponents = frame.shape
+  if numberOfComponents not in [1, 3]:
+    raise ValueError("Only grayscale and RGB images can be written to TIFF files")
+  shortType = 3
+  longType = 4
+  numberOfEntries = 10
+  # header, image file directory, bits per sample values, pixel data
+  bitsPerSampleOffset = 8 + 2 + numberOfEntries*12 + 4
+  pixelDataOffset = bitsPerSampleOffset + 2*numberOfComponents
+  def entry(tag, valueType, count, value):
+    # value is an offset if the values do not fit into the entry
+    valueFormat = "<H2x" if valueType == shortType and count == 1 else "<I"
+    return struct.pack("<HHI", tag, valueType, count) + struct.pack(valueFormat, value)
+  imageFileDirectory = b"".join([
+    struct.pack("<H", numberOfEntries),
+    entry(256, longType, 1, columns),  # ImageWidth
+    entry(257, longType, 1, rows),  # ImageLength
+    entry(258, shortType, numberOfComponents, 8 if numberOfComponents == 1 else bitsPerSampleOffset),  # BitsPerSample
+    entry(259, shortType, 1, 1),  # Compression: none
+    entry(262, shortType, 1, 2 if numberOfComponents == 3 else 1),  # PhotometricInterpretation: RGB or BlackIsZero
+    entry(273, longType, 1, pixelDataOffset),  # StripOffsets
+    entry(277, shortType, 1, numberOfComponents),  # SamplesPerPixel
+    entry(278, longType, 1, rows),  # RowsPerStrip
+    entry(279, longType, 1, frame.nbytes),  # StripByteCounts
+    entry(284, shortType, 1, 1),  # PlanarConfiguration: contiguous
+    struct.pack("<I", 0)])
+  return (b"II*\x00" + struct.pack("<I", 8) + imageFileDirectory + struct.pack("<"+"H"*numberOfComponents, *([8]*numberOfComponents))
+    + numpy.ascontiguousarray(frame).tobytes())
+
+def encodePnm(frame):
+  """Store a numpy array (rows, columns, components) in binary PPM (RGB) or PGM (grayscale) file content.
+  """
+  rows, columns, numberOfComponents = frame.shape
+  if numberOfComponents not in [1, 3]:
+    raise ValueError("Only grayscale and RGB images can be written to PNM files")
+  header = "{0}\n{1} {2}\n255\n".format("P6" if numberOfComponents == 3 else "P5", columns, rows)
+  return header.encode('ascii') + numpy.ascontiguousarray(frame).tobytes()
+
+class ImageEncoder(object):
+  """Converts frames to image file content, with format-specific settings (see createImageEncoder).
+  Encoders are used from multiple writer threads at the same time, therefore they must not have state
+  that changes during encoding.
+  """
+
+  def __init__(self, name, fileExtensions, encodeFunction, settings):
+    self.name = name
+    self.fileExtensions = fileExtensions
+    self.encodeFunction = encodeFunction
+    self.settings = settings
+
+  @property
+  def fileExtension(self):
+    return self.fileExtensions[0]
+
+  def encode(self, frame):
+    return self.encodeFunction(frame, **self.settings)
+
+def encodeJpeg(frame, quality=95):
+  """Compress a numpy array (rows, columns, components) into JPEG file content using VTK.
+  """
+  from vtk.util import numpy_support
+  writer = vtk.vtkJPEGWriter()
+  writer.SetQuality(quality)
+  writer.WriteToMemoryOn()
+  writer.SetInputData(arrayToVtkImageData(frame))
+  writer.Write()
+  return numpy_support.vtk_to_numpy(writer.GetResult()).tobytes()
+
+def getImageFormatPresets():
+  """Returns image format presets: list of (name, description, file extensions, encode function, settings).
+  """
+  import zlib
+  return [
+    ('png', "PNG, default compression", ['.png'], encodePng, {'compressionLevel': 6}),
+    ('png-small', "PNG, maximum compression (slow, smallest lossless files)", ['.png'], encodePng, {'compressionLevel': 9}),
+    ('fast-lossless', "PNG, fast run-length compression (for intermediate files)", ['.png'], encodePng,
+      {'compressionLevel': 1, 'strategy': zlib.Z_RLE}),
+    ('jpeg', "JPEG, high quality", ['.jpg', '.jpeg'], encodeJpeg, {'quality': 95}),
+    ('jpeg-small', "JPEG, medium quality (small files for delivery)", ['.jpg', '.jpeg'], encodeJpeg, {'quality': 75}),
+    ('tiff', "TIFF, uncompressed", ['.tif', '.tiff'], encodeTiff, {}),
+    ('raw', "PPM, uncompressed raw pixels", ['.ppm', '.pgm', '.pnm'], encodePnm, {}),
+    ]
+
+def createImageEncoder(imageFormat, **settings):
+  """Create an image encoder from a preset name (see getImageFormatPresets).
+  Settings of the preset can be overridden (e.g., createImageEncoder('png', compressionLevel=3)).
+  """
+  for name, description, fileExtensions, encodeFunction, presetSettings in getImageFormatPresets():
+    if name == imageFormat:
+      encoderSettings = dict(presetSettings)
+      encoderSettings.update(settings)
+      return ImageEncoder(name, fileExtensions, encodeFunction, encoderSettings)
+  raise ValueError("Unknown image format: {0}".format(imageFormat))
+
+def writeImageFile(filename, frame, statistics=None, encoder=None):
+  """Write a numpy array (rows, columns, components) into an image file.
+  File format is determined by the encoder (ImageEncoder) or, if no encoder is specified, by the file name extension.
+  If statistics (CaptureStatistics) is specified then encoding and writing time and file size are added to it.
+  """
+  extension = os.path.splitext(filename)[1].lower()
+  if encoder is None and extension == '.png':
+    encoder = createImageEncoder('png')
+  if encoder is not None:
+    startTime = timeit.default_timer()
+    content = encoder.encode(frame)
+    encodedTime = timeit.default_timer()
+    with open(filename, 'wb') as imageFile:
+      imageFile.write(content)
+    if statistics:
+      statistics.addDuration('encode', encodedTime-startTime)
+      statistics.addDuration('write', timeit.default_timer()-encodedTime)
+      statistics.addBytesWritten(len(content))
+    return
+  writerClasses = {
+    '.jpg': vtk.vtkJPEGWriter,
+    '.jpeg': vtk.vtkJPEGWriter,
+    '.bmp': vtk.vtkBMPWriter,
+    '.tif': vtk.vtkTIFFWriter,
+    '.tiff': vtk.vtkTIFFWriter,
+    '.pnm': vtk.vtkPNMWriter,
+    '.ppm': vtk.vtkPNMWriter,
+    }
+  if extension not in writerClasses:
+    raise ValueError("Unsupported image file format: "+filename)
+  startTime = timeit.default_timer()
+  writer = writerClasses[extension]()
+  writer.SetInputData(arrayToVtkImageData(frame))
+  writer.SetFileName(filename)
+  writer.Write()
+  if statistics:
+    # VTK writers encode and write in one step
+    statistics.addDuration('write', timeit.default_timer()-startTime)
+    statistics.addBytesWritten(os.path.getsize(filename))
+
+class ImageSequenceFrameWriter(object):
+  """Writes each frame into a separate image file. File format is determined by the encoder (ImageEncoder)
+  or, if no encoder is specified, by the file name extension.
+  Frames may be written from multiple threads at the same time.
+  """
+
+  def __init__(self, filePathPattern, encoder=None):
+    self.filePathPattern = filePathPattern
+    self.encoder = encoder
+    self.statistics = None
+
+  def setStatistics(self, statistics):
+    self.statistics = statistics
+
+  def getFrameDescription(self, frameIndex):
+    return self.filePathPattern % frameIndex
+
+  def writeFrame(self, frameIndex, frame):
+    writeImageFile(self.filePathPattern % frameIndex, frame, self.statistics, self.encoder)
+
+  def close(self):
+    pass
+
+  def abort(self):
+    pass
+
+class DownsamplingFrameWriter(object):
+  """Reduces the size of frames by an integer factor (see downsampleFrame) and passes them to another frame writer.
+  Downsampling is performed in the thread that writes the frame, therefore when the writer is added to a FramePipeline
+  it does not slow down rendering. If evenSize is True then the last row and column are dropped
+  if needed to make frame size even (required by most video codecs).
+  """
+
+  def __init__(self, frameWriter, downsamplingFactor, evenSize=False):
+    self.frameWriter = frameWriter
+    self.downsamplingFactor = downsamplingFactor
+    self.evenSize = evenSize
+    self.statistics = None
+
+  def setStatistics(self, statistics):
+    self.statistics = statistics
+    self.frameWriter.setStatistics(statistics)
+
+  def getFrameDescription(self, frameIndex):
+    return self.frameWriter.getFrameDescription(frameIndex)
+
+  def writeFrame(self, frameIndex, frame):
+    startTime = timeit.default_timer()
+    frame = downsampleFrame(frame, self.downsamplingFactor)
+    if self.evenSize:
+      frame = frame[:frame.shape[0] - frame.shape[0] % 2, :frame.shape[1] - frame.shape[1] % 2]
+    if self.statistics:
+      self.statistics.addDuration('downsample', timeit.default_timer()-startTime)
+    self.frameWriter.writeFrame(frameIndex, frame)
+
+  def close(self):
+    self.frameWriter.close()
+
+  def abort(self):
+    self.frameWriter.abort()
+
+class ArrayFrameWriter(object):
+  """Stores frames in memory, in a single numpy array (frames, rows, columns, components).
+  The array is allocated when the first frame is received, unless an existing array is specified in frames.
+  If filename is specified then the array is a memory-mapped .npy file.
+  """
+
+  def __init__(self, numberOfFrames, filename=None, frames=None):
+    self.numberOfFrames = numberOfFrames
+    self.filename = filename
+    self.frames = frames
+    if frames is not None and len(frames) != numberOfFrames:
+      raise ValueError("Frame array size ({0}) does not match the number of frames ({1})".format(len(frames), numberOfFrames))
+    self.allocationLock = threading.Lock()
+
+  def allocateFrames(self, frameShape, dtype):
+    if self.filename:
+      return numpy.lib.format.open_memmap(self.filename, mode='w+', dtype=dtype, shape=(self.numberOfFrames,)+frameShape)
+    return numpy.zeros((self.numberOfFrames,)+frameShape, dtype)
+
+  def setStatistics(self, statistics):
+    pass
+
+  def getFrameDescription(self, frameIndex):
+    return "frame {0} to memory".format(frameIndex)
+
+  def writeFrame(self, frameIndex, frame):
+    with self.allocationLock:
+      if self.frames is None:
+        self.frames = self.allocateFrames(frame.shape, frame.dtype)
+    if self.frames.shape[1:] != frame.shape:
+      raise ValueError("Frame size {0} does not match frame array size {1}".format(frame.shape, self.frames.shape[1:]))
+    self.frames[frameIndex] = frame
+
+  def close(self):
+    if isinstance(self.frames, numpy.memmap):
+      self.frames.flush()
+
+  def abort(self):
+    pass
+
+class DeduplicatingFrameWriter(object):
+  """Passes only frames that differ from the previous frame to another frame writer, numbered consecutively.
+  frameDurations contains the number of captured frames that each written frame represents.
+  Frames are compared using a cheap checksum, which is confirmed by comparing the content if checksums match.
+  Frames must be written in order, therefore this writer must not be used from multiple threads
+  (it can pass frames to a FramePipeline).
+  """
+
+  def __init__(self, frameWriter):
+    self.frameWriter = frameWriter
+    self.frameDurations = []
+    self.previousFrame = None
+    self.previousChecksum = None
+    self.frameListOutput = None
+    self.statistics = None
+
+  def setFrameListOutput(self, frameListFilePath, filePathPattern, frameRate):
+    """Write an ffmpeg concat list of images and their durations when the writer is closed.
+    filePathPattern is the pattern of the written image files.
+    """
+    self.frameListOutput = (frameListFilePath, filePathPattern, frameRate)
+
+  def setStatistics(self, statistics):
+    self.statistics = statistics
+    self.frameWriter.setStatistics(statistics)
+
+  def getFrameDescription(self, frameIndex):
+    return "frame {0} (stored as {1})".format(frameIndex, self.frameWriter.getFrameDescription(len(self.frameDurations)))
+
+  def isPreviousFrame(self, frame, checksum):
+    return (checksum == self.previousChecksum and frame.shape == self.previousFrame.shape
+      and numpy.array_equal(frame, self.previousFrame))
+
+  def writeFrame(self, frameIndex, frame):
+    import zlib
+    # adler32 is much faster than cryptographic hashes, collisions are ruled out by comparing the content
+    checksum = zlib.adler32(numpy.ascontiguousarray(frame))
+    if self.previousFrame is not None and self.isPreviousFrame(frame, checksum):
+      self.frameDurations[-1] += 1
+      if self.statistics:
+        self.statistics.addSkippedFrame()
+      return
+    self.frameWriter.writeFrame(len(self.frameDurations), frame)
+    self.frameDurations.append(1)
+    # the caller may reuse the frame buffer
+    self.previousFrame = frame.copy()
+    self.previousChecksum = checksum
+
+  def writeFrameList(self):
+    frameListFilePath, filePathPattern, frameRate = self.frameListOutput
+    frameListDir = os.path.dirname(frameListFilePath)
+    with open(frameListFilePath, 'w') as frameListFile:
+      frameListFile.write("ffconcat version 1.0\n")
+      for storedFrameIndex, duration in enumerate(self.frameDurations):
+        fileName = os.path.relpath(filePathPattern % storedFrameIndex, frameListDir).replace("\\", "/")
+        frameListFile.write("file '{0}'\nduration {1}\n".format(fileName.replace("'", "'\\''"), float(duration)/frameRate))
+      if self.frameDurations:
+        # duration of the last file is only taken into account if it is followed by another entry
+        frameListFile.write("file '{0}'\n".format(fileName.replace("'", "'\\''")))
+
+  def close(self):
+    self.previousFrame = None
+    self.frameWriter.close()
+    if self.frameListOutput:
+      self.writeFrameList()
+
+  def abort(self):
+    self.previousFrame = None
+    self.frameWriter.abort()
+
+class SpriteSheetFrameWriter(object):
+  """Arranges frames as tiles of sprite sheets (large images that contain many frames), for web viewers.
+  Tiles fill rows of a sheet in frame index order. Sheets are limited to maximumSheetSize pixels in each direction,
+  additional sheets are created as needed. Each sheet is saved (file format is determined by the file name
+  extension of filePathPattern) as soon as all its tiles are received, to limit memory usage.
+  Frames may be written from multiple threads at the same time.
+  """
+
+  def __init__(self, filePathPattern, numberOfFrames, downsamplingFactor=1, maximumSheetSize=8192):
+    self.filePathPattern = filePathPattern
+    self.numberOfFrames = numberOfFrames
+    self.downsamplingFactor = downsamplingFactor
+    self.maximumSheetSize = maximumSheetSize
+    self.tileShape = None
+    self.sheets = {}
+    self.numberOfMissingTiles = {}
+    self.lock = threading.Lock()
+    self.statistics = None
+
+  def setStatistics(self, statistics):
+    self.statistics = statistics
+
+  def getFrameDescription(self, frameIndex):
+    return "frame {0} to sprite sheet {1}".format(frameIndex, self.getSheetFilePath(self.getTileLocation(frameIndex)[0])
+      if self.tileShape else self.filePathPattern)
+
+  def setTileShape(self, tileShape):
+    self.tileShape = tileShape
+    tileRows, tileColumns = tileShape[:2]
+    if tileRows > self.maximumSheetSize or tileColumns > self.maximumSheetSize:
+      raise ValueError("Frame size exceeds maximum sprite sheet size")
+    self.tilesPerRow = min(self.numberOfFrames, self.maximumSheetSize // tileColumns)
+    self.tilesPerSheet = min(self.numberOfFrames, self.tilesPerRow * (self.maximumSheetSize // tileRows))
+    self.numberOfSheets = (self.numberOfFrames + self.tilesPerSheet - 1) // self.tilesPerSheet
+    for sheetIndex in range(self.numberOfSheets):
+      self.numberOfMissingTiles[sheetIndex] = min(self.tilesPerSheet, self.numberOfFrames - sheetIndex * self.tilesPerSheet)
+
+  def getTileSize(self):
+    """Returns tile (width, height)."""
+    return self.tileShape[1], self.tileShape[0]
+
+  def getTileLocation(self, frameIndex):
+    """Returns sheet index and the top-left pixel (column, row) of the tile."""
+    sheetIndex, tileIndex = divmod(frameIndex, self.tilesPerSheet)
+    tileRow, tileColumn = divmod(tileIndex, self.tilesPerRow)
+    return sheetIndex, tileColumn * self.tileShape[1], tileRow * self.tileShape[0]
+
+  def getSheetFilePath(self, sheetIndex):
+    return self.filePathPattern % sheetIndex
+
+  def getSheetFilePaths(self):
+    return [self.getSheetFilePath(sheetIndex) for sheetIndex in range(self.numberOfSheets)]
+
+  def getTilePlacement(self, frameIndex):
+    """Returns dictionary with sheet index and tile position (x, y) of a frame."""
+    sheetIndex, x, y = self.getTileLocation(frameIndex)
+    return {'sheet': sheetIndex, 'x': x, 'y': y}
+
+  def writeFrame(self, frameIndex, frame):
+    tile = downsampleFrame(frame, self.downsamplingFactor)
+    with self.lock:
+      if self.tileShape is None:
+        self.setTileShape(tile.shape)
+      elif tile.shape != self.tileShape:
+        raise ValueError("Frame size changed during capture")
+      sheetIndex, x, y = self.getTileLocation(frameIndex)
+      if sheetIndex not in self.sheets:
+        numberOfTiles = self.numberOfMissingTiles[sheetIndex]
+        numberOfTileRows = (numberOfTiles + self.tilesPerRow - 1) // self.tilesPerRow
+        self.sheets[sheetIndex] = numpy.zeros((numberOfTileRows * self.tileShape[0],
+          min(numberOfTiles, self.tilesPerRow) * self.tileShape[1], self.tileShape[2]), numpy.uint8)
+      sheet = self.sheets[sheetIndex]
+    sheet[y:y+self.tileShape[0], x:x+self.tileShape[1]] = tile
+    with self.lock:
+      self.numberOfMissingTiles[sheetIndex] -= 1
+      completed = (self.numberOfMissingTiles[sheetIndex] == 0)
+      if completed:
+        del self.sheets[sheetIndex]
+    if completed:
+      writeImageFile(self.getSheetFilePath(sheetIndex), sheet, self.statistics)
+
+  def close(self):
+    if self.sheets:
+      raise ValueError("Sprite sheets are incomplete, {0} frames are missing".format(
+        sum([self.numberOfMissingTiles[sheetIndex] for sheetIndex in self.sheets])))
+
+  def abort(self):
+    self.sheets = {}
+
+class FrameRingBuffer(object):
+  """Fixed number of reusable frame buffers that pass frames from a producer to one or more consumers.
+  Buffers are allocated once, when the first frame is added, so memory usage does not grow with the number of frames.
+  Each consumer receives every frame. A consumer may be served by multiple threads, which then share frames
+  among them. A buffer is reused only after all consumers released it, until then the producer is blocked.
+  """
+
+  def __init__(self, numberOfBuffers, numberOfConsumers=1):
+    self.numberOfBuffers = numberOfBuffers
+    self.numberOfConsumers = numberOfConsumers
+    self.buffers = None
+    self.frameIndices = [None] * numberOfBuffers
+    self.pendingReleaseCounts = [0] * numberOfBuffers
+    # position is the number of frames that have been added (by the producer) or taken (by a consumer)
+    self.writePosition = 0
+    self.readPositions = [0] * numberOfConsumers
+    self.closed = False
+    self.aborted = False
+    self.condition = threading.Condition()
+
+  def acquireWriteBuffer(self, frameShape):
+    """Wait until the next buffer is available and return it. The caller fills the buffer and calls commitWriteBuffer.
+    """
+    frameShape = tuple(frameShape)
+    bufferIndex = self.writePosition % self.numberOfBuffers
+    with self.condition:
+      while self.pendingReleaseCounts[bufferIndex] > 0 and not self.aborted:
+        self.condition.wait()
+      if self.aborted:
+        raise ValueError("Frame buffer has been aborted")
+    if self.buffers is None:
+      self.buffers = numpy.empty((self.numberOfBuffers,)+frameShape, numpy.uint8)
+    elif self.buffers.shape[1:] != frameShape:
+      raise ValueError("Frame size changed during capture: expected {0}, received {1}".format(
+        self.buffers.shape[1:], frameShape))
+    return self.buffers[bufferIndex]
+
+  def commitWriteBuffer(self, frameIndex):
+    with self.condition:
+      bufferIndex = self.writePosition % self.numberOfBuffers
+      self.frameIndices[bufferIndex] = frameIndex
+      self.pendingReleaseCounts[bufferIndex] = self.numberOfConsumers
+      self.writePosition += 1
+      self.condition.notify_all()
+
+  def put(self, frameIndex, frame):
+    numpy.copyto(self.acquireWriteBuffer(frame.shape), frame)
+    self.commitWriteBuffer(frameIndex)
+
+  def get(self, consumerIndex):
+    """Wait for the next frame of the consumer. Returns (position, frameIndex, frame) or None if there are no more frames.
+    The frame buffer must not be used after it is released by calling release(position).
+    """
+    with self.condition:
+      while self.readPositions[consumerIndex] >= self.writePosition:
+        if self.closed or self.aborted:
+          return None
+        self.condition.wait()
+      if self.aborted:
+        return None
+      position = self.readPositions[consumerIndex]
+      self.readPositions[consumerIndex] += 1
+      bufferIndex = position % self.numberOfBuffers
+      return position, self.frameIndices[bufferIndex], self.buffers[bufferIndex]
+
+  def release(self, position):
+    with self.condition:
+      self.pendingReleaseCounts[position % self.numberOfBuffers] -= 1
+      self.condition.notify_all()
+
+  def close(self):
+    """Indicate that no more frames will be added. Consumers still receive all the frames added so far.
+    """
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+
+  def abort(self):
+    """Stop passing frames to consumers and unblock all waiting threads.
+    """
+    with self.condition:
+      self.aborted = True
+      self.condition.notify_all()
+
+class FramePipeline(object):
+  """Passes frames to frame writers that run in background threads, so that the next frame can be rendered
+  while previous frames are compressed and written.
+  Frames are copied into a FrameRingBuffer, therefore memory usage is limited: writeFrame blocks while
+  all the buffers are waiting to be written.
+  Writers that have multiple threads must support concurrent writeFrame calls. Writers that have a single thread
+  receive frames in order.
+  """
+
+  def __init__(self, numberOfBuffers=8):
+    self.numberOfBuffers = numberOfBuffers
+    self.frameWriters = []
+    self.numberOfThreads = []
+    self.ringBuffer = None
+    self.workers = []
+    self.errors = []
+
+  def addFrameWriter(self, frameWriter, numberOfThreads=1):
+    if self.ringBuffer is not None:
+      raise ValueError("Frame writers cannot be added after frame writing has started")
+    self.frameWriters.append(frameWriter)
+    self.numberOfThreads.append(numberOfThreads)
+
+  def setStatistics(self, statistics):
+    for frameWriter in self.frameWriters:
+      frameWriter.setStatistics(statistics)
+
+  def getFrameDescription(self, frameIndex):
+    return ", ".join([frameWriter.getFrameDescription(frameIndex) for frameWriter in self.frameWriters])
+
+  def startWorkers(self):
+    self.ringBuffer = FrameRingBuffer(self.numberOfBuffers, len(self.frameWriters))
+    for consumerIndex, numberOfThreads in enumerate(self.numberOfThreads):
+      for threadIndex in range(numberOfThreads):
+        worker = threading.Thread(target=self.processFrames, args=(consumerIndex,))
+        worker.daemon = True
+        worker.start()
+        self.workers.append(worker)
+
+  def processFrames(self, consumerIndex):
+    frameWriter = self.frameWriters[consumerIndex]
+    while True:
+      item = self.ringBuffer.get(consumerIndex)
+      if item is None:
+        return
+      position, frameIndex, frame = item
+      try:
+        if not self.errors:
+          frameWriter.writeFrame(frameIndex, frame)
+      except Exception as e:
+        logging.error("Failed to write {0}: {1}".format(frameWriter.getFrameDescription(frameIndex), e))
+        self.errors.append(e)
+      finally:
+        # frames are still released after an error so that the capture loop is not blocked
+        self.ringBuffer.release(position)
+
+  def checkErrors(self):
+    if self.errors:
+      raise self.errors[0]
+
+  def writeFrame(self, frameIndex, frame):
+    self.checkErrors()
+    if self.ringBuffer is None:
+      self.startWorkers()
+    self.ringBuffer.put(frameIndex, frame)
+
+  def stopWorkers(self):
+    for worker in self.workers:
+      worker.join()
+    self.workers = []
+
+  def close(self):
+    if self.ringBuffer is not None:
+      self.ringBuffer.close()
+      self.stopWorkers()
+    self.checkErrors()
+    for frameWriter in self.frameWriters:
+      frameWriter.close()
+
+  def abort(self):
+    if self.ringBuffer is not None:
+      self.ringBuffer.abort()
+      self.stopWorkers()
+    for frameWriter in self.frameWriters:
+      frameWriter.abort()
+
+def getChangedRegion(frame, previousFrame):
+  """Returns bounding box (firstRow, endRow, firstColumn, endColumn) of pixels that differ between
+  two frames, or None if the frames are identical.
+  """
+  changed = frame != previousFrame
+  if changed.ndim > 2:
+    changed = changed.any(axis=2)
+  changedRows = numpy.flatnonzero(changed.any(axis=1))
+  if not len(changedRows):
+    return None
+  changedColumns = numpy.flatnonzero(changed.any(axis=0))
+  return (changedRows[0], changedRows[-1]+1, changedColumns[0], changedColumns[-1]+1)
+
+def getContentMask(frame, samplingStep=4, tolerance=8):
+  """Returns a boolean array that marks which pixels of every samplingStep-th row and column differ
+  from the background. Background color of each row is the color of its first pixel,
+  which supports both uniform and vertical gradient (3D view) backgrounds.
+  """
+  sampledPixels = frame[::samplingStep, ::samplingStep, :3].astype(numpy.int16)
+  return (numpy.abs(sampledPixels - sampledPixels[:, :1]) > tolerance).any(axis=2)
+
+def getContentRegion(contentMask, frameShape, samplingStep=4, margin=0, evenSize=False):
+  """Returns the region (firstRow, endRow, firstColumn, endColumn) of a frame that contains all pixels marked
+  in contentMask (see getContentMask) and margin pixels around them, or None if no pixels are marked.
+  The region is extended by samplingStep-1 pixels to include content between sampled pixels.
+  If evenSize is True then the region is extended (or reduced at the frame border) to even size,
+  as required by most video codecs.
+  """
+  contentRows = numpy.flatnonzero(contentMask.any(axis=1))
+  if not len(contentRows):
+    return None
+  contentColumns = numpy.flatnonzero(contentMask.any(axis=0))
+  extension = samplingStep - 1 + margin
+  region = []
+  for contentIndices, size in [(contentRows, frameShape[0]), (contentColumns, frameShape[1])]:
+    first = max(0, int(contentIndices[0]) * samplingStep - extension)
+    end = min(size, int(contentIndices[-1]) * samplingStep + 1 + extension)
+    if evenSize and (end - first) % 2:
+      if end < size:
+        end += 1
+      elif first > 0:
+        first -= 1
+      else:
+        end -= 1
+    region.extend([first, end])
+  return tuple(region)
+
+def cropFrame(frame, region):
+  """Returns the region (firstRow, endRow, firstColumn, endColumn) of the frame, without copying pixels.
+  If region is None then the whole frame is returned. Raises an error if the region is empty or not inside the frame.
+  """
+  if region is None:
+    return frame
+  firstRow, endRow, firstColumn, endColumn = region
+  if not (0 <= firstRow < endRow <= frame.shape[0] and 0 <= firstColumn < endColumn <= frame.shape[1]):
+    raise ValueError("Crop region (left {0}, top {1}, width {2}, height {3}) is not inside the captured {4}x{5} image".format(
+      firstColumn, firstRow, endColumn-firstColumn, endRow-firstRow, frame.shape[1], frame.shape[0]))
+  return frame[firstRow:endRow, firstColumn:endColumn]
+
+def getColorCodes(frame):
+  """Returns 15-bit color codes (5 bits per RGB component) of a frame (rows, columns, RGB) as a uint16 array (rows, columns).
+  """
+  red = frame[:, :, 0].astype(numpy.uint16)
+  green = frame[:, :, 1].astype(numpy.uint16)
+  blue = frame[:, :, 2].astype(numpy.uint16)
+  return ((red >> 3) << 10) | ((green >> 3) << 5) | (blue >> 3)
+
+def computeColorPalette(frame, numberOfColors=256):
+  """Compute a color palette that represents colors of a frame (rows, columns, RGB) well, using median cut
+  on the histogram of 15-bit colors. Returns a uint8 array (numberOfColors or less, RGB).
+  """
+  counts = numpy.bincount(getColorCodes(frame).ravel(), minlength=32768)
+  colorCodes = numpy.flatnonzero(counts)
+  weights = counts[colorCodes]
+  colors = numpy.column_stack([(colorCodes >> 10) & 31, (colorCodes >> 5) & 31, colorCodes & 31])
+  def getLongestAxis(box):
+    boxColors = colors[box]
+    ranges = boxColors.max(axis=0) - boxColors.min(axis=0)
+    return ranges.max(), ranges.argmax()
+  boxes = [numpy.arange(len(colorCodes))]
+  boxAxes = [getLongestAxis(boxes[0])]
+  while len(boxes) < numberOfColors:
+    # split the box that has the largest color range at the weighted median
+    boxIndex = max(range(len(boxes)), key=lambda index: boxAxes[index][0])
+    boxRange, axis = boxAxes[boxIndex]
+    if boxRange == 0:
+      break
+    box = boxes[boxIndex]
+    box = box[numpy.argsort(colors[box, axis], kind='mergesort')]
+    cumulativeWeights = numpy.cumsum(weights[box])
+    splitIndex = int(numpy.searchsorted(cumulativeWeights, cumulativeWeights[-1] / 2.0))
+    splitIndex = min(max(splitIndex, 1), len(box)-1)
+    boxes[boxIndex:boxIndex+1] = [box[:splitIndex], box[splitIndex:]]
+    boxAxes[boxIndex:boxIndex+1] = [getLongestAxis(box[:splitIndex]), getLongestAxis(box[splitIndex:])]
+  palette = numpy.array([numpy.average(colors[box], axis=0, weights=weights[box]) for box in boxes])
+  return numpy.clip(palette * 8 + 4, 0, 255).astype(numpy.uint8)
+
+def computeColorLookupTable(palette, squaredErrors=None):
+  """Returns a table that maps each 15-bit color code (see getColorCodes) to the index of the nearest palette color.
+  If squaredErrors (float32 array of 32768 values) is specified then the squared distance between each color and
+  the nearest palette color is stored in it.
+  """
+  colorCodes = numpy.arange(32768)
+  colors = numpy.column_stack([(colorCodes >> 10) & 31, (colorCodes >> 5) & 31, colorCodes & 31]) * 8 + 4
+  paletteColors = palette.astype(numpy.float32)
+  lookupTable = numpy.empty(32768, numpy.uint8)
+  # process in chunks to limit the size of the distance matrix
+  chunkSize = 4096
+  for chunkStart in range(0, 32768, chunkSize):
+    chunkColors = colors[chunkStart:chunkStart+chunkSize].astype(numpy.float32)
+    distances = (paletteColors ** 2).sum(axis=1) - 2 * numpy.dot(chunkColors, paletteColors.T)
+    lookupTable[chunkStart:chunkStart+chunkSize] = distances.argmin(axis=1)
+    if squaredErrors is not None:
+      squaredErrors[chunkStart:chunkStart+chunkSize] = distances.min(axis=1) + (chunkColors ** 2).sum(axis=1)
+  return lookupTable
+
+def encodeGifImageData(indices, minimumCodeSize=8):
+  """LZW-compress palette indices (uint8 array) as GIF image data (without the data sub-block framing).
+  The encoder processes pixels one by one in Python, therefore it is slow (about 0.5 s for a 1280x720 image region).
+  """
+  clearCode = 1 << minimumCodeSize
+  endOfInformationCode = clearCode + 1
+  codeSize = minimumCodeSize + 1
+  nextCode = endOfInformationCode + 1
+  codeTable = {}
+  output = bytearray()
+  bitBuffer = clearCode
+  bitCount = codeSize
+  pixels = bytearray(indices.tobytes())
+  prefix = pixels[0]
+  for pixel in pixels[1:]:
+    key = (prefix << 8) | pixel
+    code = codeTable.get(key)
+    if code is not None:
+      prefix = code
+      continue
+    bitBuffer |= prefix << bitCount
+    bitCount += codeSize
+    if nextCode < 4096:
+      codeTable[key] = nextCode
+      if nextCode == (1 << codeSize):
+        codeSize += 1
+      nextCode += 1
+    else:
+      # code table is full, start a new one
+      bitBuffer |= clearCode << bitCount
+      bitCount += codeSize
+      codeTable = {}
+      codeSize = minimumCodeSize + 1
+      nextCode = endOfInformationCode + 1
+    while bitCount >= 8:
+      output.append(bitBuffer & 0xff)
+      bitBuffer >>= 8
+      bitCount -= 8
+    prefix = pixel
+  bitBuffer |= prefix << bitCount
+  bitCount += codeSize
+  bitBuffer |= endOfInformationCode << bitCount
+  bitCount += codeSize
+  while bitCount > 0:
+    output.append(bitBuffer & 0xff)
+    bitBuffer >>= 8
+    bitCount -= 8
+  return bytes(output)
+
+def getGifSizeWarning(rows, columns):
+  """Returns a warning if GIF images of this size are slow to encode (see GifFrameWriter.maximumFastImageSize),
+  None otherwise.
+  """
+  if rows * columns <= GifFrameWriter.maximumFastImageSize:
+    return None
+  return ("Encoding {0}x{1} GIF images is slow, use animated PNG (.png) or video output"
+    " for faster capture of large images".format(columns, rows))
+
+class AnimationFrameWriter(object):
+  """Base class of writers that encode frames into an animated image file incrementally, while frames are captured.
+  Only the region that changed since the previous frame is stored. Identical consecutive frames are stored once,
+  with longer display time.
+  Frames must be written in order and all of them must have the same size.
+  Derived classes implement convertFrame, startFile, encodeImage, writeImage, and finishFile.
+  """
+
+  def __init__(self, filename, frameRate, loop=0):
+    self.filename = filename
+    self.frameRate = frameRate
+    # number of times the animation is played, 0 means forever
+    self.loop = loop
+    self.file = None
+    self.imageShape = None
+    self.previousImage = None
+    # encoded image that is written when its display time is known
+    self.pendingImage = None
+    self.pendingImageNumberOfFrames = 0
+    self.numberOfWrittenFrames = 0
+    self.numberOfDisplayedFrames = 0
+    self.numberOfImages = 0
+    self.statistics = None
+
+  def setStatistics(self, statistics):
+    self.statistics = statistics
+
+  def getFrameDescription(self, frameIndex):
+    return "frame {0} to {1}".format(frameIndex, self.filename)
+
+  def convertFrame(self, frame):
+    """Returns the frame in the representation that is stored in the file (e.g., palette indices).
+    Derived classes may set self.previousImage to None if images are not comparable with the previous image anymore,
+    to store the whole image.
+    """
+    return frame
+
+  def startFile(self, imageShape):
+    pass
+
+  def encodeImage(self, image, previousImage, region):
+    """Returns encoded region of the image. previousImage is None for the first image."""
+    raise NotImplementedError()
+
+  def writeImage(self, encodedImage, numberOfFrames):
+    """Write an encoded image to the file, which is displayed for the duration of numberOfFrames frames."""
+    raise NotImplementedError()
+
+  def finishFile(self):
+    pass
+
+  def getDisplayTime(self, numberOfFrames, ticksPerSecond):
+    """Returns display time of the next image in ticks. Rounding errors are not accumulated."""
+    startTick = int(round(self.numberOfDisplayedFrames * ticksPerSecond / float(self.frameRate)))
+    self.numberOfDisplayedFrames += numberOfFrames
+    return int(round(self.numberOfDisplayedFrames * ticksPerSecond / float(self.frameRate))) - startTick
+
+  def writeFrame(self, frameIndex, frame):
+    if frameIndex != self.numberOfWrittenFrames:
+      raise ValueError("Animation frames must be written in order: expected frame {0}, received frame {1}".format(
+        self.numberOfWrittenFrames, frameIndex))
+    startTime = timeit.default_timer()
+    image = self.convertFrame(frame)
+    if self.file is None:
+      self.file = open(self.filename, 'w+b')
+      self.startFile(image.shape)
+      self.imageShape = image.shape
+    elif image.shape != self.imageShape:
+      raise ValueError("Animation frame size changed during capture")
+    if self.previousImage is None:
+      region = (0, image.shape[0], 0, image.shape[1])
+    else:
+      region = getChangedRegion(image, self.previousImage)
+    if region is None:
+      self.pendingImageNumberOfFrames += 1
+    else:
+      self.writePendingImage()
+      self.pendingImage = self.encodeImage(image, self.previousImage, region)
+      self.pendingImageNumberOfFrames = 1
+      # the caller may reuse the frame buffer
+      self.previousImage = image.copy() if image is frame else image
+    if self.statistics:
+      self.statistics.addDuration('encode', timeit.default_timer()-startTime)
+    self.numberOfWrittenFrames += 1
+
+  def writePendingImage(self):
+    if self.pendingImage is None:
+      return
+    self.writeImage(self.pendingImage, self.pendingImageNumberOfFrames)
+    self.pendingImage = None
+    self.numberOfImages += 1
+
+  def close(self):
+    if self.file is None:
+      return
+    self.writePendingImage()
+    self.finishFile()
+    self.file.close()
+    self.file = None
+    self.previousImage = None
+    if self.statistics:
+      self.statistics.addBytesWritten(os.path.getsize(self.filename))
+
+  def abort(self):
+    if self.file is None:
+      return
+    self.file.close()
+    self.file = None
+    self.previousImage = None
+    os.remove(self.filename)
+
+class ApngFrameWriter(AnimationFrameWriter):
+  """Writes frames into an animated PNG file. Images are lossless, in full color.
+  """
+
+  def startFile(self, imageShape):
+    self.sequenceNumber = 0
+    self.file.write(pngSignature + pngHeaderChunk(numpy.empty(imageShape, numpy.uint8)))
+    # number of frames is updated when the file is closed
+    self.animationControlChunkPosition = self.file.tell()
+    self.file.write(self.getAnimationControlChunk())
+
+  def getAnimationControlChunk(self):
+    import struct
+    return pngChunk(b"acTL", struct.pack(">II", self.numberOfImages, self.loop))
+
+  def encodeImage(self, image, previousImage, region):
+    firstRow, endRow, firstColumn, endColumn = region
+    return region, compressPngImageData(image[firstRow:endRow, firstColumn:endColumn])
+
+  def writeImage(self, encodedImage, numberOfFrames):
+    import struct
+    (firstRow, endRow, firstColumn, endColumn), imageData = encodedImage
+    displayTime = min(self.getDisplayTime(numberOfFrames, 1000), 65535)
+    # image region replaces the previous content (dispose_op=none, blend_op=source)
+    self.file.write(pngChunk(b"fcTL", struct.pack(">IIIIIHHBB", self.sequenceNumber,
+      endColumn-firstColumn, endRow-firstRow, firstColumn, firstRow, displayTime, 1000, 0, 0)))
+    self.sequenceNumber += 1
+    if self.numberOfImages == 0:
+      # the first image is the default image
+      self.file.write(pngChunk(b"IDAT", imageData))
+    else:
+      self.file.write(pngChunk(b"fdAT", struct.pack(">I", self.sequenceNumber) + imageData))
+      self.sequenceNumber += 1
+
+  def finishFile(self):
+    self.file.write(pngChunk(b"IEND", b""))
+    self.file.seek(self.animationControlChunkPosition)
+    self.file.write(self.getAnimationControlChunk())
+
+class GifFrameWriter(AnimationFrameWriter):
+  """Writes frames into an animated GIF file, using a 255-color palette. Colors are mapped to the palette
+  by a precomputed lookup table. Unless a palette is specified, it is computed from the first frame, and it is
+  computed again from the current frame when colors of the frame are represented much worse than colors of the frame
+  that the palette was computed from (new colors appear during the capture). The new palette is stored as
+  a local color table in the following images.
+  Unchanged pixels in the changed region are stored as transparent to improve compression.
+  LZW compression is slow (see encodeGifImageData), for large or long captures use animated PNG or video instead.
+  A warning is logged when images are larger than maximumFastImageSize.
+  """
+
+  transparentIndex = 0
+
+  # Images that have more pixels than this are slow to encode (0.1-0.2 s for a 640x480 image), a warning is logged
+  maximumFastImageSize = 640 * 480
+
+  # Palette is recomputed if the mean squared color error of a frame is larger than this many times the error of
+  # the frame that the palette was computed from, plus paletteErrorTolerance
+  paletteErrorRatio = 2.0
+  paletteErrorTolerance = 64.0
+
+  def __init__(self, filename, frameRate, loop=0, palette=None):
+    AnimationFrameWriter.__init__(self, filename, frameRate, loop)
+    self.palette = palette
+    self.colorLookupTable = None
+    self.colorSquaredErrors = numpy.zeros(32768, numpy.float32)
+    self.paletteError = 0.0
+    # color table of images, None if they use the global color table
+    self.localColorTable = None
+
+  def getColorTable(self, palette):
+    # first palette entry is reserved for transparent pixels
+    colorTable = numpy.zeros((256, 3), numpy.uint8)
+    colorTable[1:len(palette)+1] = palette[:255]
+    return colorTable
+
+  def setPalette(self, palette, colorCodes):
+    self.colorLookupTable = computeColorLookupTable(palette[:255], self.colorSquaredErrors) + 1
+    self.paletteError = self.colorSquaredErrors[colorCodes].mean()
+
+  def convertFrame(self, frame):
+    colorCodes = getColorCodes(frame)
+    if self.colorLookupTable is None:
+      palette = self.palette if self.palette is not None else computeColorPalette(frame, 255)
+      self.colorTable = self.getColorTable(palette)
+      self.setPalette(palette, colorCodes)
+    elif self.palette is None and (self.colorSquaredErrors[colorCodes].mean()
+      > self.paletteErrorRatio * self.paletteError + self.paletteErrorTolerance):
+      palette = computeColorPalette(frame, 255)
+      self.localColorTable = self.getColorTable(palette)
+      self.setPalette(palette, colorCodes)
+      # indices of the previous image refer to the previous palette
+      self.previousImage = None
+    return self.colorLookupTable[colorCodes]
+
+  def startFile(self, imageShape):
+    import struct
+    rows, columns = imageShape
+    sizeWarning = getGifSizeWarning(rows, columns)
+    if sizeWarning:
+      logging.warning(sizeWarning)
+    # logical screen descriptor with a 256-entry global color table
+    self.file.write(b"GIF89a" + struct.pack("<HHBBB", columns, rows, 0xf7, 0, 0) + self.colorTable.tobytes())
+    # application extension for looping
+    self.file.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+  def encodeImage(self, image, previousImage, region):
+    firstRow, endRow, firstColumn, endColumn = region
+    indices = image[firstRow:endRow, firstColumn:endColumn].copy()
+    transparent = previousImage is not None
+    if transparent:
+      indices[indices == previousImage[firstRow:endRow, firstColumn:endColumn]] = self.transparentIndex
+    return region, transparent, self.localColorTable, encodeGifImageData(indices)
+
+  def writeImage(self, encodedImage, numberOfFrames):
+    import struct
+    (firstRow, endRow, firstColumn, endColumn), transparent, localColorTable, imageData = encodedImage
+    displayTime = min(self.getDisplayTime(numberOfFrames, 100), 65535)
+    # graphic control extension: keep previous image (disposal method 1), display time, transparency
+    self.file.write(b"\x21\xf9\x04" + struct.pack("<BHB", (1 << 2) | int(transparent), displayTime,
+      self.transparentIndex) + b"\x00")
+    if localColorTable is None:
+      self.file.write(b"\x2c" + struct.pack("<HHHHB", firstColumn, firstRow, endColumn-firstColumn, endRow-firstRow, 0))
+    else:
+      # image descriptor with a 256-entry local color table
+      self.file.write(b"\x2c" + struct.pack("<HHHHB", firstColumn, firstRow, endColumn-firstColumn, endRow-firstRow, 0x87)
+        + localColorTable.tobytes())
+    self.file.write(b"\x08")
+    for blockStart in range(0, len(imageData), 255):
+      block = imageData[blockStart:blockStart+255]
+      self.file.write(struct.pack("<B", len(block)) + block)
+    self.file.write(b"\x00")
+
+  def finishFile(self):
+    self.file.write(b"\x3b")
+
+class FfmpegVideoStreamWriter(object):
+  """Sends frames as raw RGB data to the standard input of an ffmpeg process, which encodes them into a video file.
+  The process is started when the first frame is received, as the frame size is not known earlier.
+  Frames must be written in order and all of them must have the same size.
+  """
+
+  def __init__(self, ffmpegPath, bitRate, frameRate, outputVideoFilePath):
+    self.ffmpegPath = ffmpegPath
+    self.bitRate = bitRate
+    self.frameRate = frameRate
+    self.outputVideoFilePath = outputVideoFilePath
+    self.process = None
+    self.errorOutputFile = None
+    self.frameShape = None
+    self.numberOfWrittenFrames = 0
+    self.statistics = None
+
+  def setStatistics(self, statistics):
+    self.statistics = statistics
+
+  def getFrameDescription(self, frameIndex):
+    return "frame {0} to {1}".format(frameIndex, self.outputVideoFilePath)
+
+  def startProcess(self, frameShape):
+    import subprocess
+    import tempfile
+    rows, columns, _ = frameShape
+    ffmpegParams = [self.ffmpegPath,
+                    "-y", # overwrite without asking
+                    "-f", "rawvideo",
+                    "-pix_fmt", "rgb24",
+                    "-s", "{0}x{1}".format(columns, rows),
+                    "-r", str(self.frameRate),
+                    "-i", "-", # read frames from standard input
+                    "-vb", "{0}M".format(self.bitRate),
+                    self.outputVideoFilePath]
+    logging.debug("ffmpeg parameters: "+repr(ffmpegParams))
+    # Error output is redirected to a file, as an unread pipe would block ffmpeg when its buffer is full
+    self.errorOutputFile = tempfile.TemporaryFile()
+    self.process = subprocess.Popen(ffmpegParams, stdin=subprocess.PIPE, stdout=self.errorOutputFile, stderr=self.errorOutputFile)
+    self.frameShape = frameShape
+
+  def getErrorOutput(self):
+    if not self.errorOutputFile:
+      return ''
+    self.errorOutputFile.seek(0)
+    return self.errorOutputFile.read().decode('utf-8', 'replace')
+
+  def writeFrame(self, frameIndex, frame):
+    if frameIndex != self.numberOfWrittenFrames:
+      raise ValueError("Video frames must be written in order: expected frame {0}, received frame {1}".format(
+        self.numberOfWrittenFrames, frameIndex))
+    if self.process is None:
+      self.startProcess(frame.shape)
+    elif frame.shape != self.frameShape:
+      raise ValueError("Video frame size changed during capture")
+    startTime = timeit.default_timer()
+    try:
+      self.process.stdin.write(numpy.ascontiguousarray(frame[:, :, :3]).tobytes())
+    except IOError:
+      self.process.wait()
+      raise ValueError("ffmpeg stopped unexpectedly: " + self.getErrorOutput())
+    if self.statistics:
+      # writing blocks while ffmpeg is busy, so this is mostly the time spent with video encoding
+      self.statistics.addDuration('video', timeit.default_timer()-startTime)
+    self.numberOfWrittenFrames += 1
+
+  def close(self):
+    if self.process is None:
+      return
+    startTime = timeit.default_timer()
+    self.process.stdin.close()
+    returnCode = self.process.wait()
+    errorOutput = self.getErrorOutput()
+    self.errorOutputFile.close()
+    self.process = None
+    logging.debug("ffmpeg output: " + errorOutput)
+    if returnCode != 0:
+      raise ValueError("ffmpeg returned with error: " + errorOutput)
+    if self.statistics:
+      self.statistics.addDuration('video', timeit.default_timer()-startTime)
+      self.statistics.addBytesWritten(os.path.getsize(self.outputVideoFilePath))
+
+  def abort(self):
+    if self.process is None:
+      return
+    self.process.kill()
+    self.process.wait()
+    self.errorOutputFile.close()
+    self.process = None
+
+#
+# Performance statistics
+#
+
+class CaptureStatistics(object):
+  """Collects durations of capture stages for each frame and summarizes them.
+  Stages:
+  - cache: looking up frames in the frame cache and storing captured frames
+  - update: changing slice offset, camera position, etc.
+  - render: rendering the view
+  - grab: getting the rendered image from the view
+  - trim: finding the content region of frames for automatic cropping
+  - output: passing the frame to the frame writer (includes waiting for a free frame buffer)
+  - encode: compressing the image
+  - write: writing image file
+  - video: video encoding
+  Durations may be added from multiple threads.
+  Skipped frames are captured frames that were identical to the previous frame, therefore were not written.
+  Cached frames were read from the frame cache instead of being rendered.
+  """
+
+  stageNames = ['cache', 'update', 'render', 'grab', 'trim', 'output', 'encode', 'write', 'video']
+
+  def __init__(self):
+    self.stageDurations = {}
+    self.numberOfFrames = 0
+    self.numberOfSkippedFrames = 0
+    self.numberOfCachedFrames = 0
+    self.bytesWritten = 0
+    self.startTime = timeit.default_timer()
+    self.stopTime = None
+    self.lock = threading.Lock()
+
+  def addDuration(self, stageName, duration):
+    with self.lock:
+      self.stageDurations.setdefault(stageName, []).append(duration)
+
+  def measure(self, stageName):
+    """Returns a context manager that adds the time spent in its block to the specified stage.
+    """
+    import contextlib
+    @contextlib.contextmanager
+    def measureStage():
+      startTime = timeit.default_timer()
+      yield
+      self.addDuration(stageName, timeit.default_timer()-startTime)
+    return measureStage()
+
+  def addFrame(self):
+    with self.lock:
+      self.numberOfFrames += 1
+
+  def addSkippedFrame(self):
+    with self.lock:
+      self.numberOfSkippedFrames += 1
+
+  def addCachedFrame(self):
+    with self.lock:
+      self.numberOfCachedFrames += 1
+
+  def addBytesWritten(self, numberOfBytes):
+    with self.lock:
+      self.bytesWritten += numberOfBytes
+
+  def stop(self):
+    self.stopTime = timeit.default_timer()
+
+  def getTotalTime(self):
+    stopTime = self.stopTime if self.stopTime is not None else timeit.default_timer()
+    return stopTime - self.startTime
+
+  def getSummary(self):
+    """Returns a dictionary with total capture time, frames per second, number of skipped and cached frames, bytes written,
+    and count, total, mean, median (p50), 95th percentile (p95), and maximum duration of each stage (in seconds).
+    """
+    totalTime = self.getTotalTime()
+    summary = {
+      'numberOfFrames': self.numberOfFrames,
+      'totalTime': totalTime,
+      'framesPerSecond': self.numberOfFrames/totalTime if totalTime > 0 else 0.0,
+      'numberOfSkippedFrames': self.numberOfSkippedFrames,
+      'numberOfCachedFrames': self.numberOfCachedFrames,
+      'bytesWritten': self.bytesWritten,
+      'stages': {}
+      }
+    with self.lock:
+      stageDurations = dict((stageName, numpy.array(durations)) for stageName, durations in self.stageDurations.items())
+    for stageName, durations in stageDurations.items():
+      summary['stages'][stageName] = {
+        'count': len(durations),
+        'total': float(durations.sum()),
+        'mean': float(durations.mean()),
+        'p50': float(numpy.percentile(durations, 50)),
+        'p95': float(numpy.percentile(durations, 95)),
+        'max': float(durations.max())
+        }
+    return summary
+
+  def getOrderedStageNames(self, summary):
+    return ([stageName for stageName in self.stageNames if stageName in summary['stages']]
+      + sorted([stageName for stageName in summary['stages'] if stageName not in self.stageNames]))
+
+  def getSummaryText(self):
+    summary = self.getSummary()
+    lines = ["Captured {0} frames in {1:.2f}s ({2:.1f} fps), {3:.1f} MB written".format(
+      summary['numberOfFrames'], summary['totalTime'], summary['framesPerSecond'], summary['bytesWritten']/1.0e6)]
+    if summary['numberOfSkippedFrames']:
+      lines.append("  {0} duplicate frames skipped".format(summary['numberOfSkippedFrames']))
+    if summary['numberOfCachedFrames']:
+      lines.append("  {0} frames reused from frame cache".format(summary['numberOfCachedFrames']))
+    for stageName in self.getOrderedStageNames(summary):
+      stage = summary['stages'][stageName]
+      lines.append("  {0}: total {1:.3f}s, mean {2:.1f}ms, p50 {3:.1f}ms, p95 {4:.1f}ms, max {5:.1f}ms".format(
+        stageName, stage['total'], stage['mean']*1000, stage['p50']*1000, stage['p95']*1000, stage['max']*1000))
+    return "\n".join(lines)
+
+  def writeJson(self, filename):
+    import json
+    with open(filename, 'w') as summaryFile:
+      json.dump(self.getSummary(), summaryFile, indent=2, sort_keys=True)
+
+  def writeCsv(self, filename):
+    """Write per-stage summary as a table, one stage per row.
+    """
+    summary = self.getSummary()
+    with open(filename, 'w') as summaryFile:
+      summaryFile.write("stage,count,total,mean,p50,p95,max\n")
+      for stageName in self.getOrderedStageNames(summary):
+        stage = summary['stages'][stageName]
+        summaryFile.write("{0},{1},{2},{3},{4},{5},{6}\n".format(stageName, stage['count'], stage['total'],
+          stage['mean'], stage['p50'], stage['p95'], stage['max']))
 
 class ScreenCaptureTest(ScriptedLoadableModuleTest):
   """
@@ -556,24 +4204,69 @@ class ScreenCaptureTest(ScriptedLoadableModuleTest):
 
     self.delayDisplay("Starting the test")
     #
-    # first, get some data
+    # first, create a synthetic volume (no network access is needed)
     #
-    import urllib
-    downloads = (
-        ('http://slicer.kitware.com/midas3/download?items=5767', 'FA.nrrd', slicer.util.loadVolume),
-        )
-
-    for url,name,loader in downloads:
-      filePath = slicer.app.temporaryPath + '/' + name
-      if not os.path.exists(filePath) or os.stat(filePath).st_size == 0:
-        logging.info('Requesting download %s from %s...\n' % (name, url))
-        urllib.urlretrieve(url, filePath)
-      if loader:
-        logging.info('Loading %s...' % (name,))
-        loader(filePath)
-    self.delayDisplay('Finished with download and loading')
-
-    volumeNode = slicer.util.getNode(pattern="FA")
+    imageSource = vtk.vtkImageEllipsoidSource()
+    imageSource.SetWholeExtent(0, 63, 0, 63, 0, 31)
+    imageSource.SetCenter(32, 32, 16)
+    imageSource.SetRadius(20, 25, 12)
+    imageSource.Update()
+    volumeNode = slicer.vtkMRMLScalarVolumeNode()
+    volumeNode.SetName("ScreenCaptureTestVolume")
+    volumeNode.SetAndObserveImageData(imageSource.GetOutput())
+    slicer.mrmlScene.AddNode(volumeNode)
+    volumeNode.CreateDefaultDisplayNodes()
+    slicer.util.setSliceViewerLayers(background=volumeNode, fit=True)
+    self.delayDisplay('Finished with creating test data')
+
     logic = ScreenCaptureLogic()
-    self.assertIsNotNone( logic.hasImageData(volumeNode) )
+    outputDir = os.path.join(slicer.app.temporaryPath, 'ScreenCaptureTest')
+    numberOfImages = 5
+
+    sliceNode = slicer.app.layoutManager().sliceWidget('Red').mrmlSliceNode()
+    sliceOffsetMin, sliceOffsetMax = logic.getSliceOffsetRange(sliceNode)
+    logic.captureSliceSweep(sliceNode, sliceOffsetMin, sliceOffsetMax, numberOfImages, outputDir, 'slice_%05d.png')
+    for imageIndex in range(numberOfImages):
+      self.assertTrue(os.path.isfile(os.path.join(outputDir, 'slice_%05d.png' % imageIndex)))
+    self.assertEqual(logic.captureStatistics.numberOfFrames, numberOfImages)
+
+    viewNode = slicer.app.layoutManager().threeDWidget(0).mrmlViewNode()
+    logic.capture3dViewRotation(viewNode, 90, 90, numberOfImages, outputDir, 'rotation_%05d.png')
+    for imageIndex in range(numberOfImages):
+      self.assertTrue(os.path.isfile(os.path.join(outputDir, 'rotation_%05d.png' % imageIndex)))
+
     self.delayDisplay('Test passed!')
+
+#
+# Command-line batch capture
+#
+
+def main(argv=None):
+  """
+  Run capture jobs of a job file (see ScreenCaptureLogic.runBatchCapture), so that application startup and
+  scene loading are shared by all the jobs:
+
+    Slicer --no-splash --python-script ScreenCapture.py --job-file jobs.json [--summary summary.json]
+
+  Views are rendered in the main window, therefore --no-main-window cannot be used. On a server without display,
+  run Slicer in a virtual display (e.g., xvfb-run). Results of each job are logged and written to the summary file.
+  Returns 0 if all the jobs are completed successfully.
+  """
+  import argparse
+  parser = argparse.ArgumentParser(description="Capture image sequences and videos of views, as specified in a job file.")
+  parser.add_argument("--job-file", required=True, help="JSON or YAML file that describes the capture jobs")
+  parser.add_argument("--summary", help="summary file path (default: summary.json in the output directory)")
+  args = parser.parse_args(argv)
+  logic = ScreenCaptureLogic()
+  try:
+    jobSummaries = logic.runBatchCapture(args.job_file, args.summary)
+  except (IOError, ValueError) as e:
+    logging.error("Batch capture failed: {0}".format(e))
+    return 1
+  for jobSummary in jobSummaries:
+    logging.info("{0}: {1} ({2:.1f}s){3}".format(jobSummary['name'], jobSummary['status'], jobSummary['elapsedTime'],
+      ": "+jobSummary['error'] if 'error' in jobSummary else ""))
+  return 0 if all(jobSummary['status'] == 'completed' for jobSummary in jobSummaries) else 1
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
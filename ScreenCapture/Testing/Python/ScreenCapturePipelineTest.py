@@ -0,0 +1,1184 @@
+"""Regression tests and benchmarks of the ScreenCapture capture pipeline.
+
+Slicer is replaced by a lightweight stand-in (see SlicerStandIn.py), therefore the tests run in plain Python
+(only numpy is required), without GPU, display, or network access.
+
+Run all tests:
+
+  python -m unittest -v ScreenCapturePipelineTest
+
+Benchmark options can be set in environment variables:
+- SCREENCAPTURE_BENCHMARK_FULL=1: include large (4K) frames and long captures
+- SCREENCAPTURE_BENCHMARK_OUTPUT=results.json: save benchmark results
+- SCREENCAPTURE_BENCHMARK_BASELINE=baseline.json: fail if performance is worse than in previously saved results
+- SCREENCAPTURE_BENCHMARK_TOLERANCE=0.3: allowed relative performance decrease compared to the baseline
+- SCREENCAPTURE_FFMPEG=/path/to/ffmpeg: ffmpeg executable for video benchmarks (found in the path by default)
+"""
+
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+import numpy
+
+import SlicerStandIn
+application = SlicerStandIn.install()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import ScreenCapture
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+def readPngFile(filename):
+  """Decode PNG files that are written by ScreenCapture.encodePng.
+  """
+  with open(filename, 'rb') as pngFile:
+    content = pngFile.read()
+  position = 8
+  compressedData = b''
+  while position < len(content):
+    length, = struct.unpack(">I", content[position:position+4])
+    chunkType = content[position+4:position+8]
+    data = content[position+8:position+8+length]
+    if chunkType == b'IHDR':
+      columns, rows, bitDepth, colorType = struct.unpack(">IIBB", data[:10])
+    elif chunkType == b'IDAT':
+      compressedData += data
+    position += length + 12
+  numberOfComponents = {0: 1, 4: 2, 2: 3, 6: 4}[colorType]
+  filteredRows = numpy.frombuffer(zlib.decompress(compressedData), numpy.uint8).reshape(rows, -1)
+  if not (filteredRows[:, 0] == 2).all():
+    raise ValueError("Only 'Up' filter is supported")
+  pixels = numpy.cumsum(filteredRows[:, 1:], axis=0, dtype=numpy.uint8)
+  return pixels.reshape(rows, columns, numberOfComponents)
+
+def readPngChunks(filename):
+  """Returns list of (chunk type, data) of a PNG file."""
+  with open(filename, 'rb') as pngFile:
+    content = pngFile.read()
+  chunks = []
+  position = 8
+  while position < len(content):
+    length, = struct.unpack(">I", content[position:position+4])
+    chunks.append((content[position+4:position+8], content[position+8:position+8+length]))
+    position += length + 12
+  return chunks
+
+def readGifFile(filename):
+  """Decode GIF files that are written by ScreenCapture.GifFrameWriter.
+  Returns list of (frame (rows, columns, RGB), display time in 1/100 s).
+  """
+  with open(filename, 'rb') as gifFile:
+    content = gifFile.read()
+  columns, rows = struct.unpack("<HH", content[6:10])
+  colorTable = numpy.frombuffer(content[13:13+768], numpy.uint8).reshape(256, 3)
+  canvas = numpy.zeros((rows, columns, 3), numpy.uint8)
+  frames = []
+  position = 13+768
+  while content[position:position+1] != b'\x3b':
+    if content[position:position+2] == b'\x21\xf9':
+      packedFields, displayTime, transparentIndex = struct.unpack("<BHB", content[position+3:position+7])
+      position += 8
+    elif content[position:position+1] == b'\x21':
+      position += 2
+      while content[position] != 0:
+        position += content[position] + 1
+      position += 1
+    else:
+      left, top, width, height, imagePackedFields = struct.unpack("<HHHHB", content[position+1:position+10])
+      position += 10
+      imageColorTable = colorTable
+      if imagePackedFields & 0x80:
+        localColorTableSize = 2 << (imagePackedFields & 7)
+        imageColorTable = numpy.frombuffer(content[position:position+3*localColorTableSize], numpy.uint8).reshape(-1, 3)
+        position += 3*localColorTableSize
+      minimumCodeSize = content[position]
+      position += 1
+      data = bytearray()
+      while content[position] != 0:
+        data += content[position+1:position+1+content[position]]
+        position += content[position] + 1
+      position += 1
+      # LZW decoding
+      clearCode = 1 << minimumCodeSize
+      bits = int.from_bytes(bytes(data), 'little')
+      bitPosition = 0
+      indices = []
+      codeSize = minimumCodeSize + 1
+      table = None
+      previous = None
+      while True:
+        code = (bits >> bitPosition) & ((1 << codeSize) - 1)
+        bitPosition += codeSize
+        if code == clearCode:
+          table = [[index] for index in range(clearCode)] + [None, None]
+          codeSize = minimumCodeSize + 1
+          previous = None
+          continue
+        if code == clearCode + 1:
+          break
+        entry = table[code] if code < len(table) else table[previous] + [table[previous][0]]
+        if previous is not None and len(table) < 4096:
+          table.append(table[previous] + [entry[0]])
+        indices += entry
+        previous = code
+        if len(table) == (1 << codeSize) and codeSize < 12:
+          codeSize += 1
+      indices = numpy.array(indices, numpy.uint8).reshape(height, width)
+      region = canvas[top:top+height, left:left+width]
+      opaque = indices != transparentIndex if packedFields & 1 else numpy.ones(indices.shape, bool)
+      region[opaque] = imageColorTable[indices[opaque]]
+      frames.append((canvas.copy(), displayTime))
+  return frames
+
+def findFfmpeg():
+  ffmpegPath = os.environ.get('SCREENCAPTURE_FFMPEG')
+  if ffmpegPath:
+    return ffmpegPath
+  for directory in os.environ.get('PATH', '').split(os.pathsep):
+    for name in ['ffmpeg', 'ffmpeg.exe']:
+      if os.path.isfile(os.path.join(directory, name)):
+        return os.path.join(directory, name)
+  return None
+
+def getNumberOfVideoFrames(filename):
+  import subprocess
+  process = subprocess.Popen([findFfmpeg(), "-i", filename, "-f", "null", "-"],
+    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  output = process.communicate()[0].decode('utf-8', 'replace')
+  return int(re.findall(r"frame=\s*(\d+)", output)[-1])
+
+class DiscardFrameWriter(object):
+  """Frame writer that ignores all frames, for measuring the capture pipeline without output costs."""
+
+  def setStatistics(self, statistics):
+    pass
+
+  def getFrameDescription(self, frameIndex):
+    return "frame {0}".format(frameIndex)
+
+  def writeFrame(self, frameIndex, frame):
+    pass
+
+  def close(self):
+    pass
+
+  def abort(self):
+    pass
+
+class FailingFrameWriter(DiscardFrameWriter):
+  """Frame writer that fails when it receives the specified frame, for simulating an interrupted capture."""
+
+  def __init__(self, failingFrameIndex):
+    self.failingFrameIndex = failingFrameIndex
+
+  def writeFrame(self, frameIndex, frame):
+    if frameIndex == self.failingFrameIndex:
+      raise IOError("Disk is full")
+
+class CaptureTestBase(unittest.TestCase):
+
+  def setUp(self):
+    application.reset()
+    self.logic = ScreenCapture.ScreenCaptureLogic()
+    self.outputDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.outputDir)
+
+  def getSliceView(self, sliceNode):
+    return application.layoutManager().sliceWidget(sliceNode.GetLayoutName()).sliceView()
+
+class ScreenCapturePipelineTest(CaptureTestBase):
+
+  def test_sliceSweepImageSequence(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 64, 48)
+    self.logic.numberOfWriterThreads = 0
+    self.logic.captureSliceSweep(sliceNode, -20, 20, 5, self.outputDir, "image_%05d.png")
+    self.assertEqual(sorted(os.listdir(self.outputDir)), ["image_%05d.png" % index for index in range(5)])
+
+    sliceView = self.getSliceView(sliceNode)
+    sliceView.sliceLogic.SetSliceOffset(-20)
+    self.assertTrue((readPngFile(os.path.join(self.outputDir, "image_00000.png")) == sliceView.renderFrame(64, 48)).all())
+    sliceView.sliceLogic.SetSliceOffset(20)
+    self.assertTrue((readPngFile(os.path.join(self.outputDir, "image_00004.png")) == sliceView.renderFrame(64, 48)).all())
+
+  def test_sliceSweepRestoresSliceOffset(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 32)
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(12.5)
+    self.logic.captureSliceSweep(sliceNode, -20, 20, 5, self.outputDir, "image_%05d.png")
+    self.assertEqual(self.getSliceView(sliceNode).sliceLogic.GetSliceOffset(), 12.5)
+
+  def test_nativeResolutionSliceSweep(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24, sliceOffsetRange=(-10, 10), sliceSpacing=2.5)
+    sliceLogic = self.getSliceView(sliceNode).sliceLogic
+    sliceLogic.SetSliceOffset(3.0)
+    numpy.testing.assert_allclose(self.logic.getVoxelAlignedSliceOffsets(sliceNode),
+      [-8.75, -6.25, -3.75, -1.25, 1.25, 3.75, 6.25, 8.75])
+    numpy.testing.assert_allclose(self.logic.getVoxelAlignedSliceOffsets(sliceNode, 5, -4), [-3.75, -1.25, 1.25, 3.75])
+    self.assertEqual(sliceLogic.GetSliceOffset(), 3.0)
+
+    renderedOffsets = []
+    def setSliceOffset(offset, originalSetSliceOffset=sliceLogic.SetSliceOffset):
+      renderedOffsets.append(offset)
+      originalSetSliceOffset(offset)
+    sliceLogic.SetSliceOffset = setSliceOffset
+    self.assertEqual(self.logic.captureNativeResolutionSliceSweep(sliceNode, self.outputDir, "image_%05d.png",
+                                                                  startSliceOffset=5, endSliceOffset=-4), 4)
+    # each slice is rendered once, from start towards end, then the original offset is restored
+    numpy.testing.assert_allclose(renderedOffsets[-5:], [3.75, 1.25, -1.25, -3.75, 3.0])
+    self.assertEqual(len(os.listdir(self.outputDir)), 4)
+
+  def test_writerThreadsProduceSameImages(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 80, 60)
+    synchronousDir = os.path.join(self.outputDir, "synchronous")
+    threadedDir = os.path.join(self.outputDir, "threaded")
+    self.logic.numberOfWriterThreads = 0
+    self.logic.captureSliceSweep(sliceNode, -30, 30, 12, synchronousDir, "image_%05d.png")
+    self.logic.numberOfWriterThreads = 4
+    self.logic.numberOfFrameBuffers = 3
+    self.logic.captureSliceSweep(sliceNode, -30, 30, 12, threadedDir, "image_%05d.png")
+    for index in range(12):
+      filename = "image_%05d.png" % index
+      self.assertTrue((readPngFile(os.path.join(synchronousDir, filename))
+        == readPngFile(os.path.join(threadedDir, filename))).all())
+
+  def test_3dViewRotation(self):
+    viewNode = application.layoutManager().addThreeDView(40, 30)
+    frameWriter = ScreenCapture.ArrayFrameWriter(7)
+    self.logic.capture3dViewRotation(viewNode, 90, 90, 7, self.outputDir, "image_%05d.png", frameWriter)
+    self.assertEqual(frameWriter.frames.shape, (7, 30, 40, 3))
+    # consecutive frames are different
+    for index in range(6):
+      self.assertFalse((frameWriter.frames[index] == frameWriter.frames[index+1]).all())
+    view = application.layoutManager().threeDWidget(0).threeDView()
+    self.assertAlmostEqual(view.yawAngle, 0.0)
+
+  def test_3dViewRotationUsesAbsoluteCameraPoses(self):
+    viewNode = application.layoutManager().addThreeDView(40, 30)
+    view = application.layoutManager().threeDWidget(0).threeDView()
+    camera = view.getCamera()
+    camera.SetPosition(100.0, -300.0, 0.0)
+    camera.SetViewUp(0.0, 0.0, 1.0)
+    camera.OrthogonalizeViewUp()
+    originalCameraState = (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp(), camera.GetClippingRange())
+    yawAngles = []
+    originalForceRender = view.forceRender
+    def forceRender():
+      yawAngles.append(view.yawAngle)
+      originalForceRender()
+    view.forceRender = forceRender
+    self.logic.capture3dViewRotation(viewNode, 90, 90, 7, self.outputDir, None, ScreenCapture.ArrayFrameWriter(7))
+    initialYawAngle = view.yawAngle
+    numpy.testing.assert_allclose(numpy.array(yawAngles) - initialYawAngle, numpy.linspace(-90, 90, 7), atol=1e-9)
+    self.assertEqual((camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp(), camera.GetClippingRange()),
+      originalCameraState)
+
+  def test_cameraPaths(self):
+    cameraPose = ((0.0, -100.0, 0.0), (0.0, 0.0, 0.0), (0.0, 0.0, 1.0))
+    # turntable around the world S axis
+    cameraPath = ScreenCapture.computeRotationCameraPath(cameraPose, (0, 0, 1), [0, 90, 180])
+    numpy.testing.assert_allclose(cameraPath.positions, [[0, -100, 0], [100, 0, 0], [0, 100, 0]], atol=1e-9)
+    numpy.testing.assert_allclose(cameraPath.viewUps, [[0, 0, 1]] * 3, atol=1e-9)
+    # elevation arc: camera moves up
+    cameraPath = ScreenCapture.computeRotationCameraPath(cameraPose,
+      ScreenCapture.getCameraRotationAxis(cameraPose, 'pitch'), [0, 90])
+    numpy.testing.assert_allclose(cameraPath.positions[1], [0, 0, 100], atol=1e-9)
+    numpy.testing.assert_allclose(cameraPath.viewUps[1], [0, 1, 0], atol=1e-9)
+    # fly-through goes through the keyframes
+    keyframePoses = [cameraPose, ((0.0, -50.0, 20.0), (0.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+      ((30.0, -10.0, 0.0), (0.0, 10.0, 0.0), (0.0, 0.0, 1.0))]
+    cameraPath = ScreenCapture.computeKeyframeCameraPath(keyframePoses, 9)
+    self.assertEqual(cameraPath.numberOfPoses, 9)
+    for poseIndex, keyframeIndex in [(0, 0), (4, 1), (8, 2)]:
+      numpy.testing.assert_allclose(cameraPath.positions[poseIndex], keyframePoses[keyframeIndex][0], atol=1e-9)
+      numpy.testing.assert_allclose(cameraPath.focalPoints[poseIndex], keyframePoses[keyframeIndex][1], atol=1e-9)
+    # view up is orthogonal to the viewing direction
+    directions = cameraPath.focalPoints - cameraPath.positions
+    numpy.testing.assert_allclose((directions * cameraPath.viewUps).sum(axis=1), 0, atol=1e-9)
+
+  def test_cameraPathCapture(self):
+    viewNode = application.layoutManager().addThreeDView(40, 30)
+    view = application.layoutManager().threeDWidget(0).threeDView()
+    originalPose = self.logic.getCameraPose(viewNode)
+    cameraPath = ScreenCapture.computeRotationCameraPath(originalPose, (0, 0, 1), [0, 30, 60, 90])
+    self.logic.captureCameraPath(viewNode, cameraPath, self.outputDir, "image_%05d.png")
+    self.assertEqual(sorted(os.listdir(self.outputDir)), ["image_%05d.png" % index for index in range(4)])
+    self.assertEqual(self.logic.getCameraPose(viewNode), originalPose)
+    view.getCamera().SetPosition(cameraPath.positions[3])
+    self.assertTrue((readPngFile(os.path.join(self.outputDir, "image_00003.png")) == view.renderFrame(40, 30)).all())
+
+  def test_sphericalGridCapture(self):
+    viewNode = application.layoutManager().addThreeDView(40, 30)
+    view = application.layoutManager().threeDWidget(0).threeDView()
+    originalPose = self.logic.getCameraPose(viewNode)
+    yawAngles = numpy.arange(0, 360, 60)
+    pitchAngles = [-30, 0, 30]
+    visitedYawAngles = []
+    originalForceRender = view.forceRender
+    def forceRender():
+      visitedYawAngles.append(round(view.yawAngle))
+      originalForceRender()
+    view.forceRender = forceRender
+    frameWriter = ScreenCapture.ArrayFrameWriter(18)
+    self.logic.captureSphericalGrid(viewNode, yawAngles, pitchAngles, self.outputDir, "image_%05d.png",
+      "sprites_%02d.png", "index.json", 2, frameWriter)
+    self.assertEqual(self.logic.getCameraPose(viewNode), originalPose)
+    # camera moves by a single step between frames
+    self.assertEqual(visitedYawAngles[:8], [0, 60, 120, 180, -120, -60, -60, -120])
+    with open(os.path.join(self.outputDir, "index.json")) as indexFile:
+      index = json.load(indexFile)
+    self.assertEqual(index['sheets'], ["sprites_00.png"])
+    self.assertEqual((index['tileWidth'], index['tileHeight']), (20, 15))
+    self.assertEqual(len(index['frames']), 18)
+    frameInfo = index['frames'][7]
+    self.assertEqual((frameInfo['yaw'], frameInfo['pitch']), (60, 0))
+    # frames are stored in grid order
+    self.assertTrue((readPngFile(os.path.join(self.outputDir, frameInfo['image'])) == frameWriter.frames[7]).all())
+    sheet = readPngFile(os.path.join(self.outputDir, "sprites_00.png"))
+    self.assertEqual(sheet.shape, (15, 18*20, 3))
+    tile = sheet[frameInfo['y']:frameInfo['y']+15, frameInfo['x']:frameInfo['x']+20]
+    self.assertTrue((tile == ScreenCapture.downsampleFrame(frameWriter.frames[7], 2)).all())
+
+  def test_spriteSheetsAreSplit(self):
+    frameWriter = ScreenCapture.SpriteSheetFrameWriter(os.path.join(self.outputDir, "sprites_%02d.png"), 7,
+      maximumSheetSize=25)
+    for frameIndex in reversed(range(7)):
+      frameWriter.writeFrame(frameIndex, numpy.full((10, 12, 3), frameIndex, numpy.uint8))
+    frameWriter.close()
+    # 2 tiles per row, 2 rows per sheet
+    self.assertEqual(sorted(os.listdir(self.outputDir)), ["sprites_00.png", "sprites_01.png"])
+    self.assertEqual(frameWriter.getTilePlacement(6), {'sheet': 1, 'x': 0, 'y': 10})
+    sheet = readPngFile(os.path.join(self.outputDir, "sprites_01.png"))
+    self.assertEqual(sheet.shape, (20, 24, 3))
+    self.assertTrue((sheet[10:20, 0:12] == 6).all())
+
+  def test_sequenceCapture(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    browserNode = application.addSequenceBrowser(10)
+    browserNode.SetSelectedItemNumber(4)
+    events = []
+    def prefetcher(browserNode, itemIndex):
+      events.append(("prepare", itemIndex, browserNode.GetSelectedItemNumber()))
+      return lambda: events.append(("prefetch", itemIndex))
+    frameWriter = ScreenCapture.ArrayFrameWriter(4)
+    self.logic.captureSequence(browserNode, sliceNode, 0, 9, 4, self.outputDir, None, frameWriter, prefetcher=prefetcher)
+    self.assertEqual(browserNode.GetSelectedItemNumber(), 4)
+    # next item is prefetched while the current item is captured
+    self.assertEqual(events, [("prepare", 3, 0), ("prefetch", 3), ("prepare", 6, 3), ("prefetch", 6),
+      ("prepare", 9, 6), ("prefetch", 9)])
+    sliceView = self.getSliceView(sliceNode)
+    browserNode.SetSelectedItemNumber(6)
+    self.assertTrue((frameWriter.frames[2] == sliceView.renderFrame(32, 24)).all())
+    # file prefetcher reads the files of the item
+    itemFilePath = os.path.join(self.outputDir, "item.nrrd")
+    with open(itemFilePath, 'wb') as itemFile:
+      itemFile.write(b"x" * 3000)
+    prefetcher = ScreenCapture.createFilePrefetcher(lambda browserNode, itemIndex: [itemFilePath] if itemIndex == 2 else [],
+      blockSize=1024)
+    self.assertIsNone(prefetcher(browserNode, 1))
+    prefetcher(browserNode, 2)()
+    os.remove(itemFilePath)
+    self.logic.captureSequence(browserNode, sliceNode, 0, 9, 10, self.outputDir, "image_%05d.png")
+    self.assertEqual(len(os.listdir(self.outputDir)), 10)
+
+  def test_batchCapture(self):
+    application.layoutManager().addSliceView("Red", 32, 24)
+    application.layoutManager().addThreeDView(40, 30)
+    application.addSequenceBrowser(6, "Cine")
+    jobFilePath = os.path.join(self.outputDir, "jobs.json")
+    with open(jobFilePath, 'w') as jobFile:
+      json.dump({
+        "scene": "head.mrb",
+        "layout": "FourUp",
+        "outputDir": "output",
+        "numberOfWriterThreads": 0,
+        "jobs": [
+          {"name": "axial", "view": "Red", "startSliceOffset": -10, "endSliceOffset": 10, "numberOfImages": 3},
+          {"name": "spin", "type": "3dViewRotation", "view": "View1", "numberOfImages": 4,
+            "fileNamePattern": "spin_%03d.png", "video": "spin.gif", "frameRate": 10},
+          {"name": "missing", "view": "Green"},
+          {"name": "cine", "type": "sequence", "view": "Red", "sequenceBrowser": "Cine"},
+          {"name": "other", "view": "Red", "numberOfImages": 2, "scene": "chest.mrb"}
+          ]
+        }, jobFile)
+    summaryFilePath = os.path.join(self.outputDir, "summary.json")
+    self.assertEqual(ScreenCapture.main(["--job-file", jobFilePath, "--summary", summaryFilePath]), 1)
+
+    # scene is loaded once for all the jobs that use it
+    self.assertEqual(application.events, [("clear scene",), ("load scene", os.path.join(self.outputDir, "head.mrb")),
+      ("clear scene",), ("load scene", os.path.join(self.outputDir, "chest.mrb"))])
+    self.assertEqual(application.layoutManager().layout, SlicerStandIn.StandInLayoutNode.SlicerLayoutFourUpView)
+    self.assertEqual(self.logic.numberOfWriterThreads, ScreenCapture.ScreenCaptureLogic().numberOfWriterThreads)
+
+    outputDir = os.path.join(self.outputDir, "output")
+    self.assertEqual(sorted(os.listdir(os.path.join(outputDir, "axial"))), ["image_%05d.png" % index for index in range(3)])
+    self.assertEqual(os.listdir(os.path.join(outputDir, "spin")), ["spin.gif"])
+    self.assertEqual(len(os.listdir(os.path.join(outputDir, "cine"))), 6)
+    with open(summaryFilePath) as summaryFile:
+      jobSummaries = json.load(summaryFile)['jobs']
+    self.assertEqual([(jobSummary['name'], jobSummary['status']) for jobSummary in jobSummaries],
+      [("axial", "completed"), ("spin", "completed"), ("missing", "failed"), ("cine", "completed"), ("other", "completed")])
+    self.assertEqual(jobSummaries[0]['numberOfFrames'], 3)
+    self.assertEqual(jobSummaries[0]['statistics']['numberOfFrames'], 3)
+    self.assertIn("Green", jobSummaries[2]['error'])
+    self.assertNotIn('statistics', jobSummaries[2])
+
+  def test_batchCaptureJobErrors(self):
+    application.layoutManager().addSliceView("Red", 32, 24)
+    createdWriters = []
+    abortedWriters = []
+    def createAnimationWriter(*args):
+      frameWriter = ScreenCapture.ArrayFrameWriter(3)
+      frameWriter.abort = lambda: abortedWriters.append(frameWriter)
+      createdWriters.append(frameWriter)
+      return frameWriter
+    self.logic.createAnimationWriter = createAnimationWriter
+    # invalid jobs are rejected before output is created
+    for jobDescription, message in [({"type": "unknown"}, "unknown"), ({"type": "sequence", "sequenceBrowser": "Cine"}, "Cine")]:
+      jobDescription.update({"view": "Red", "video": "animation.gif"})
+      with self.assertRaises(ValueError) as context:
+        self.logic.createBatchCaptureJob(jobDescription, self.outputDir)
+      self.assertIn(message, str(context.exception))
+    self.assertEqual(createdWriters, [])
+    # output is aborted if the job cannot be created
+    def createSliceSweepJob(*args):
+      raise ValueError("Slice view is not visible")
+    self.logic.createSliceSweepJob = createSliceSweepJob
+    self.assertRaises(ValueError, self.logic.createBatchCaptureJob, {"view": "Red", "video": "animation.gif"},
+      self.outputDir)
+    self.assertEqual(abortedWriters, createdWriters)
+    self.assertEqual(len(createdWriters), 1)
+
+  def test_batchCaptureFfmpegPath(self):
+    application.layoutManager().addSliceView("Red", 32, 24)
+    self.logic.setFfmpegPath("ffmpeg-of-application")
+    jobFilePath = os.path.join(self.outputDir, "jobs.json")
+    with open(jobFilePath, 'w') as jobFile:
+      json.dump({"jobs": [{"name": "axial", "view": "Red", "video": "axial.mp4", "ffmpegPath": "ffmpeg-of-job"}]}, jobFile)
+    jobSummaries = self.logic.runBatchCapture(jobFilePath)
+    # ffmpeg path of the job is used, but it is not saved in application settings
+    self.assertIn("ffmpeg-of-job", jobSummaries[0]['error'])
+    self.assertEqual(self.logic.getFfmpegPath(), "ffmpeg-of-application")
+    self.assertEqual(ScreenCapture.ScreenCaptureLogic().getFfmpegPath(), "ffmpeg-of-application")
+
+  def test_batchCaptureRequiresMainWindow(self):
+    jobFilePath = os.path.join(self.outputDir, "jobs.json")
+    with open(jobFilePath, 'w') as jobFile:
+      json.dump({"jobs": [{"name": "axial", "view": "Red"}]}, jobFile)
+    # application started with --no-main-window
+    application.manager = None
+    with self.assertRaises(ValueError) as context:
+      self.logic.runBatchCapture(jobFilePath)
+    self.assertIn("--no-main-window", str(context.exception))
+    self.assertEqual(ScreenCapture.main(["--job-file", jobFilePath]), 1)
+
+  def test_imageFormats(self):
+    frame = numpy.random.RandomState(3).randint(0, 256, (13, 7, 3)).astype(numpy.uint8)
+    # PNG presets are all readable by the same decoder
+    for imageFormat in ['png', 'png-small', 'fast-lossless']:
+      filename = os.path.join(self.outputDir, imageFormat + ".png")
+      ScreenCapture.writeImageFile(filename, frame, encoder=ScreenCapture.createImageEncoder(imageFormat))
+      self.assertTrue((readPngFile(filename) == frame).all())
+    # uncompressed formats store pixels after the header
+    tiffContent = ScreenCapture.createImageEncoder('tiff').encode(frame)
+    self.assertEqual(tiffContent[:4], b"II*\x00")
+    stripOffset = len(tiffContent) - frame.nbytes
+    self.assertIn(struct.pack("<HHII", 273, 4, 1, stripOffset), tiffContent)
+    self.assertEqual(tiffContent[stripOffset:], frame.tobytes())
+    self.assertEqual(ScreenCapture.createImageEncoder('raw').encode(frame), b"P6\n7 13\n255\n" + frame.tobytes())
+    self.assertEqual(ScreenCapture.createImageEncoder('png', compressionLevel=0).settings, {'compressionLevel': 0})
+    self.assertRaises(ValueError, ScreenCapture.createImageEncoder, 'webp')
+
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    self.logic.imageFormat = 'raw'
+    self.assertEqual(self.logic.getImageFileNamePattern("image_%05d.png"), "image_%05d.ppm")
+    self.assertEqual(self.logic.getImageFileNamePattern("image_%05d.pgm"), "image_%05d.pgm")
+    self.assertRaises(ValueError, self.logic.captureSliceSweep, sliceNode, -10, 10, 3, self.outputDir, "slice_%05d.png")
+    self.logic.captureSliceSweep(sliceNode, -10, 10, 3, self.outputDir, "slice_%05d.ppm")
+    with open(os.path.join(self.outputDir, "slice_00002.ppm"), 'rb') as imageFile:
+      content = imageFile.read()
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(10)
+    self.assertEqual(content, b"P6\n32 24\n255\n" + self.getSliceView(sliceNode).renderFrame(32, 24).tobytes())
+
+  def test_benchmarkImageFormats(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 64, 48)
+    results = self.logic.benchmarkImageFormats(sliceNode, ['png', 'fast-lossless', 'tiff', 'raw'], 3)
+    self.assertEqual([result['imageFormat'] for result in results], ['png', 'fast-lossless', 'tiff', 'raw'])
+    resultsByFormat = dict((result['imageFormat'], result) for result in results)
+    self.assertEqual(resultsByFormat['raw']['bytesPerFrame'], len(b"P6\n64 48\n255\n") + 64*48*3)
+    self.assertTrue(resultsByFormat['png']['bytesPerFrame'] < resultsByFormat['tiff']['bytesPerFrame'])
+    self.assertTrue(all(result['framesPerSecond'] > 0 for result in results))
+
+  def test_multiResolutionOutput(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 40, 30)
+    frameWriter = self.logic.createMultiResolutionWriter(self.outputDir, "image_%05d.png", [1, 2, 4])
+    self.logic.captureSliceSweep(sliceNode, -10, 10, 3, self.outputDir, None, frameWriter)
+    self.assertEqual(sorted(os.listdir(self.outputDir)), ["scale_1", "scale_1_2", "scale_1_4"])
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(0)
+    frame = self.getSliceView(sliceNode).renderFrame(40, 30)
+    for downsamplingFactor, shape in [(1, (30, 40, 3)), (2, (15, 20, 3)), (4, (7, 10, 3))]:
+      levelOutputDir = self.logic.getMultiResolutionOutputDir(self.outputDir, downsamplingFactor)
+      self.assertEqual(len(os.listdir(levelOutputDir)), 3)
+      image = readPngFile(os.path.join(levelOutputDir, "image_00001.png"))
+      self.assertEqual(image.shape, shape)
+      self.assertTrue((image == ScreenCapture.downsampleFrame(frame, downsamplingFactor)).all())
+    self.assertEqual(self.logic.captureStatistics.getSummary()['stages']['downsample']['count'], 9)
+
+    # video frames are cropped to even size
+    writer = ScreenCapture.DownsamplingFrameWriter(ScreenCapture.ArrayFrameWriter(1, frames=numpy.zeros((1, 6, 10, 3), numpy.uint8)),
+      4, evenSize=True)
+    writer.writeFrame(0, frame)
+    self.assertTrue((writer.frameWriter.frames[0] == ScreenCapture.downsampleFrame(frame, 4)[:6]).all())
+    if findFfmpeg():
+      self.logic.setFfmpegPath(findFfmpeg())
+      videoOutputDir = os.path.join(self.outputDir, "video")
+      frameWriter = self.logic.createMultiResolutionWriter(videoOutputDir, None, [1, 4], "capture.mp4")
+      self.logic.captureSliceSweep(sliceNode, -10, 10, 5, self.outputDir, None, frameWriter)
+      for downsamplingFactor in [1, 4]:
+        levelOutputDir = self.logic.getMultiResolutionOutputDir(videoOutputDir, downsamplingFactor)
+        self.assertEqual(getNumberOfVideoFrames(os.path.join(levelOutputDir, "capture.mp4")), 5)
+
+  def test_frameCache(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    sliceView = self.getSliceView(sliceNode)
+    displayNode = application.addDisplayNode()
+    sliceModelDisplayNode = application.addDisplayNode(helper=True)
+    self.logic.numberOfWriterThreads = 0
+    expectedFrames = self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8)
+    cacheDir = os.path.join(self.outputDir, "FrameCache")
+    frameCache = self.logic.createFrameCache(cacheDir)
+
+    # interrupted capture keeps the frames that were captured
+    self.assertRaises(IOError, self.logic.captureSliceSweep, sliceNode, -20, 20, 8, self.outputDir, None,
+      FailingFrameWriter(3))
+    with open(os.path.join(cacheDir, "manifest.json")) as manifestFile:
+      self.assertEqual(len(json.load(manifestFile)['frames']), 4)
+
+    # restarted capture renders only the remaining frames
+    numberOfRenders = sliceView.numberOfRenders
+    frames = self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8)
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 4)
+    self.assertEqual(self.logic.captureStatistics.getSummary()['numberOfCachedFrames'], 4)
+    self.assertTrue((frames == expectedFrames).all())
+    numberOfRenders = sliceView.numberOfRenders
+    self.assertTrue((self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8) == expectedFrames).all())
+    self.assertEqual(sliceView.numberOfRenders, numberOfRenders)
+    # slice models are updated when the slice offset changes, they do not make cached frames invalid
+    sliceModelDisplayNode.Modified()
+    sliceModelDisplayNode.GetDisplayableNode().Modified()
+    self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8)
+    self.assertEqual(sliceView.numberOfRenders, numberOfRenders)
+
+    # changes in the scene or in the view make cached frames invalid
+    displayNode.Modified()
+    self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8)
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 8)
+    sliceView.width = 30
+    self.assertEqual(self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8).shape, (8, 24, 30, 3))
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 16)
+    self.assertEqual(len(frameCache), 24)
+
+    # frames that are not in the manifest (cache was not saved) are found, too
+    os.remove(os.path.join(cacheDir, "manifest.json"))
+    frameCache = ScreenCapture.FrameCache(cacheDir)
+    self.assertEqual(len(frameCache), 24)
+    # frames are replaced in place, without leaving temporary files
+    key = next(iter(frameCache.frameSizes))
+    frameCache.addFrame(key, expectedFrames[0])
+    self.assertTrue((frameCache.getFrame(key) == expectedFrames[0]).all())
+    self.assertEqual(frameCache.totalSize, sum(os.path.getsize(os.path.join(cacheDir, fileName))
+      for fileName in os.listdir(cacheDir) if fileName.endswith(".npy")))
+    self.assertEqual([fileName for fileName in os.listdir(cacheDir) if fileName.endswith(".tmp")], [])
+
+    # least recently used frames are removed when the cache is full
+    frameSize = os.path.getsize(os.path.join(cacheDir, os.listdir(cacheDir)[0]))
+    self.logic.createFrameCache(cacheDir, maximumSize=10*frameSize)
+    self.assertEqual(len(self.logic.frameCache), 10)
+    sliceView.width = 32
+    numberOfRenders = sliceView.numberOfRenders
+    self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 8)
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 8)
+    self.assertEqual(len([fileName for fileName in os.listdir(cacheDir) if fileName.endswith(".npy")]), 10)
+
+    # camera poses are part of the key
+    viewNode = application.layoutManager().addThreeDView(40, 30)
+    threeDView = application.layoutManager().threeDWidget(0).threeDView()
+    expectedFrames = self.logic.capture3dViewRotationToArray(viewNode, 90, 90, 5)
+    numberOfRenders = threeDView.numberOfRenders
+    self.assertTrue((self.logic.capture3dViewRotationToArray(viewNode, 90, 90, 5) == expectedFrames).all())
+    self.assertEqual(threeDView.numberOfRenders, numberOfRenders)
+    self.logic.capture3dViewRotationToArray(viewNode, 90, 90, 4)
+    self.assertEqual(threeDView.numberOfRenders - numberOfRenders, 2)
+
+  def test_cropRegion(self):
+    # content is found on uniform and vertical gradient backgrounds
+    frame = numpy.zeros((30, 40, 3), numpy.uint8)
+    frame[:, :, 2] = numpy.arange(30)[:, numpy.newaxis] * 8
+    frame[11:17, 21:26] = 255
+    contentMask = ScreenCapture.getContentMask(frame, samplingStep=2)
+    self.assertEqual(ScreenCapture.getContentRegion(contentMask, frame.shape, samplingStep=2), (11, 18, 21, 26))
+    self.assertEqual(ScreenCapture.getContentRegion(contentMask, frame.shape, samplingStep=2, margin=30, evenSize=True),
+      (0, 30, 0, 40))
+    self.assertEqual(ScreenCapture.getContentRegion(ScreenCapture.getContentMask(frame, samplingStep=4), frame.shape,
+      samplingStep=4, evenSize=True), (9, 21, 21, 29))
+    self.assertIsNone(ScreenCapture.getContentRegion(ScreenCapture.getContentMask(frame[:10]), frame[:10].shape))
+
+    sliceNode = application.layoutManager().addSliceView("Red", 64, 48)
+    sliceView = self.getSliceView(sliceNode)
+    self.logic.numberOfWriterThreads = 0
+    fullFrames = self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 6)
+    self.logic.cropRegion = (2, 10, 4, 20)
+    self.assertTrue((self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 6) == fullFrames[:, 2:10, 4:20]).all())
+    # regions that are empty or not inside the view are rejected
+    for cropRegion in [(2, 10, 4, 70), (-1, 10, 4, 20), (10, 10, 4, 20)]:
+      self.logic.cropRegion = cropRegion
+      with self.assertRaises(ValueError) as context:
+        self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 6)
+      self.assertIn("64x48", str(context.exception))
+
+    # all frames are cropped to the same region that contains the content of all frames
+    self.logic.cropRegion = 'auto'
+    progress = []
+    self.logic.progressCallback = lambda numberOfCapturedFrames, numberOfFrames: progress.append(
+      (numberOfCapturedFrames, numberOfFrames))
+    # each frame is rendered once, frames are kept in a temporary file until the crop region is known
+    scannedFramesDir = os.path.join(self.outputDir, "Temp")
+    os.makedirs(scannedFramesDir)
+    import tempfile
+    tempDir = tempfile.tempdir
+    tempfile.tempdir = scannedFramesDir
+    try:
+      numberOfRenders = sliceView.numberOfRenders
+      frames = self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 6)
+    finally:
+      tempfile.tempdir = tempDir
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 6)
+    self.assertEqual(os.listdir(scannedFramesDir), [])
+    self.assertEqual(progress[-1], (12, 12))
+    firstRow, endRow, firstColumn, endColumn = ScreenCapture.getChangedRegion(fullFrames.any(axis=0), False)
+    self.assertTrue(endRow - firstRow <= frames.shape[1] < 48 and endColumn - firstColumn <= frames.shape[2] < 64)
+    self.assertEqual((frames.shape[1] % 2, frames.shape[2] % 2), (0, 0))
+    self.assertEqual(frames.astype(int).sum(), fullFrames.astype(int).sum())
+    self.assertEqual(self.logic.captureStatistics.getSummary()['stages']['trim']['count'], 6)
+
+    # with frame cache the frames are not rendered again
+    self.logic.createFrameCache(os.path.join(self.outputDir, "FrameCache"))
+    numberOfRenders = sliceView.numberOfRenders
+    self.assertTrue((self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 6) == frames).all())
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 6)
+    self.assertTrue((self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 6) == frames).all())
+    self.assertEqual(sliceView.numberOfRenders - numberOfRenders, 6)
+    self.assertEqual(self.logic.captureStatistics.numberOfCachedFrames, 6)
+
+  def test_qImageConversion(self):
+    frame = numpy.random.RandomState(5).randint(0, 256, (9, 11, 3)).astype(numpy.uint8)
+    qimage = SlicerStandIn.StandInQImage(frame)
+    pixels = ScreenCapture.getQImagePixels(qimage)
+    self.assertTrue((pixels == frame).all())
+    self.assertTrue(numpy.shares_memory(pixels, qimage.bits))
+    self.assertTrue((ScreenCapture.qImageToArray(qimage) == frame).all())
+    self.assertTrue((ScreenCapture.vtkImageDataToArray(ScreenCapture.qImageToVtkImageData(qimage)) == frame).all())
+    # pixels are copied using VTK if the image buffer is not accessible
+    def constBits():
+      raise TypeError("buffer is not accessible")
+    qimage.constBits = constBits
+    self.assertIsNone(ScreenCapture.getQImagePixels(qimage))
+    self.assertTrue((ScreenCapture.qImageToArray(qimage) == frame).all())
+
+  def test_takeScreenshots(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    application.layoutManager().addThreeDView(40, 30)
+    sliceView = self.getSliceView(sliceNode)
+    threeDView = application.layoutManager().threeDWidget(0).threeDView()
+    screenShotDialog = SlicerStandIn.StandInQMRMLScreenShotDialog
+    self.logic.takeScreenshots([("a", "slice", screenShotDialog.Red), ("b", "3D", screenShotDialog.ThreeD),
+      ("c", "slice again", screenShotDialog.Red), ("d", "layout", screenShotDialog.FullLayout), ("e", "window", -1)])
+    # each view is rendered once and snapshots are created in one batch
+    self.assertEqual((sliceView.numberOfRenders, threeDView.numberOfRenders), (1, 1))
+    batchProcessState = SlicerStandIn.StandInMRMLScene.BatchProcessState
+    self.assertEqual(application.events[0], ("start state", batchProcessState))
+    self.assertEqual(application.events[-1], ("end state", batchProcessState))
+    snapshots = application.events[1:-1]
+    self.assertEqual([snapshot[1:4] for snapshot in snapshots], [("a", "slice", screenShotDialog.Red),
+      ("b", "3D", screenShotDialog.ThreeD), ("c", "slice again", screenShotDialog.Red),
+      ("d", "layout", screenShotDialog.FullLayout), ("e", "window", screenShotDialog.FullLayout)])
+    self.assertIs(snapshots[0][4], snapshots[2][4])
+    self.assertTrue((ScreenCapture.vtkImageDataToArray(snapshots[0][4]) == sliceView.frame).all())
+    self.assertTrue((ScreenCapture.vtkImageDataToArray(snapshots[1][4]) == threeDView.frame).all())
+    self.assertTrue((ScreenCapture.vtkImageDataToArray(snapshots[3][4]) == application.layoutManager().viewport().frame).all())
+
+  def test_renderWindowBackendMagnification(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 50, 40)
+    self.logic.captureBackend = 'renderWindow'
+    self.logic.captureMagnification = 3
+    frameWriter = ScreenCapture.ArrayFrameWriter(3)
+    self.logic.captureSliceSweep(sliceNode, 0, 10, 3, self.outputDir, "image_%05d.png", frameWriter)
+    self.assertEqual(frameWriter.frames.shape, (3, 120, 150, 3))
+
+  def getPeakMemoryUsage(self, sliceNode, numberOfImages):
+    framePipeline = self.logic.createFramePipeline()
+    framePipeline.addFrameWriter(DiscardFrameWriter(), 2)
+    tracemalloc.start()
+    try:
+      self.logic.captureSliceSweep(sliceNode, -50, 50, numberOfImages, self.outputDir, "image_%05d.png", framePipeline)
+      return tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+  def test_frameBuffersLimitMemoryUsage(self):
+    if tracemalloc is None:
+      self.skipTest("tracemalloc is not available")
+    width, height = 512, 512
+    frameSize = width * height * 3
+    sliceNode = application.layoutManager().addSliceView("Red", width, height)
+    self.logic.numberOfFrameBuffers = 4
+    shortCapturePeakMemory = self.getPeakMemoryUsage(sliceNode, 10)
+    longCapturePeakMemory = self.getPeakMemoryUsage(sliceNode, 80)
+    # memory usage must not grow with the number of frames
+    self.assertLess(longCapturePeakMemory, shortCapturePeakMemory + frameSize)
+
+  def test_captureStatistics(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 64, 64)
+    self.logic.captureSliceSweep(sliceNode, -20, 20, 6, self.outputDir, "image_%05d.png")
+    summary = self.logic.captureStatistics.getSummary()
+    self.assertEqual(summary['numberOfFrames'], 6)
+    for stageName in ['update', 'render', 'grab', 'output', 'encode', 'write']:
+      self.assertEqual(summary['stages'][stageName]['count'], 6)
+    outputSize = sum([os.path.getsize(os.path.join(self.outputDir, filename)) for filename in os.listdir(self.outputDir)])
+    self.assertEqual(summary['bytesWritten'], outputSize)
+    self.logic.captureStatistics.writeCsv(os.path.join(self.outputDir, "statistics.csv"))
+    self.logic.captureStatistics.writeJson(os.path.join(self.outputDir, "statistics.json"))
+
+  def test_progressReportingIsThrottled(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 32)
+    progressReports = []
+    self.logic.progressCallback = lambda numberOfCapturedFrames, numberOfFrames: progressReports.append(
+      (numberOfCapturedFrames, numberOfFrames))
+    self.logic.maximumProgressUpdateRate = 0.001
+    self.logic.captureSliceSweep(sliceNode, -20, 20, 50, self.outputDir, "image_%05d.png")
+    # first and last frames are always reported
+    self.assertEqual(progressReports, [(1, 50), (50, 50)])
+
+  def test_captureJobRunsFromEventLoop(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 32)
+    finishedRunners = []
+    job = self.logic.createSliceSweepJob(sliceNode, -20, 20, 10, self.outputDir, "image_%05d.png")
+    runner = self.logic.startCaptureJobs([job], finishedRunners.append)
+    # one frame is captured in each event loop iteration
+    for iteration in range(3):
+      application.processEvents()
+    self.assertEqual(job.nextFrameIndex, 3)
+    runner.pause()
+    application.processEvents()
+    self.assertEqual(job.nextFrameIndex, 3)
+    runner.resume()
+    while runner.running:
+      application.processEvents()
+    self.assertEqual(finishedRunners, [runner])
+    self.assertFalse(runner.cancelled)
+    self.assertIsNone(runner.error)
+    self.assertEqual(len(os.listdir(self.outputDir)), 10)
+
+  def test_cancelCaptureRestoresView(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 32)
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(7)
+    viewNode = application.layoutManager().addThreeDView(32, 32)
+    threeDView = application.layoutManager().threeDWidget(0).threeDView()
+    jobs = [
+      self.logic.createSliceSweepJob(sliceNode, -20, 20, 10, self.outputDir, "slice_%05d.png"),
+      self.logic.create3dViewRotationJob(viewNode, 90, 90, 10, self.outputDir, "rotation_%05d.png"),
+      ]
+    runner = self.logic.startCaptureJobs(jobs)
+    for iteration in range(15):
+      application.processEvents()
+    self.assertNotAlmostEqual(threeDView.yawAngle, 0.0)
+    runner.cancel()
+    self.assertTrue(runner.cancelled)
+    self.assertFalse(runner.running)
+    self.assertEqual(self.getSliceView(sliceNode).sliceLogic.GetSliceOffset(), 7)
+    self.assertAlmostEqual(threeDView.yawAngle, 0.0)
+    self.assertEqual(threeDView.pitchRollYawIncrement, 5.0)
+
+  def test_cancelFromProgressCallback(self):
+    # progress display processes application events, therefore cancel may be called while a step is running
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 32)
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(7)
+    viewNode = application.layoutManager().addThreeDView(32, 32)
+    sliceDir = os.path.join(self.outputDir, "slice")
+    rotationDir = os.path.join(self.outputDir, "rotation")
+    jobs = [
+      self.logic.createSliceSweepJob(sliceNode, -20, 20, 5, sliceDir, "slice_%05d.png"),
+      self.logic.create3dViewRotationJob(viewNode, 90, 90, 5, rotationDir, "rotation_%05d.png"),
+      ]
+    runners = []
+    def cancelOnLastFrame(numberOfCapturedFrames, numberOfFrames):
+      if numberOfCapturedFrames == numberOfFrames:
+        runners[0].cancel()
+    self.logic.progressCallback = cancelOnLastFrame
+    finishedRunners = []
+    runners.append(self.logic.startCaptureJobs(jobs, finishedRunners.append))
+    for iteration in range(20):
+      application.processEvents()
+    self.assertEqual(finishedRunners, runners)
+    self.assertTrue(runners[0].cancelled)
+    self.assertEqual(self.getSliceView(sliceNode).sliceLogic.GetSliceOffset(), 7)
+    self.assertFalse(os.path.exists(rotationDir) and os.listdir(rotationDir))
+
+  def test_failedBeginRestoresView(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 32)
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(7)
+    self.logic.createFrameCache(os.path.join(self.outputDir, "FrameCache"))
+    def getSceneStateKey():
+      raise ValueError("Scene is not available")
+    self.logic.getSceneStateKey = getSceneStateKey
+    self.assertRaises(ValueError, self.logic.captureSliceSweep, sliceNode, -20, 20, 5, self.outputDir, "image_%05d.png")
+    self.assertEqual(self.getSliceView(sliceNode).sliceLogic.GetSliceOffset(), 7)
+
+  def test_abortFrameWriters(self):
+    # writers of a job that could not be created stop their threads and remove partial output
+    self.logic.numberOfWriterThreads = 2
+    frameWriter = self.logic.createAnimationWriter(10, self.outputDir, "animation.gif")
+    frameWriter.writeFrame(0, numpy.zeros((8, 8, 3), numpy.uint8))
+    self.logic.abortFrameWriters([frameWriter, None, frameWriter])
+    self.assertEqual(frameWriter.workers, [])
+    self.assertEqual(os.listdir(self.outputDir), [])
+
+  def test_composeMosaic(self):
+    frames = [numpy.full((4, 6, 3), index + 1, numpy.uint8) for index in range(5)]
+    mosaic = ScreenCapture.composeMosaic(frames)
+    self.assertEqual(mosaic.shape, (8, 18, 3))
+    self.assertTrue((mosaic[4:8, 6:12] == 5).all())
+    self.assertTrue((mosaic[4:8, 12:18] == 0).all())
+    # buffer is reused if size matches
+    self.assertIs(ScreenCapture.composeMosaic(frames, mosaic=mosaic), mosaic)
+    # frames of different size
+    mosaic = ScreenCapture.composeMosaic([frames[0], numpy.full((2, 8, 3), 9, numpy.uint8)], numberOfColumns=1)
+    self.assertEqual(mosaic.shape, (8, 8, 3))
+    self.assertTrue((mosaic[4:6, :] == 9).all())
+    self.assertTrue((mosaic[0:4, 6:8] == 0).all())
+
+  def test_multiViewCapture(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    self.getSliceView(sliceNode).sliceLogic.SetSliceOffset(3)
+    viewNode = application.layoutManager().addThreeDView(32, 24)
+    threeDView = application.layoutManager().threeDWidget(0).threeDView()
+    viewJobs = [
+      self.logic.createSliceSweepJob(sliceNode, -20, 20, 4, self.outputDir, "Red_%05d.png"),
+      self.logic.create3dViewRotationJob(viewNode, -30, 30, 4, self.outputDir, None),
+      ]
+    self.assertIsNone(viewJobs[1].frameWriter)
+    # a job without output can only be run as part of a multi-view capture
+    self.assertRaises(ValueError, viewJobs[1].run)
+    self.assertAlmostEqual(threeDView.yawAngle, 0.0)
+    self.logic.captureMultiView(viewJobs, self.outputDir, "mosaic_%05d.png")
+    self.assertEqual(sorted(os.listdir(self.outputDir)),
+      sorted(["Red_%05d.png" % index for index in range(4)] + ["mosaic_%05d.png" % index for index in range(4)]))
+    mosaic = readPngFile(os.path.join(self.outputDir, "mosaic_00003.png"))
+    self.assertEqual(mosaic.shape, (24, 64, 3))
+    self.assertTrue((mosaic[:, :32] == readPngFile(os.path.join(self.outputDir, "Red_00003.png"))).all())
+    # view state is restored
+    self.assertEqual(self.getSliceView(sliceNode).sliceLogic.GetSliceOffset(), 3)
+    self.assertAlmostEqual(threeDView.yawAngle, 0.0)
+
+    # with automatic cropping views are rendered once and images of views are not cropped
+    self.logic.cropRegion = 'auto'
+    numberOfRenders = self.getSliceView(sliceNode).numberOfRenders
+    viewJobs = [
+      self.logic.createSliceSweepJob(sliceNode, -20, 20, 4, self.outputDir, "autoRed_%05d.png"),
+      self.logic.create3dViewRotationJob(viewNode, -30, 30, 4, self.outputDir, None),
+      ]
+    self.logic.captureMultiView(viewJobs, self.outputDir, "autoMosaic_%05d.png")
+    self.assertEqual(self.getSliceView(sliceNode).numberOfRenders - numberOfRenders, 4)
+    for index in range(4):
+      self.assertTrue((readPngFile(os.path.join(self.outputDir, "autoRed_%05d.png" % index)) ==
+        readPngFile(os.path.join(self.outputDir, "Red_%05d.png" % index))).all())
+
+  def test_skipDuplicateFrames(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    filePathPattern = os.path.join(self.outputDir, "image_%05d.png")
+    frameWriter = self.logic.createImageSequenceWriter(filePathPattern, skipDuplicateFrames=True)
+    frameListFilePath = os.path.join(self.outputDir, "frames.ffconcat")
+    frameWriter.setFrameListOutput(frameListFilePath, filePathPattern, 10)
+    # slice offset changes only in every third frame
+    job = ScreenCapture.SliceSweepCaptureJob(self.logic, self.getSliceView(sliceNode).sliceLogic,
+      self.getSliceView(sliceNode), 0, 8, 9, frameWriter)
+    job.setFrameState = lambda frameIndex: job.sliceLogic.SetSliceOffset(frameIndex // 3)
+    job.run()
+    self.assertEqual(frameWriter.frameDurations, [3, 3, 3])
+    self.assertEqual(sorted(os.listdir(self.outputDir)),
+      ["frames.ffconcat", "image_00000.png", "image_00001.png", "image_00002.png"])
+    self.assertEqual(self.logic.captureStatistics.getSummary()['numberOfSkippedFrames'], 6)
+    with open(frameListFilePath) as frameListFile:
+      frameList = frameListFile.read().splitlines()
+    self.assertEqual(frameList, ["ffconcat version 1.0",
+      "file 'image_00000.png'", "duration 0.3",
+      "file 'image_00001.png'", "duration 0.3",
+      "file 'image_00002.png'", "duration 0.3",
+      "file 'image_00002.png'"])
+    if findFfmpeg():
+      self.logic.setFfmpegPath(findFfmpeg())
+      self.logic.createVideo(5, 10, self.outputDir, "image_%05d.png", "video.mp4", 9, "frames.ffconcat")
+      self.assertEqual(getNumberOfVideoFrames(os.path.join(self.outputDir, "video.mp4")), 9)
+
+  def test_captureToArray(self):
+    sliceNode = application.layoutManager().addSliceView("Red", 32, 24)
+    frames = self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 5)
+    self.assertEqual(frames.shape, (5, 24, 32, 3))
+    sliceView = self.getSliceView(sliceNode)
+    sliceView.sliceLogic.SetSliceOffset(20)
+    self.assertTrue((frames[4] == sliceView.renderFrame(32, 24)).all())
+    # existing array is reused
+    self.assertIs(self.logic.captureSliceSweepToArray(sliceNode, -20, 20, 5, frames=frames), frames)
+    # memory-mapped file
+    viewNode = application.layoutManager().addThreeDView(32, 24)
+    filename = os.path.join(self.outputDir, "rotation.npy")
+    frames = self.logic.capture3dViewRotationToArray(viewNode, -30, 30, 4, filename=filename)
+    self.assertTrue(isinstance(frames, numpy.memmap))
+    self.assertTrue((numpy.load(filename) == frames).all())
+    del frames
+    self.assertEqual(os.listdir(self.outputDir), ["rotation.npy"])
+
+  def captureAnimation(self, fileName):
+    """Capture 6 frames, each slice offset is captured twice, except the last one."""
+    sliceNode = application.layoutManager().addSliceView("Red", 40, 30)
+    sliceView = self.getSliceView(sliceNode)
+    frameWriter = self.logic.createAnimationWriter(10, self.outputDir, fileName)
+    job = ScreenCapture.SliceSweepCaptureJob(self.logic, sliceView.sliceLogic, sliceView, 0, 5, 6, frameWriter)
+    job.setFrameState = lambda frameIndex: sliceView.sliceLogic.SetSliceOffset(min(frameIndex // 2, 2) * 5)
+    job.run()
+    expectedFrames = []
+    for sliceOffset in [0, 5, 10]:
+      sliceView.sliceLogic.SetSliceOffset(sliceOffset)
+      expectedFrames.append(sliceView.renderFrame(40, 30))
+    return expectedFrames
+
+  def test_animatedPng(self):
+    expectedFrames = self.captureAnimation("animation.png")
+    chunks = readPngChunks(os.path.join(self.outputDir, "animation.png"))
+    self.assertEqual([chunkType for chunkType, data in chunks],
+      [b"IHDR", b"acTL", b"fcTL", b"IDAT", b"fcTL", b"fdAT", b"fcTL", b"fdAT", b"IEND"])
+    self.assertEqual(struct.unpack(">II", chunks[1][1]), (3, 0))
+    # display time of each image is 2 frames at 10 fps
+    for chunkType, data in chunks:
+      if chunkType == b"fcTL":
+        self.assertEqual(struct.unpack(">HH", data[20:24]), (200, 1000))
+    # first image is the default image
+    self.assertTrue((readPngFile(os.path.join(self.outputDir, "animation.png")) == expectedFrames[0]).all())
+    # only the changed region is stored
+    width, height, left, top = struct.unpack(">IIII", chunks[4][1][4:20])
+    self.assertLess(width * height, 40 * 30)
+    changedRegion = ScreenCapture.getChangedRegion(expectedFrames[1], expectedFrames[0])
+    self.assertEqual((top, top+height, left, left+width), changedRegion)
+    self.assertTrue((numpy.frombuffer(zlib.decompress(chunks[5][1][4:]), numpy.uint8).reshape(height, -1)[:, 0] == 2).all())
+
+  def test_animatedGif(self):
+    expectedFrames = self.captureAnimation("animation.gif")
+    frames = readGifFile(os.path.join(self.outputDir, "animation.gif"))
+    self.assertEqual([displayTime for frame, displayTime in frames], [20, 20, 20])
+    for (frame, displayTime), expectedFrame in zip(frames, expectedFrames):
+      self.assertEqual(frame.shape, expectedFrame.shape)
+      # colors are quantized
+      self.assertLessEqual(numpy.abs(frame.astype(int) - expectedFrame).max(), 40)
+
+  def test_gifEncoder(self):
+    # large, random image, to test code table resets
+    numpy.random.seed(0)
+    palette = (numpy.random.randint(0, 32, (255, 3)) * 8 + 4).astype(numpy.uint8)
+    frames = [palette[numpy.random.randint(0, 255, (100, 120))] for frameIndex in range(2)]
+    filename = os.path.join(self.outputDir, "random.gif")
+    frameWriter = ScreenCapture.GifFrameWriter(filename, 25, palette=palette)
+    for frameIndex, frame in enumerate(frames):
+      frameWriter.writeFrame(frameIndex, frame)
+    frameWriter.close()
+    decodedFrames = readGifFile(filename)
+    self.assertEqual([displayTime for frame, displayTime in decodedFrames], [4, 4])
+    for (decodedFrame, displayTime), frame in zip(decodedFrames, frames):
+      self.assertTrue((decodedFrame == frame).all())
+
+  def test_gifSizeWarning(self):
+    # large images are steered towards faster formats
+    sliceNode = application.layoutManager().addSliceView("Red", 320, 240)
+    self.assertIsNone(self.logic.getAnimationSizeWarning("animation.gif", sliceNode))
+    self.logic.captureBackend = 'renderWindow'
+    self.logic.captureMagnification = 3
+    self.assertIn("960x720", self.logic.getAnimationSizeWarning("animation.gif", sliceNode))
+    self.assertIsNone(self.logic.getAnimationSizeWarning("animation.png", sliceNode))
+    frameWriter = ScreenCapture.GifFrameWriter(os.path.join(self.outputDir, "large.gif"), 25)
+    with self.assertLogs(level='WARNING') as logs:
+      frameWriter.writeFrame(0, numpy.zeros((720, 960, 3), numpy.uint8))
+    frameWriter.close()
+    self.assertIn("960x720", logs.output[0])
+
+  def test_gifPaletteUpdate(self):
+    # colors that appear after the first frame are added to the palette
+    frames = [numpy.zeros((20, 30, 3), numpy.uint8) for frameIndex in range(3)]
+    frames[0][:, :, 0] = numpy.arange(30) * 8
+    frames[1][:] = frames[0]
+    frames[1][5:15, 10:20] = [40, 240, 60]
+    frames[2][:] = frames[1]
+    frames[2][0:4, 0:6] = [20, 30, 250]
+    filename = os.path.join(self.outputDir, "colors.gif")
+    frameWriter = ScreenCapture.GifFrameWriter(filename, 25)
+    for frameIndex, frame in enumerate(frames):
+      frameWriter.writeFrame(frameIndex, frame)
+    frameWriter.close()
+    decodedFrames = readGifFile(filename)
+    for (decodedFrame, displayTime), frame in zip(decodedFrames, frames):
+      self.assertLessEqual(numpy.abs(decodedFrame.astype(int) - frame).max(), 8)
+
+  def test_segmentedVideoEncoding(self):
+    if not findFfmpeg():
+      self.skipTest("ffmpeg is not available")
+    self.logic.setFfmpegPath(findFfmpeg())
+    # nothing is written to the output directory before the job begins, and temporary files are removed on cancel
+    videoJob = self.logic.createVideoJob(5, 10, self.outputDir, "image_%05d.png", "video.mp4", 10, numberOfSegments=3)
+    self.assertEqual(os.listdir(self.outputDir), [])
+    videoJob.begin()
+    videoJob.cancel()
+    self.assertEqual(os.listdir(self.outputDir), [])
+    sliceNode = application.layoutManager().addSliceView("Red", 64, 48)
+    self.logic.captureSliceSweep(sliceNode, -20, 20, 10, self.outputDir, "image_%05d.png")
+    self.logic.createVideo(5, 10, self.outputDir, "image_%05d.png", "video.mp4", 10, numberOfSegments=3)
+    self.assertEqual(sorted(os.listdir(self.outputDir)), ["image_%05d.png" % index for index in range(10)] + ["video.mp4"])
+    self.assertEqual(self.logic.captureStatistics.getSummary()['stages']['video segment']['count'], 3)
+    # all frames are in the concatenated video
+    self.assertEqual(getNumberOfVideoFrames(os.path.join(self.outputDir, "video.mp4")), 10)
+
+class ScreenCaptureBenchmark(CaptureTestBase):
+  """Measure frames per second, peak memory usage, and output size of captures.
+  """
+
+  def getBenchmarkCases(self):
+    sinkNames = ['png', 'png-threaded', 'fast-lossless', 'memory', 'gif']
+    if findFfmpeg():
+      sinkNames.append('video')
+    frameSizes = [(320, 240), (1280, 720)]
+    numbersOfFrames = [20]
+    if os.environ.get('SCREENCAPTURE_BENCHMARK_FULL'):
+      frameSizes.append((3840, 2160))
+      numbersOfFrames.append(200)
+    cases = []
+    for sinkName in sinkNames:
+      for width, height in frameSizes:
+        if sinkName == 'gif' and width * height > 320 * 240 and not os.environ.get('SCREENCAPTURE_BENCHMARK_FULL'):
+          # GIF encoding is slow
+          continue
+        for numberOfFrames in numbersOfFrames:
+          cases.append({'sink': sinkName, 'width': width, 'height': height, 'numberOfFrames': numberOfFrames})
+    return cases
+
+  def createFrameWriter(self, sinkName, numberOfFrames, outputDir):
+    if sinkName == 'png':
+      self.logic.numberOfWriterThreads = 0
+      return None
+    elif sinkName == 'png-threaded':
+      self.logic.numberOfWriterThreads = 4
+      return None
+    elif sinkName == 'fast-lossless':
+      self.logic.numberOfWriterThreads = 4
+      self.logic.imageFormat = 'fast-lossless'
+      return None
+    elif sinkName == 'memory':
+      return ScreenCapture.ArrayFrameWriter(numberOfFrames)
+    elif sinkName == 'gif':
+      self.logic.numberOfWriterThreads = 4
+      return self.logic.createAnimationWriter(25, outputDir, "capture.gif")
+    elif sinkName == 'video':
+      self.logic.setFfmpegPath(findFfmpeg())
+      return self.logic.createVideoStreamWriter(4, 25, outputDir, "capture.mp4")
+    raise ValueError("Unknown sink: "+sinkName)
+
+  def runBenchmarkCase(self, case):
+    application.reset()
+    sliceNode = application.layoutManager().addSliceView("Red", case['width'], case['height'])
+    outputDir = os.path.join(self.outputDir, "{sink}-{width}x{height}-{numberOfFrames}".format(**case))
+    frameWriter = self.createFrameWriter(case['sink'], case['numberOfFrames'], outputDir)
+    if tracemalloc:
+      tracemalloc.start()
+    try:
+      self.logic.captureSliceSweep(sliceNode, -50, 50, case['numberOfFrames'], outputDir, "image_%05d.png", frameWriter)
+      peakMemory = tracemalloc.get_traced_memory()[1] if tracemalloc else None
+    finally:
+      if tracemalloc:
+        tracemalloc.stop()
+    outputSize = sum([os.path.getsize(os.path.join(outputDir, filename)) for filename in os.listdir(outputDir)])
+    summary = self.logic.captureStatistics.getSummary()
+    result = dict(case)
+    result.update({
+      'framesPerSecond': summary['framesPerSecond'],
+      'peakMemoryMB': peakMemory/1.0e6 if peakMemory is not None else None,
+      'outputMB': outputSize/1.0e6,
+      'stageMeans': dict((stageName, stage['mean']) for stageName, stage in summary['stages'].items()),
+      })
+    shutil.rmtree(outputDir)
+    return result
+
+  def checkBaseline(self, results, baselineFilename):
+    tolerance = float(os.environ.get('SCREENCAPTURE_BENCHMARK_TOLERANCE', '0.3'))
+    with open(baselineFilename) as baselineFile:
+      baselineResults = json.load(baselineFile)
+    caseKeys = ['sink', 'width', 'height', 'numberOfFrames']
+    baselineByCase = dict((tuple(result[key] for key in caseKeys), result) for result in baselineResults)
+    regressions = []
+    for result in results:
+      baseline = baselineByCase.get(tuple(result[key] for key in caseKeys))
+      if not baseline:
+        continue
+      if result['framesPerSecond'] < baseline['framesPerSecond'] * (1 - tolerance):
+        regressions.append("{0}: {1:.1f} fps, baseline {2:.1f} fps".format(
+          tuple(result[key] for key in caseKeys), result['framesPerSecond'], baseline['framesPerSecond']))
+      if (result['peakMemoryMB'] and baseline['peakMemoryMB']
+        and result['peakMemoryMB'] > baseline['peakMemoryMB'] * (1 + tolerance)):
+        regressions.append("{0}: {1:.1f} MB peak memory, baseline {2:.1f} MB".format(
+          tuple(result[key] for key in caseKeys), result['peakMemoryMB'], baseline['peakMemoryMB']))
+    self.assertEqual(regressions, [], "Performance regressions:\n" + "\n".join(regressions))
+
+  def test_sequencePrefetchBenchmark(self):
+    # selecting an item of a disk-based sequence is slow, prefetching loads the next item while the current one
+    # is rendered and written
+    sliceNode = application.layoutManager().addSliceView("Red", 640, 480)
+    self.logic.numberOfWriterThreads = 0
+    updateTimes = {}
+    for prefetch in [False, True]:
+      browserNode = application.addSequenceBrowser(12)
+      browserNode.itemLoadTime = 0.02
+      prefetcher = lambda browserNode, itemIndex: lambda: browserNode.loadItem(itemIndex)
+      outputDir = os.path.join(self.outputDir, "prefetch" if prefetch else "noprefetch")
+      self.logic.captureSequence(browserNode, sliceNode, 0, 11, 12, outputDir, "image_%05d.png",
+        prefetcher=prefetcher if prefetch else None)
+      updateTimes[prefetch] = self.logic.captureStatistics.getSummary()['stages']['update']['mean']
+      browserNode.itemLoadTime = 0.0
+    print("")
+    print("Sequence item switch time: {0:.1f} ms without prefetch, {1:.1f} ms with prefetch".format(
+      updateTimes[False]*1000, updateTimes[True]*1000))
+    self.assertLess(updateTimes[True], updateTimes[False])
+
+  def test_benchmark(self):
+    results = [self.runBenchmarkCase(case) for case in self.getBenchmarkCases()]
+
+    print("")
+    print("{0:>14} {1:>11} {2:>7} {3:>8} {4:>10} {5:>10}".format("sink", "size", "frames", "fps", "memory MB", "output MB"))
+    for result in results:
+      print("{0:>14} {1:>11} {2:>7} {3:>8.1f} {4:>10} {5:>10.2f}".format(result['sink'],
+        "{0}x{1}".format(result['width'], result['height']), result['numberOfFrames'], result['framesPerSecond'],
+        "{0:.1f}".format(result['peakMemoryMB']) if result['peakMemoryMB'] is not None else "-", result['outputMB']))
+
+    outputFilename = os.environ.get('SCREENCAPTURE_BENCHMARK_OUTPUT')
+    if outputFilename:
+      with open(outputFilename, 'w') as outputFile:
+        json.dump(results, outputFile, indent=2, sort_keys=True)
+    baselineFilename = os.environ.get('SCREENCAPTURE_BENCHMARK_BASELINE')
+    if baselineFilename:
+      self.checkBaseline(results, baselineFilename)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,787 @@
+"""Lightweight stand-in for the slicer, qt, ctk, and vtk modules used by ScreenCaptureLogic.
+
+It allows running the capture pipeline in plain Python (only numpy is required), without GPU, display, or network.
+Views render synthetic frames that change with the slice offset or camera rotation, so that captured
+frames differ from each other similarly to real captures.
+
+Usage:
+
+  import SlicerStandIn
+  application = SlicerStandIn.install()
+  import ScreenCapture
+  sliceNode = application.layoutManager().addSliceView("Red", 512, 512)
+"""
+
+import sys
+import types
+import unittest
+import numpy
+import time
+
+#
+# vtk
+#
+
+VTK_UNSIGNED_CHAR = 3
+
+class StandInDataArray(object):
+  def __init__(self, values):
+    self.values = values
+
+class StandInPointData(object):
+  def __init__(self):
+    self.scalars = None
+
+  def GetScalars(self):
+    return self.scalars
+
+  def SetScalars(self, scalars):
+    self.scalars = scalars
+
+class StandInImageData(object):
+  """Image data with the same memory layout as vtkImageData: bottom row first."""
+
+  def __init__(self):
+    self.dimensions = (0, 0, 0)
+    self.pointData = StandInPointData()
+
+  def SetDimensions(self, *dimensions):
+    if len(dimensions) == 1:
+      dimensions = dimensions[0]
+    self.dimensions = tuple(dimensions)
+
+  def GetDimensions(self):
+    return self.dimensions
+
+  def GetPointData(self):
+    return self.pointData
+
+  def GetNumberOfScalarComponents(self):
+    scalars = self.pointData.GetScalars()
+    return scalars.values.shape[1] if scalars is not None else 1
+
+  def ShallowCopy(self, other):
+    self.dimensions = other.dimensions
+    self.pointData.SetScalars(other.GetPointData().GetScalars())
+
+  def setFrame(self, frame):
+    """Set content from an array (rows, columns, components) that has the top row first."""
+    rows, columns, numberOfComponents = frame.shape
+    self.SetDimensions(columns, rows, 1)
+    self.pointData.SetScalars(StandInDataArray(numpy.ascontiguousarray(frame[::-1]).reshape(-1, numberOfComponents)))
+
+class StandInWindowToImageFilter(object):
+
+  def __init__(self):
+    self.renderWindow = None
+    self.scale = 1
+    self.output = StandInImageData()
+
+  def SetInput(self, renderWindow):
+    self.renderWindow = renderWindow
+
+  def SetScale(self, scale):
+    self.scale = scale
+
+  def SetInputBufferTypeToRGB(self):
+    pass
+
+  def ShouldRerenderOff(self):
+    pass
+
+  def Update(self):
+    view = self.renderWindow.view
+    if self.scale != 1:
+      frame = view.renderFrame(view.width * self.scale, view.height * self.scale)
+    else:
+      frame = view.frame
+    self.output.setFrame(frame)
+
+  def GetOutput(self):
+    return self.output
+
+def vtk_to_numpy(dataArray):
+  return dataArray.values
+
+def numpy_to_vtk(values, deep=False, array_type=None):
+  return StandInDataArray(numpy.array(values) if deep else values)
+
+#
+# Scene and views
+#
+
+class StandInViewNode(object):
+  def __init__(self, className, layoutName):
+    self.className = className
+    self.layoutName = layoutName
+
+  def IsA(self, className):
+    return className == self.className
+
+  def GetLayoutName(self):
+    return self.layoutName
+
+  def IsMappedInLayout(self):
+    return True
+
+class StandInMatrix4x4(object):
+  def __init__(self, elements):
+    self.elements = numpy.array(elements, float)
+
+  def GetElement(self, row, column):
+    return self.elements[row, column]
+
+class StandInSliceNode(StandInViewNode):
+  def __init__(self, layoutName):
+    StandInViewNode.__init__(self, "vtkMRMLSliceNode", layoutName)
+    self.sliceToRas = numpy.eye(4)
+    self.fieldOfView = [200.0, 150.0, 1.0]
+
+  def GetSliceToRAS(self):
+    return StandInMatrix4x4(self.sliceToRas)
+
+  def GetFieldOfView(self):
+    return self.fieldOfView
+
+  def GetXYZOrigin(self):
+    return [0.0, 0.0, 0.0]
+
+class StandInDisplayNode(object):
+  """Display node of the scene, it changes the rendered content when it is modified.
+  Also used as displayable node (with className vtkMRMLDisplayableNode)."""
+  modifiedTime = 0
+
+  def __init__(self, nodeID, className="vtkMRMLDisplayNode", displayableNode=None, hideFromEditors=False):
+    self.nodeID = nodeID
+    self.className = className
+    self.displayableNode = displayableNode
+    self.hideFromEditors = hideFromEditors
+    self.Modified()
+
+  def IsA(self, className):
+    return className == self.className
+
+  def GetDisplayableNode(self):
+    return self.displayableNode
+
+  def GetHideFromEditors(self):
+    return self.hideFromEditors
+
+  def GetID(self):
+    return self.nodeID
+
+  def GetMTime(self):
+    return self.mtime
+
+  def Modified(self):
+    StandInDisplayNode.modifiedTime += 1
+    self.mtime = StandInDisplayNode.modifiedTime
+
+class StandInCamera(object):
+  def __init__(self):
+    self.position = numpy.array([0.0, -500.0, 0.0])
+    self.focalPoint = numpy.array([0.0, 0.0, 0.0])
+    self.viewUp = numpy.array([0.0, 0.0, 1.0])
+    self.viewAngle = 30.0
+    self.parallelScale = 1.0
+    self.clippingRange = (400.0, 600.0)
+    self.numberOfModifications = 0
+
+  def GetPosition(self):
+    return tuple(self.position)
+
+  def SetPosition(self, *position):
+    self.position = numpy.array(position, float).reshape(3)
+    self.numberOfModifications += 1
+
+  def GetFocalPoint(self):
+    return tuple(self.focalPoint)
+
+  def SetFocalPoint(self, *focalPoint):
+    self.focalPoint = numpy.array(focalPoint, float).reshape(3)
+    self.numberOfModifications += 1
+
+  def GetViewUp(self):
+    return tuple(self.viewUp)
+
+  def SetViewUp(self, *viewUp):
+    self.viewUp = numpy.array(viewUp, float).reshape(3)
+    self.viewUp /= numpy.linalg.norm(self.viewUp)
+    self.numberOfModifications += 1
+
+  def OrthogonalizeViewUp(self):
+    direction = self.focalPoint - self.position
+    direction /= numpy.linalg.norm(direction)
+    viewUp = self.viewUp - numpy.dot(self.viewUp, direction) * direction
+    self.viewUp = viewUp / numpy.linalg.norm(viewUp)
+
+  def GetViewAngle(self):
+    return self.viewAngle
+
+  def SetViewAngle(self, viewAngle):
+    self.viewAngle = viewAngle
+
+  def GetParallelScale(self):
+    return self.parallelScale
+
+  def SetParallelScale(self, parallelScale):
+    self.parallelScale = parallelScale
+
+  def GetClippingRange(self):
+    return self.clippingRange
+
+  def SetClippingRange(self, *clippingRange):
+    self.clippingRange = tuple(numpy.array(clippingRange, float).reshape(2))
+
+  def Azimuth(self, angle):
+    """Rotate the position around the view up direction, centered at the focal point."""
+    axis = self.viewUp
+    angle = numpy.radians(angle)
+    offset = self.position - self.focalPoint
+    # Rodrigues' rotation formula
+    offset = (offset * numpy.cos(angle) + numpy.cross(axis, offset) * numpy.sin(angle)
+      + axis * numpy.dot(axis, offset) * (1 - numpy.cos(angle)))
+    self.position = self.focalPoint + offset
+    self.numberOfModifications += 1
+
+class StandInCollection(object):
+  def __init__(self):
+    self.items = []
+
+  def AddItem(self, item):
+    self.items.append(item)
+
+  def GetNumberOfItems(self):
+    return len(self.items)
+
+  def GetItemAsObject(self, index):
+    return self.items[index]
+
+class StandInVolumeNode(object):
+  def __init__(self, voxels):
+    self.imageData = StandInImageData()
+    self.imageData.setFrame(voxels)
+
+  def IsA(self, className):
+    return className in ["vtkMRMLVolumeNode", "vtkMRMLScalarVolumeNode"]
+
+  def GetImageData(self):
+    return self.imageData
+
+class StandInSequenceNode(object):
+  def __init__(self, dataNodes):
+    self.dataNodes = dataNodes
+
+  def GetNumberOfDataNodes(self):
+    return len(self.dataNodes)
+
+  def GetNthIndexValue(self, itemIndex):
+    return str(itemIndex)
+
+  def GetDataNodeAtValue(self, indexValue):
+    return self.dataNodes[int(indexValue)]
+
+class StandInSequenceBrowserNode(object):
+  """Sequence browser with a single sequence of volumes. Selected item changes the content of all views.
+  If itemLoadTime is set then selecting an item takes that much time (in seconds), as if its data was read from disk,
+  unless the item has been loaded before (see loadItem).
+  """
+  instances = []
+
+  def __init__(self, numberOfItems, name="SequenceBrowser"):
+    self.name = name
+    self.itemLoadTime = 0.0
+    self.loadedItems = set()
+    self.sequenceNode = StandInSequenceNode([StandInVolumeNode(numpy.full((4, 4, 1), itemIndex, numpy.uint8))
+      for itemIndex in range(numberOfItems)])
+    self.selectedItemNumber = 0
+    self.instances.append(self)
+
+  def GetNumberOfItems(self):
+    return self.sequenceNode.GetNumberOfDataNodes()
+
+  def GetSelectedItemNumber(self):
+    return self.selectedItemNumber
+
+  def SetSelectedItemNumber(self, itemNumber):
+    self.loadItem(itemNumber)
+    self.selectedItemNumber = itemNumber
+
+  def loadItem(self, itemNumber):
+    if self.itemLoadTime and itemNumber not in self.loadedItems:
+      time.sleep(self.itemLoadTime)
+      self.loadedItems.add(itemNumber)
+
+  def GetMasterSequenceNode(self):
+    return self.sequenceNode
+
+  def GetSynchronizedSequenceNodes(self, sequenceNodes, includeMasterNode=False):
+    if includeMasterNode:
+      sequenceNodes.AddItem(self.sequenceNode)
+
+class StandInRenderer(object):
+  def __init__(self):
+    self.camera = StandInCamera()
+
+  def GetActiveCamera(self):
+    return self.camera
+
+  def ResetCameraClippingRange(self):
+    distance = numpy.linalg.norm(self.camera.position - self.camera.focalPoint)
+    self.camera.clippingRange = (distance - 100.0, distance + 100.0)
+
+  def UpdateLightsGeometryToFollowCamera(self):
+    pass
+
+class StandInRendererCollection(object):
+  def __init__(self, renderer):
+    self.renderer = renderer
+
+  def GetFirstRenderer(self):
+    return self.renderer
+
+class StandInRenderWindow(object):
+  def __init__(self, view):
+    self.view = view
+    self.renderers = StandInRendererCollection(StandInRenderer())
+
+  def GetRenderers(self):
+    return self.renderers
+
+  def GetSize(self):
+    return (self.view.width, self.view.height)
+
+class StandInView(object):
+  """Base class of synthetic views. Rendered frame is available in self.frame (rows, columns, RGB), top row first.
+  """
+
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+    self.frame = None
+    self.numberOfRenders = 0
+    self.window = StandInRenderWindow(self)
+
+  def renderWindow(self):
+    return self.window
+
+  def forceRender(self):
+    self.frame = self.renderFrame(self.width, self.height)
+    self.numberOfRenders += 1
+
+  def getPhase(self):
+    """Returns a number that determines the rendered content."""
+    raise NotImplementedError()
+
+  def renderFrame(self, width, height):
+    """Draw a disk with a gradient on black background. Disk size and color depend on view state
+    and selected items of sequence browsers.
+    """
+    phase = self.getPhase() + sum([0.3 * browserNode.selectedItemNumber for browserNode in StandInSequenceBrowserNode.instances])
+    rows, columns = numpy.ogrid[0:height, 0:width]
+    centerRow = height * (0.5 + 0.1 * numpy.sin(phase))
+    centerColumn = width * (0.5 + 0.1 * numpy.cos(phase))
+    radius = min(width, height) * (0.2 + 0.1 * (1 + numpy.sin(phase * 0.37)))
+    insideDisk = (rows - centerRow) ** 2 + (columns - centerColumn) ** 2 < radius ** 2
+    frame = numpy.zeros((height, width, 3), numpy.uint8)
+    gradient = ((rows * 255 // max(height - 1, 1) + columns * 255 // max(width - 1, 1)) // 2).astype(numpy.uint8)
+    frame[:, :, 0] = numpy.where(insideDisk, gradient, 0)
+    frame[:, :, 1] = numpy.where(insideDisk, 255 - gradient, 0)
+    frame[:, :, 2] = numpy.where(insideDisk, int(phase * 40) % 256, 0)
+    return frame
+
+class StandInSliceLogic(object):
+  def __init__(self, sliceView, sliceOffsetRange, sliceSpacing):
+    self.sliceView = sliceView
+    self.sliceNode = None
+    self.sliceOffset = 0.0
+    self.sliceOffsetRange = sliceOffsetRange
+    self.sliceSpacing = sliceSpacing
+
+  def GetSliceNode(self):
+    return self.sliceNode
+
+  def GetSliceOffset(self):
+    return self.sliceOffset
+
+  def SetSliceOffset(self, offset):
+    self.sliceOffset = offset
+
+  def SnapSliceOffsetToIJK(self):
+    # slice offset range covers whole voxels, snap to the nearest voxel center
+    firstVoxelCenter = self.sliceOffsetRange[0] + self.sliceSpacing * 0.5
+    self.sliceOffset = firstVoxelCenter + round((self.sliceOffset - firstVoxelCenter) / self.sliceSpacing) * self.sliceSpacing
+
+  def GetLowestVolumeSliceBounds(self, bounds):
+    bounds[0:6] = [0, 0, 0, 0, self.sliceOffsetRange[0], self.sliceOffsetRange[1]]
+
+  def GetLowestVolumeSliceSpacing(self):
+    return [1.0, 1.0, self.sliceSpacing]
+
+  def GetSliceCompositeNode(self):
+    return None
+
+class StandInSliceView(StandInView):
+  def __init__(self, width, height):
+    StandInView.__init__(self, width, height)
+    self.sliceLogic = None
+
+  def getPhase(self):
+    return self.sliceLogic.GetSliceOffset() * 0.1
+
+class StandInSliceWidget(object):
+  def __init__(self, view, viewNode):
+    self.view = view
+    self.viewNode = viewNode
+
+  def mrmlSliceNode(self):
+    return self.viewNode
+
+  @property
+  def frame(self):
+    # grabbing the slice widget grabs the view
+    return self.view.frame
+
+  def sliceView(self):
+    return self.view
+
+  def sliceLogic(self):
+    return self.view.sliceLogic
+
+class StandInThreeDView(StandInView):
+  YawLeft = 0
+  YawRight = 1
+
+  def __init__(self, width, height, viewNode):
+    StandInView.__init__(self, width, height)
+    self.viewNode = viewNode
+    self.pitchRollYawIncrement = 5.0
+    self.yawDirection = self.YawLeft
+
+  def mrmlViewNode(self):
+    return self.viewNode
+
+  def getCamera(self):
+    return self.window.GetRenderers().GetFirstRenderer().GetActiveCamera()
+
+  def setPitchRollYawIncrement(self, increment):
+    self.pitchRollYawIncrement = increment
+
+  def yaw(self):
+    self.getCamera().Azimuth(self.pitchRollYawIncrement if self.yawDirection == self.YawLeft else -self.pitchRollYawIncrement)
+
+  @property
+  def yawAngle(self):
+    """Rotation angle (in degrees) of the camera around the vertical axis, increased by yawing to the right."""
+    camera = self.getCamera()
+    offset = camera.position - camera.focalPoint
+    return -numpy.degrees(numpy.arctan2(offset[0], -offset[1]))
+
+  def getPhase(self):
+    camera = self.getCamera()
+    direction = camera.focalPoint - camera.position
+    elevation = numpy.arcsin(direction[2] / numpy.linalg.norm(direction))
+    return numpy.radians(self.yawAngle) + 1.7 * elevation + 0.6 * camera.viewUp[0]
+
+class StandInThreeDWidget(object):
+  def __init__(self, view):
+    self.view = view
+
+  def threeDView(self):
+    return self.view
+
+class StandInViewport(StandInView):
+  """Widget that contains all the views. Its content does not change."""
+
+  def getPhase(self):
+    return 0.0
+
+class StandInLayoutManager(object):
+  def __init__(self):
+    self.sliceWidgets = {}
+    self.threeDWidgets = []
+    self.viewportWidget = StandInViewport(48, 36)
+    self.viewportWidget.forceRender()
+
+  def viewport(self):
+    return self.viewportWidget
+
+  def addSliceView(self, layoutName, width, height, sliceOffsetRange=(-100.0, 100.0), sliceSpacing=1.0):
+    """Add a slice view and return its view node."""
+    view = StandInSliceView(width, height)
+    view.sliceLogic = StandInSliceLogic(view, sliceOffsetRange, sliceSpacing)
+    viewNode = StandInSliceNode(layoutName)
+    view.sliceLogic.sliceNode = viewNode
+    self.sliceWidgets[layoutName] = StandInSliceWidget(view, viewNode)
+    return viewNode
+
+  def addThreeDView(self, width, height):
+    """Add a 3D view and return its view node."""
+    viewNode = StandInViewNode("vtkMRMLViewNode", "{0}".format(len(self.threeDWidgets) + 1))
+    self.threeDWidgets.append(StandInThreeDWidget(StandInThreeDView(width, height, viewNode)))
+    return viewNode
+
+  def sliceWidget(self, layoutName):
+    return self.sliceWidgets.get(layoutName)
+
+  def setLayout(self, layout):
+    self.layout = layout
+
+  @property
+  def threeDViewCount(self):
+    return len(self.threeDWidgets)
+
+  def threeDWidget(self, index):
+    return self.threeDWidgets[index]
+
+class StandInLayoutNode(object):
+  SlicerLayoutFourUpView = 3
+  SlicerLayoutOneUpRedSliceView = 6
+
+class StandInMRMLScene(object):
+  def __init__(self, application):
+    self.application = application
+
+  BatchProcessState = 1
+
+  def Clear(self, removeSingletons):
+    self.application.events.append(("clear scene",))
+
+  def StartState(self, state):
+    self.application.events.append(("start state", state))
+
+  def EndState(self, state):
+    self.application.events.append(("end state", state))
+
+  def GetNumberOfNodes(self):
+    return len(self.application.displayNodes)
+
+  def GetNthNode(self, index):
+    return self.application.displayNodes[index]
+
+  def GetFirstNodeByName(self, name):
+    for browserNode in StandInSequenceBrowserNode.instances:
+      if browserNode.name == name:
+        return browserNode
+    return None
+
+class StandInAnnotationsLogic(object):
+  def __init__(self, application):
+    self.application = application
+
+  def CreateSnapShot(self, name, description, screenshotType, scaleFactor, imageData):
+    self.application.events.append(("create snapshot", name, description, screenshotType, imageData))
+
+class StandInQMRMLScreenShotDialog(object):
+  FullLayout = 0
+  ThreeD = 1
+  Red = 2
+  Yellow = 3
+  Green = 4
+
+class StandInApplication(object):
+  def __init__(self):
+    self.manager = StandInLayoutManager()
+    # scene operations (loading, batch processing, snapshots), for checking how the scene is modified
+    self.events = []
+    self.displayNodes = []
+
+  def loadScene(self, filename):
+    self.events.append(("load scene", filename))
+
+  def mainWindow(self):
+    return self.manager.viewport()
+
+  def layoutManager(self):
+    return self.manager
+
+  def processEvents(self):
+    """Call all active timers once (interval is ignored)."""
+    for timer in list(StandInQTimer.activeTimers):
+      if timer.isActive():
+        timer.timeout()
+
+  def addDisplayNode(self, helper=False):
+    """Add a displayable node and its display node to the scene and return the display node. The rendered content
+    does not depend on them, but they are used for detecting scene changes. Helper nodes (such as slice models)
+    are hidden from editors."""
+    displayableNode = StandInDisplayNode("vtkMRMLDisplayableNode{0}".format(len(self.displayNodes) + 1),
+      "vtkMRMLDisplayableNode", hideFromEditors=helper)
+    # display nodes are hidden from editors by default
+    displayNode = StandInDisplayNode("vtkMRMLDisplayNode{0}".format(len(self.displayNodes) + 2),
+      displayableNode=displayableNode, hideFromEditors=True)
+    self.displayNodes.extend([displayableNode, displayNode])
+    return displayNode
+
+  def addSequenceBrowser(self, numberOfItems, name="SequenceBrowser"):
+    """Add a sequence browser node that has a sequence of volumes."""
+    return StandInSequenceBrowserNode(numberOfItems, name)
+
+  def reset(self):
+    self.manager = StandInLayoutManager()
+    self.events = []
+    self.displayNodes = []
+    del StandInSequenceBrowserNode.instances[:]
+    StandInQSettings.values.clear()
+
+#
+# qt
+#
+
+class StandInQImage(object):
+  """Image of a grabbed widget, stored in Format_RGB32 (B, G, R, 255 bytes on little-endian systems)."""
+  Format_RGB32 = 4
+  Format_ARGB32 = 5
+  Format_ARGB32_Premultiplied = 6
+
+  def __init__(self, frame):
+    self.frame = frame
+    rows, columns, _ = frame.shape
+    self.bits = numpy.full((rows, columns, 4), 255, numpy.uint8)
+    self.bits[:, :, 2::-1] = frame
+
+  def format(self):
+    return self.Format_RGB32
+
+  def width(self):
+    return self.frame.shape[1]
+
+  def height(self):
+    return self.frame.shape[0]
+
+  def bytesPerLine(self):
+    return self.frame.shape[1] * 4
+
+  def constBits(self):
+    return memoryview(self.bits.reshape(-1))
+
+class StandInQPixmap(object):
+  def __init__(self, frame=None):
+    self.frame = frame
+
+  def grabWidget(self, view):
+    return StandInQPixmap(view.frame.copy())
+
+  def toImage(self):
+    return StandInQImage(self.frame)
+
+class StandInQTimer(object):
+  activeTimers = []
+
+  def __init__(self):
+    self.interval = 0
+    self.callbacks = []
+
+  def connect(self, signal, callback):
+    self.callbacks.append(callback)
+
+  def setInterval(self, interval):
+    self.interval = interval
+
+  def start(self):
+    if self not in self.activeTimers:
+      self.activeTimers.append(self)
+
+  def stop(self):
+    if self in self.activeTimers:
+      self.activeTimers.remove(self)
+
+  def isActive(self):
+    return self in self.activeTimers
+
+  def timeout(self):
+    for callback in self.callbacks:
+      callback()
+
+class StandInQSettings(object):
+  values = {}
+
+  def contains(self, key):
+    return key in self.values
+
+  def value(self, key):
+    return self.values[key]
+
+  def setValue(self, key, value):
+    self.values[key] = value
+
+class StandInQMRMLUtils(object):
+  def qImageToVtkImageData(self, qimage, imageData):
+    imageData.setFrame(qimage.frame)
+
+#
+# ScriptedLoadableModule
+#
+
+class ScriptedLoadableModule(object):
+  def __init__(self, parent):
+    self.parent = parent
+
+class ScriptedLoadableModuleWidget(object):
+  def __init__(self, parent=None):
+    self.parent = parent
+
+class ScriptedLoadableModuleLogic(object):
+  def __init__(self, parent=None):
+    self.parent = parent
+
+class ScriptedLoadableModuleTest(unittest.TestCase):
+  pass
+
+def install():
+  """Register stand-in slicer, qt, ctk, and vtk modules. Returns the stand-in application (slicer.app).
+  """
+  application = StandInApplication()
+
+  vtkModule = types.ModuleType("vtk")
+  vtkModule.VTK_UNSIGNED_CHAR = VTK_UNSIGNED_CHAR
+  vtkModule.vtkImageData = StandInImageData
+  vtkModule.vtkWindowToImageFilter = StandInWindowToImageFilter
+  vtkModule.vtkCollection = StandInCollection
+  vtkUtilModule = types.ModuleType("vtk.util")
+  numpySupportModule = types.ModuleType("vtk.util.numpy_support")
+  numpySupportModule.vtk_to_numpy = vtk_to_numpy
+  numpySupportModule.numpy_to_vtk = numpy_to_vtk
+  vtkUtilModule.numpy_support = numpySupportModule
+  vtkModule.util = vtkUtilModule
+
+  qtModule = types.ModuleType("qt")
+  qtModule.QPixmap = StandInQPixmap
+  qtModule.QImage = StandInQImage
+  qtModule.QSettings = StandInQSettings
+  qtModule.QTimer = StandInQTimer
+
+  ctkModule = types.ModuleType("ctk")
+
+  slicerModule = types.ModuleType("slicer")
+  slicerModule.app = application
+  slicerModule.qMRMLUtils = StandInQMRMLUtils
+  slicerModule.qMRMLScreenShotDialog = StandInQMRMLScreenShotDialog
+  modulesModule = types.ModuleType("slicer.modules")
+  modulesModule.annotations = types.ModuleType("slicer.modules.annotations")
+  annotationsLogic = StandInAnnotationsLogic(application)
+  modulesModule.annotations.logic = lambda: annotationsLogic
+  slicerModule.modules = modulesModule
+  slicerModule.mrmlScene = StandInMRMLScene(application)
+  slicerModule.vtkMRMLLayoutNode = StandInLayoutNode
+  utilModule = types.ModuleType("slicer.util")
+  utilModule.loadScene = application.loadScene
+  utilModule.mainWindow = application.mainWindow
+  slicerModule.util = utilModule
+  scriptedLoadableModuleModule = types.ModuleType("slicer.ScriptedLoadableModule")
+  for baseClass in [ScriptedLoadableModule, ScriptedLoadableModuleWidget, ScriptedLoadableModuleLogic,
+    ScriptedLoadableModuleTest]:
+    setattr(scriptedLoadableModuleModule, baseClass.__name__, baseClass)
+  slicerModule.ScriptedLoadableModule = scriptedLoadableModuleModule
+
+  sys.modules.update({
+    "vtk": vtkModule,
+    "vtk.util": vtkUtilModule,
+    "vtk.util.numpy_support": numpySupportModule,
+    "qt": qtModule,
+    "ctk": ctkModule,
+    "slicer": slicerModule,
+    "slicer.ScriptedLoadableModule": scriptedLoadableModuleModule,
+    "slicer.util": utilModule,
+    })
+  return application